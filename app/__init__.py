@@ -1,9 +1,12 @@
+import atexit
 import logging
-from logging.handlers import SMTPHandler, RotatingFileHandler
+from logging.handlers import SMTPHandler, RotatingFileHandler, QueueHandler, QueueListener
 import os
+from queue import Queue
 from flask import Flask, request, current_app
+from flask.logging import default_handler
 from config import Config
-from flask_sqlalchemy import SQLAlchemy
+from app.database import engine_options, sqlite_pragmas, apply_sqlite_pragmas, include_object, RoutingSQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_mail import Mail
@@ -14,10 +17,17 @@ from flask_moment import Moment
 app = Flask(__name__, static_url_path="/inventory/static", static_folder=os.path.abspath("static/"))
 # This is for your config file
 app.config.from_object(Config)
-# Instantiates the database object
-db = SQLAlchemy(app)
-# Instantiates the migration object
-migrate = Migrate(app, db)
+# Sets the connection pool and, for SQLite, the pragmas from your config file
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(engine_options(app.config),
+                                               **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+# Registers the read replicas from your config file as the binds replica0, replica1, ...
+app.config['SQLALCHEMY_BINDS'] = dict(app.config.get('SQLALCHEMY_BINDS') or {}, **{
+    'replica{}'.format(number): url for number, url in enumerate(app.config['DATABASE_REPLICA_URLS'])})
+# Instantiates the database object. Its session sends the reads of routed views to a replica.
+db = RoutingSQLAlchemy(app)
+apply_sqlite_pragmas(db.engine, sqlite_pragmas(app.config))
+# Instantiates the migration object. Autogenerate leaves the old device tables alone.
+migrate = Migrate(app, db, include_object=include_object)
 # Instantiates the login object and view
 login = LoginManager(app)
 login.login_view = 'login'
@@ -25,13 +35,23 @@ login.login_view = 'login'
 mail = Mail(app)
 # Instantiates the bootstrap object so it can be used throughout your templates
 bootstrap = Bootstrap(app)
-# Although I already have a parameter for this in my config file, I decided to give it a value in the
-# init.py module. This allows me to see changes within my templates without clearing the cache files
-# in my browser
-app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
 # Instantiates the moment object from the moment.js module
 moment = Moment(app)
 
+
+# Hands log records to the listener thread as they are. Log calls pass plain values as
+# %-style arguments, so the message is only built by the listener, and not at all when
+# the level is disabled.
+class LogQueueHandler(QueueHandler):
+    def prepare(self, record):
+        return record
+
+
+# Records of the committed changes made through the forms. They go to logs/commit.log
+# and, like every app.logger record, to logs/inventory.log.
+audit_log = logging.getLogger(app.logger.name + '.audit')
+log_handlers = []
+
 # Used to build your Mail server to send passwords to your users
 if not app.debug:
         if app.config['MAIL_SERVER']:            
@@ -47,19 +67,38 @@ if not app.debug:
                     toaddrs=app.config['ADMINS'], subject='MIS Inventory Failure',
                     credentials=auth, secure=secure)
             mail_handler.setLevel(logging.ERROR)
-            app.logger.addHandler(mail_handler)
+            log_handlers.append(mail_handler)
         # This is for building your logs
         if not os.path.exists('logs'):
             os.mkdir('logs')
-        file_handler = RotatingFileHandler('logs/inventory.log', maxBytes=10240,
-                                           backupCount=10)
+        file_handler = RotatingFileHandler('logs/inventory.log', maxBytes=app.config['LOG_MAX_BYTES'],
+                                           backupCount=app.config['LOG_BACKUP_COUNT'])
         file_handler.setFormatter(logging.Formatter(
             '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
         file_handler.setLevel(logging.INFO)
-        app.logger.addHandler(file_handler)
+        log_handlers.append(file_handler)
+
+if not os.path.exists('logs'):
+    os.mkdir('logs')
+commit_handler = RotatingFileHandler('logs/commit.log', maxBytes=app.config['LOG_MAX_BYTES'],
+                                     backupCount=app.config['LOG_BACKUP_COUNT'])
+commit_handler.setFormatter(logging.Formatter(
+    '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
+commit_handler.addFilter(logging.Filter(audit_log.name))
+log_handlers.append(commit_handler)
 
-        app.logger.setLevel(logging.INFO)
-        app.logger.info('IT Inventory DB startup')
+# Requests only put records on the queue. The listener thread formats them and does the
+# console output, file writes, rotation and error mails, and drains the queue when the
+# process exits. Flask's own stderr handler moves to the listener for that reason.
+app.logger.removeHandler(default_handler)
+log_handlers.append(default_handler)
+log_queue = Queue()
+log_listener = QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+app.logger.addHandler(LogQueueHandler(log_queue))
+app.logger.setLevel(logging.INFO)
+log_listener.start()
+atexit.register(log_listener.stop)
+app.logger.info('IT Inventory DB startup')
 
 # Used for circular dependency
-from app import routes, models, errors, tables
+from app import static_files, routes, models, errors, tables, cli
@@ -0,0 +1,73 @@
+import atexit
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+from sqlalchemy import bindparam, or_
+from sqlalchemy.orm.attributes import set_committed_value
+from app import app, db
+from app.models import User
+
+
+# Keeps track of when users were last active without writing to the database on every
+# request. Activity is buffered in memory and written back in one batched UPDATE every
+# LAST_SEEN_FLUSH_INTERVAL seconds, and once more when the process exits.
+class LastSeenTracker(object):
+    def __init__(self, app):
+        self.granularity = timedelta(minutes=app.config['LAST_SEEN_GRANULARITY'])
+        self.interval = app.config['LAST_SEEN_FLUSH_INTERVAL']
+        self.pending = {}
+        self.lock = Lock()
+        self.stopped = Event()
+        self.worker = None
+        atexit.register(self.shutdown)
+
+    # Records that a user was seen. Nothing is buffered while the stored value is still
+    # within the configured granularity, so most requests never touch the buffer at all.
+    def touch(self, user, now=None):
+        now = now or datetime.utcnow()
+        if user.last_seen is not None and now - user.last_seen < self.granularity:
+            return
+        # Updates the loaded object without marking it dirty, so the next commit made by
+        # a view does not turn this back into a write.
+        set_committed_value(user, 'last_seen', now)
+        with self.lock:
+            self.pending[user.id] = now
+        if not self.interval:
+            self.flush()
+        elif self.worker is None:
+            self.start()
+
+    # Writes every buffered timestamp in a single executemany UPDATE. The WHERE clause
+    # keeps a slower worker process from moving a value backwards.
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        table = User.__table__
+        statement = table.update()\
+            .where(table.c.id == bindparam('user_id'))\
+            .where(or_(table.c.last_seen == None, table.c.last_seen < bindparam('seen')))\
+            .values(last_seen=bindparam('seen'))
+        with db.engine.begin() as connection:
+            connection.execute(statement, [{'user_id': user_id, 'seen': seen}
+                                           for user_id, seen in pending.items()])
+
+    def start(self):
+        with self.lock:
+            if self.worker is None:
+                self.worker = Thread(target=self.run, name='last-seen-flush', daemon=True)
+                self.worker.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception('Could not flush last seen timestamps')
+
+    def shutdown(self):
+        self.stopped.set()
+        self.flush()
+
+
+last_seen_tracker = LastSeenTracker(app)
@@ -0,0 +1,228 @@
+import gzip
+import json
+from datetime import datetime
+from flask import request
+from werkzeug.datastructures import MultiDict
+from app import app, db
+from app.models import Users, Asset, CheckOut, Toner
+from app.forms import ImportRowForm, AssetForm, TonerForm
+from app.pagination import KeysetPage
+from app.importer import DEVICE_COLUMNS
+
+
+# One table served by the JSON API. fields are the columns a client may read, in order,
+# and writable the ones it may send; the key is always included and keys the pages. tag
+# is the column that tags=... looks up and filters maps query string arguments to
+# functions returning a criterion. Rows are validated with form, whose fields carry the
+# column names, and checked against the unique columns and the references, a map from
+# column name to the column it refers to, for the whole batch at once. A table without a
+# form is read-only. With natural_key the client chooses the key of new rows.
+class Resource(object):
+    def __init__(self, model, key, fields, writable=(), form=None, tag=None, filters=None, unique=(),
+                 references=None, natural_key=False, create=None):
+        self.model = model
+        self.key = key
+        self.columns = dict((name, getattr(model, name)) for name in fields)
+        self.fields = list(fields)
+        self.writable = list(writable)
+        self.form = form
+        self.tag = tag
+        self.filters = filters or {}
+        self.unique = list(unique)
+        self.references = references or {}
+        self.natural_key = natural_key
+        self.create = create or (lambda values: model(**values))
+
+
+# New employees get the same blank devices as on the import form, two monitors and one of
+# every other kind, which the edit view expects to find.
+def _create_employee(values):
+    employee = Users(**values)
+    for model, fields in DEVICE_COLUMNS:
+        device = model()
+        for column in fields:
+            setattr(device, column, '')
+        device.employee = employee
+    return employee
+
+
+def _create_asset(values):
+    asset = Asset.class_of(values['type'])()
+    for name, value in values.items():
+        setattr(asset, name, value)
+    return asset
+
+
+EMPLOYEE_FIELDS = ['employee_id', 'username', 'first_name', 'last_name', 'email', 'room_number']
+ASSET_FIELDS = ['asset_id', 'type', 'name', 'serial_number', 'asset_tag', 'employee_id']
+CHECKOUT_FIELDS = ['check_out_id', 'checkout_timestamp', 'checkout_username', 'checkout_item_name',
+                   'checkout_serial_number', 'checkout_asset_tag', 'checked_in_at']
+TONER_FIELDS = ['toner_id', 'toner_model', 'toner_cartridge', 'toner_color', 'toner_quantity',
+                'toner_reorder_threshold']
+
+# The devices and inventory items share one resource, told apart by type. Checkouts are
+# read-only here; loans are written through /checkouts and /checkins.
+RESOURCES = {
+    'employees': Resource(Users, Users.employee_id, EMPLOYEE_FIELDS, EMPLOYEE_FIELDS, ImportRowForm,
+                          filters={'room_number': lambda value: Users.room_number == value},
+                          unique=['username', 'email'], natural_key=True, create=_create_employee),
+    'assets': Resource(Asset, Asset.asset_id, ASSET_FIELDS, ASSET_FIELDS[1:], AssetForm, Asset.asset_tag,
+                       filters={'type': lambda value: Asset.type == value,
+                                'employee_id': lambda value: Asset.employee_id == int(value)},
+                       references={'employee_id': Users.employee_id}, create=_create_asset),
+    'checkouts': Resource(CheckOut, CheckOut.check_out_id, CHECKOUT_FIELDS, tag=CheckOut.checkout_asset_tag,
+                          filters={'open': lambda value: CheckOut.is_open() if value == '1'
+                                   else CheckOut.checked_in_at != None,
+                                   'username': lambda value: CheckOut.checkout_username == value}),
+    'toner': Resource(Toner, Toner.toner_id, TONER_FIELDS, TONER_FIELDS[1:], TonerForm,
+                      filters={'toner_model': lambda value: Toner.toner_model == value}),
+}
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+# Returns payload as a JSON response, gzip compressed when the client accepts it and the
+# body is large enough for compression to pay off.
+def api_response(payload, status=200):
+    body = json.dumps(payload, default=_json_value, separators=(',', ':')).encode('utf-8')
+    response = app.response_class(body, status=status, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if len(body) >= app.config['API_GZIP_MIN_SIZE'] and request.accept_encodings['gzip']:
+        response.set_data(gzip.compress(body, 6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def _list(value, convert=str):
+    items = [item for item in value.split(',') if item] if value else []
+    if len(items) > app.config['API_BATCH_LIMIT']:
+        raise ValueError('At most {} values may be given at a time'.format(app.config['API_BATCH_LIMIT']))
+    return [convert(item) for item in items]
+
+
+# Returns one page of rows of a resource as dicts, and the cursor of the next page or None,
+# for the query string arguments:
+#   ids=1,2,3 or tags=A,B    only these rows, at most API_BATCH_LIMIT of them
+#   fields=name,asset_tag    only these fields, besides the key
+#   <filter>=<value>         only the rows matching the resource's filter
+#   limit=100, after=<next>  the page size and where the page starts
+# A page is one indexed range query on the key, so a nightly sync walking the whole table
+# costs the same per page however far it gets. Raises ValueError for invalid arguments.
+def fetch(resource, args):
+    fields = _list(args.get('fields')) or resource.fields
+    unknown = [name for name in fields if name not in resource.columns]
+    if unknown:
+        raise ValueError('Unknown fields: {}'.format(', '.join(unknown)))
+    fields = [resource.key.key] + [name for name in fields if name != resource.key.key]
+    query = db.session.query(*[resource.columns[name] for name in fields])
+    ids = _list(args.get('ids'), resource.key.type.python_type)
+    if ids:
+        query = query.filter(resource.key.in_(ids))
+    tags = _list(args.get('tags'))
+    if tags:
+        if resource.tag is None:
+            raise ValueError('This resource has no tags')
+        query = query.filter(resource.tag.in_(tags))
+    for name, criterion in resource.filters.items():
+        if name in args:
+            query = query.filter(criterion(args[name]))
+    limit = min(args.get('limit', app.config['API_PAGE_SIZE'], type=int), app.config['API_PAGE_SIZE'])
+    page = KeysetPage(query, resource.key, resource.key, max(limit, 1), after=args.get('after'))
+    return [dict(zip(fields, row)) for row in page.items], page.next_cursor if page.has_next else None
+
+
+def _value(column, value):
+    if column.type.python_type is int:
+        return int(value) if value not in (None, '') else None
+    return value
+
+
+# Validates a row merged onto the stored values of the row it updates, so a client only
+# sends the fields it changes. Returns the values to write and the errors by field.
+def _validate(resource, row, obj):
+    values = dict((name, getattr(obj, name)) for name in resource.writable) if obj is not None else {}
+    values.update((name, value) for name, value in row.items() if name in resource.writable)
+    form = resource.form(formdata=MultiDict([(name, str(value)) for name, value in values.items()
+                                             if value is not None]), meta={'csrf': False})
+    form.validate()
+    errors = dict(form.errors)
+    unknown = [name for name in row if name not in resource.writable and name != resource.key.key]
+    if unknown:
+        errors['fields'] = ['Unknown fields: {}'.format(', '.join(sorted(unknown)))]
+    if obj is not None and 'type' in resource.writable and form.type.data != obj.type:
+        errors['type'] = ['The type of an asset cannot be changed.']
+    if errors:
+        return None, errors
+    values = dict((name, _value(resource.columns[name], form[name].data)) for name in resource.writable)
+    return values, errors
+
+
+# Checks the unique columns and the references of a whole batch with one query per
+# column, adding to the errors by row index.
+def _check_batch(resource, rows, errors):
+    for name in resource.unique:
+        column = resource.columns[name]
+        owners = {}
+        for index, values in rows.items():
+            if values[name] is None:
+                continue
+            if values[name] in owners:
+                errors.setdefault(index, {})[name] = ['{} appears twice in this batch.'.format(values[name])]
+            owners.setdefault(values[name], values[resource.key.key])
+        taken = dict(db.session.query(column, resource.key).filter(column.in_(list(owners))))
+        for index, values in rows.items():
+            if values[name] in taken and taken[values[name]] != values[resource.key.key]:
+                errors.setdefault(index, {})[name] = ['{} is already in use.'.format(values[name])]
+    for name, target in resource.references.items():
+        wanted = set(values[name] for values in rows.values() if values[name] is not None)
+        known = set(row[0] for row in db.session.query(target).filter(target.in_(list(wanted)))) if wanted else set()
+        for index, values in rows.items():
+            if values[name] is not None and values[name] not in known:
+                errors.setdefault(index, {})[name] = ['{} does not exist.'.format(values[name])]
+
+
+# Creates and updates the given rows of a resource in the session's transaction, for the
+# caller to commit, so the whole batch is written or none of it. Rows carrying the key of
+# a stored row update it; the others are created. The stored rows are loaded with one
+# query and every row is validated with the resource's form before anything is written.
+# Returns the key of each row and whether it was created, or None and the errors by row
+# index when a row is invalid.
+def upsert(resource, rows):
+    key = resource.key.key
+    keys = set(row.get(key) for row in rows if isinstance(row, dict) and row.get(key) is not None)
+    stored = dict((getattr(obj, key), obj) for obj in
+                  resource.model.query.filter(resource.key.in_(list(keys)))) if keys else {}
+    errors, valid = {}, {}
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors[index] = {'row': ['Expected an object.']}
+            continue
+        obj = stored.get(row.get(key))
+        if obj is None and row.get(key) is not None and not resource.natural_key:
+            errors[index] = {key: ['{} does not exist.'.format(row[key])]}
+            continue
+        values, row_errors = _validate(resource, row, obj)
+        if row_errors:
+            errors[index] = row_errors
+            continue
+        values.setdefault(key, getattr(obj, key) if obj is not None else None)
+        valid[index] = values
+    _check_batch(resource, valid, errors)
+    if errors:
+        return None, [{'index': index, 'errors': errors[index]} for index in sorted(errors)]
+    written = []
+    for index, values in valid.items():
+        obj = stored.get(values[key])
+        if obj is None:
+            obj = resource.create(dict((name, value) for name, value in values.items() if value is not None))
+            db.session.add(obj)
+        else:
+            for name in resource.writable:
+                setattr(obj, name, values[name])
+        written.append((obj, values[key] not in stored))
+    db.session.flush()
+    return [{key: getattr(obj, key), 'created': created} for obj, created in written], None
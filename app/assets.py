@@ -0,0 +1,131 @@
+from sqlalchemy import and_, event, inspect, null, select
+from app import db
+from app.models import Users, Asset, Other, CheckOut, AssetTag
+
+# Registry entries are kinded by asset type. Devices are held by the employee they are
+# assigned to, inventory items through checkouts.
+ITEM = Other.__mapper__.polymorphic_identity
+
+# Marks a claim that leaves the current holder of the tag in place
+KEEP = object()
+
+# How many registry rows are written per statement during a rebuild
+REBUILD_BATCH = 500
+
+
+# Maps every asset tag to the row that owns it and the employee holding it. Tags are
+# unique in the registry: when two rows carry the same tag, the row written last owns it.
+class AssetRegistry(object):
+    def find(self, tag):
+        return AssetTag.query.filter_by(tag=tag).first() if tag else None
+
+    # Returns the registry entry of a tag together with the employee holding it, or
+    # (None, None) when the tag is unknown.
+    def holder(self, tag):
+        row = db.session.query(AssetTag, Users).outerjoin(Users, Users.employee_id == AssetTag.employee_id)\
+            .filter(AssetTag.tag == tag).first() if tag else None
+        return row if row is not None else (None, None)
+
+    # Points tag at the given row, taking it over from any other row that used it. A row
+    # whose tag was cleared is removed from the registry.
+    def claim(self, connection, kind, row_id, tag, employee_id=KEEP):
+        table = AssetTag.__table__
+        owner = and_(table.c.kind == kind, table.c.row_id == row_id)
+        if not tag:
+            connection.execute(table.delete().where(owner))
+            return
+        connection.execute(table.delete().where(table.c.tag == tag).where(~owner))
+        values = {'tag': tag}
+        if employee_id is not KEEP:
+            values['employee_id'] = employee_id
+        if connection.execute(table.update().where(owner).values(**values)).rowcount == 0:
+            values.setdefault('employee_id', None)
+            connection.execute(table.insert().values(kind=kind, row_id=row_id, **values))
+
+    def release(self, connection, kind, row_id):
+        table = AssetTag.__table__
+        connection.execute(table.delete().where(table.c.kind == kind).where(table.c.row_id == row_id))
+
+    # Records the employee inventory items are checked out to, or clears it on check in.
+    def hold(self, connection, tags, username=None):
+        table = AssetTag.__table__
+        employee = select([Users.employee_id]).where(Users.username == username).as_scalar() \
+            if username else null()
+        connection.execute(table.update().where(table.c.tag.in_(tags)).where(table.c.kind == ITEM)
+                           .values(employee_id=employee))
+
+    # Returns registry rows for every tagged asset, or only for the devices of the given
+    # employees, read with one query.
+    def entries(self, connection, employee_ids=None):
+        entries = {}
+        query = select([Asset.type, Asset.asset_id, Asset.asset_tag, Asset.employee_id])\
+            .where(Asset.asset_tag != None).where(Asset.asset_tag != '').order_by(Asset.asset_id)
+        if employee_ids is not None:
+            query = query.where(Asset.employee_id.in_(employee_ids))
+        for row in connection.execute(query):
+            entries[row[2]] = {'kind': row[0], 'row_id': row[1], 'tag': row[2],
+                               'employee_id': row[3] if row[0] != ITEM else None}
+        return list(entries.values())
+
+    # Registers the devices of the given employees in bulk. Used by the importer, which
+    # writes device rows without going through the session.
+    def register_employees(self, connection, employee_ids):
+        table = AssetTag.__table__
+        entries = self.entries(connection, employee_ids)
+        for start in range(0, len(entries), REBUILD_BATCH):
+            batch = entries[start:start + REBUILD_BATCH]
+            connection.execute(table.delete().where(table.c.tag.in_([entry['tag'] for entry in batch])))
+            connection.execute(table.insert(), batch)
+
+    # Rebuilds the registry from the asset table and open checkouts. Used after bulk
+    # loads that bypass the ORM.
+    def rebuild(self):
+        table = AssetTag.__table__
+        with db.engine.begin() as connection:
+            connection.execute(table.delete())
+            entries = self.entries(connection)
+            for start in range(0, len(entries), REBUILD_BATCH):
+                connection.execute(table.insert(), entries[start:start + REBUILD_BATCH])
+            holder = select([Users.employee_id])\
+                .where(Users.username == CheckOut.checkout_username)\
+                .where(CheckOut.checkout_asset_tag == table.c.tag).where(CheckOut.is_open()).limit(1).as_scalar()
+            connection.execute(table.update().where(table.c.kind == ITEM).values(employee_id=holder))
+
+
+asset_registry = AssetRegistry()
+
+
+def _changed(obj, *attributes):
+    state = inspect(obj)
+    return any(state.attrs[attribute].history.has_changes() for attribute in attributes)
+
+
+# Mirrors inserted, edited and deleted devices, inventory items and checkouts into the
+# registry on the flush's own connection, so it commits or rolls back with the change.
+@event.listens_for(db.session, 'after_flush')
+def update_asset_registry(session, flush_context):
+    connection = session.connection()
+    for obj in session.new:
+        if isinstance(obj, Asset):
+            asset_registry.claim(connection, obj.type, obj.asset_id, obj.asset_tag,
+                                 obj.employee_id if obj.type != ITEM else KEEP)
+    for obj in session.dirty:
+        if isinstance(obj, Asset) and _changed(obj, 'asset_tag', 'employee_id'):
+            asset_registry.claim(connection, obj.type, obj.asset_id, obj.asset_tag,
+                                 obj.employee_id if obj.type != ITEM else KEEP)
+    for obj in session.deleted:
+        if isinstance(obj, Asset):
+            asset_registry.release(connection, obj.type, obj.asset_id)
+    # Checkouts are written with one statement per employee, so a batch check out or check
+    # in costs a single registry update.
+    held = {}
+    for obj in session.new:
+        if isinstance(obj, CheckOut):
+            held.setdefault(obj.checkout_username, []).append(obj.checkout_asset_tag)
+    for username, tags in held.items():
+        asset_registry.hold(connection, tags, username)
+    returned = [obj.checkout_asset_tag for obj in session.deleted if isinstance(obj, CheckOut)] + \
+        [obj.checkout_asset_tag for obj in session.dirty
+         if isinstance(obj, CheckOut) and obj.checked_in_at is not None and _changed(obj, 'checked_in_at')]
+    if returned:
+        asset_registry.hold(connection, returned)
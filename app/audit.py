@@ -0,0 +1,156 @@
+import atexit
+import json
+from datetime import datetime
+from threading import Event, Lock, Thread
+from flask import has_request_context
+from flask_login import current_user
+from sqlalchemy import event, inspect
+from app import app, db
+from app.models import AuditEvent, SearchDocument, AssetTag, ReplicaHeartbeat, CheckOutArchive
+from app.counts import row_counts
+from app.responses import table_versions
+
+CREATE, UPDATE, DELETE = 'create', 'update', 'delete'
+
+# Tables derived from the others, which are not audited themselves
+IGNORED = {AuditEvent.__tablename__, SearchDocument.__tablename__, AssetTag.__tablename__,
+           ReplicaHeartbeat.__tablename__, CheckOutArchive.__tablename__}
+# Columns whose changes are recorded without their values
+REDACTED = {'password_hash'}
+
+
+# Collects the audit events of committed transactions and writes them to the audit_event
+# table in batches, off the request path: every AUDIT_FLUSH_INTERVAL seconds, as soon as
+# AUDIT_BATCH_SIZE events are waiting, and once more when the process exits.
+class AuditTrail(object):
+    def __init__(self, app):
+        self.interval = app.config['AUDIT_FLUSH_INTERVAL']
+        self.batch_size = app.config['AUDIT_BATCH_SIZE']
+        self.pending = []
+        self.lock = Lock()
+        self.wake = Event()
+        self.stopped = False
+        self.worker = None
+        atexit.register(self.shutdown)
+
+    def add(self, events):
+        with self.lock:
+            self.pending.extend(events)
+            full = len(self.pending) >= self.batch_size
+        if not self.interval:
+            self.flush()
+        elif self.worker is None:
+            self.start()
+        elif full:
+            self.wake.set()
+
+    # Writes every waiting event with executemany INSERTs in one transaction. When the write
+    # fails, the events go back to the front of the queue, in order, for the next flush.
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return
+        try:
+            with db.engine.begin() as connection:
+                for start in range(0, len(pending), self.batch_size):
+                    connection.execute(AuditEvent.__table__.insert(), pending[start:start + self.batch_size])
+        except Exception:
+            with self.lock:
+                self.pending[:0] = pending
+            raise
+        row_counts.adjust({AuditEvent.__tablename__: len(pending)})
+        table_versions.bump([AuditEvent.__tablename__])
+
+    def start(self):
+        with self.lock:
+            if self.worker is None:
+                self.worker = Thread(target=self.run, name='audit-flush', daemon=True)
+                self.worker.start()
+
+    def run(self):
+        while not self.stopped:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception('Could not write audit events')
+
+    def shutdown(self):
+        self.stopped = True
+        self.wake.set()
+        self.flush()
+
+
+audit_trail = AuditTrail(app)
+
+
+# The user making the change, or None for changes made outside a request such as the
+# flask commands.
+def actor():
+    if has_request_context() and current_user.is_authenticated:
+        return current_user.username
+    return None
+
+
+def make_event(action, entity, entity_id, changes):
+    return {'timestamp': datetime.utcnow(), 'actor': actor(), 'action': action, 'entity': entity,
+            'entity_id': entity_id, 'changes': json.dumps(changes, default=str, sort_keys=True)}
+
+
+def _value(key, value):
+    return '[redacted]' if key in REDACTED and value is not None else value
+
+
+# All column values of a created or deleted row, read from the loaded state so nothing is
+# fetched in the middle of a flush.
+def _values(state):
+    return {attr.key: _value(attr.key, state.dict.get(attr.key)) for attr in state.mapper.column_attrs}
+
+
+# The [old, new] values of the columns changed on an updated row.
+def _changes(state):
+    changes = {}
+    for attr in state.mapper.column_attrs:
+        history = state.attrs[attr.key].history
+        if history.has_changes():
+            changes[attr.key] = [_value(attr.key, history.deleted[0] if history.deleted else None),
+                                 _value(attr.key, history.added[0] if history.added else None)]
+    return changes
+
+
+# Records the rows each flush created, updated or deleted. The events are held on the
+# session until the transaction commits and dropped if it rolls back.
+@event.listens_for(db.session, 'after_flush')
+def collect_audit_events(session, flush_context):
+    events = session.info.setdefault('audit_events', [])
+    for objects, action in ((session.new, CREATE), (session.dirty, UPDATE), (session.deleted, DELETE)):
+        for obj in objects:
+            state = inspect(obj)
+            if state.mapper.local_table.name in IGNORED:
+                continue
+            # Rows of the asset table are recorded under their type, the device table's name
+            entity = state.mapper.polymorphic_identity or state.mapper.local_table.name
+            changes = _changes(state) if action == UPDATE else _values(state)
+            if changes:
+                events.append(make_event(action, entity, state.mapper.primary_key_from_instance(obj)[0],
+                                         changes))
+
+
+# Adds the events of changes made with bulk statements, which the flush does not see, to
+# the session's transaction.
+def record_events(session, events):
+    session.info.setdefault('audit_events', []).extend(events)
+
+
+@event.listens_for(db.session, 'after_commit')
+def write_audit_events(session):
+    events = session.info.pop('audit_events', None)
+    if events:
+        audit_trail.add(events)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_audit_events(session):
+    session.info.pop('audit_events', None)
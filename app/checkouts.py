@@ -0,0 +1,100 @@
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import select
+from app import app, db
+from app.models import Other, CheckOut, CheckOutArchive, AssetTag
+from app.assets import ITEM
+from app.counts import row_counts
+from app.responses import table_versions
+
+OK, CHECKED_OUT, NOT_CHECKED_OUT, UNKNOWN = 'ok', 'already out', 'not out', 'unknown'
+
+
+# The distinct, non-empty tags of a scan in the order they were scanned, so a tag read
+# twice by the scanner is only handled once.
+def scanned_tags(tags):
+    return list(OrderedDict((tag.strip(), None) for tag in tags if tag and tag.strip()))
+
+
+def result(tag, status, item=None):
+    return {'tag': tag, 'status': status, 'item': item}
+
+
+# Checks the inventory items with the given tags out to employee. The tags are resolved
+# with one IN (...) query on the asset registry and one on the items, and the checkouts
+# are added to the session for the caller to commit in one transaction. Returns a result
+# per tag: ok, already out or unknown.
+def check_out(tags, employee):
+    tags = scanned_tags(tags)
+    entries = dict((entry.tag, entry) for entry in AssetTag.query.filter(AssetTag.tag.in_(tags))) if tags else {}
+    free = [entries[tag].row_id for tag in tags
+            if tag in entries and entries[tag].kind == ITEM and entries[tag].employee_id is None]
+    items = dict((item.others_id, item) for item in Other.query.filter(Other.others_id.in_(free))) if free else {}
+    timestamp = datetime.utcnow()
+    results = []
+    for tag in tags:
+        entry = entries.get(tag)
+        if entry is None or entry.kind != ITEM or (entry.employee_id is None and entry.row_id not in items):
+            results.append(result(tag, UNKNOWN))
+        elif entry.employee_id is not None:
+            results.append(result(tag, CHECKED_OUT))
+        else:
+            item = items[entry.row_id]
+            db.session.add(CheckOut(checkout_timestamp=timestamp,
+                                    checkout_username=employee.username,
+                                    checkout_item_name=item.other_item_name,
+                                    checkout_serial_number=item.other_serial_number,
+                                    checkout_asset_tag=tag))
+            results.append(result(tag, OK, item.other_item_name))
+    return results
+
+
+# Checks the inventory items with the given tags back in, with one IN (...) query on the
+# asset registry and one on the open loans. The loans are closed in the session for the
+# caller to commit in one transaction. Returns a result per tag: ok, not out or unknown.
+def check_in(tags):
+    tags = scanned_tags(tags)
+    timestamp = datetime.utcnow()
+    known = set(tag for tag, in db.session.query(AssetTag.tag).filter(AssetTag.kind == ITEM, AssetTag.tag.in_(tags))) \
+        if tags else set()
+    loans = {}
+    for loan in (CheckOut.query.filter(CheckOut.is_open(), CheckOut.checkout_asset_tag.in_(tags)) if tags else []):
+        loans.setdefault(loan.checkout_asset_tag, []).append(loan)
+    results = []
+    for tag in tags:
+        if tag in loans:
+            for loan in loans[tag]:
+                loan.checked_in_at = timestamp
+            results.append(result(tag, OK, loans[tag][0].checkout_item_name))
+        else:
+            results.append(result(tag, NOT_CHECKED_OUT if tag in known else UNKNOWN))
+    return results
+
+
+# Moves the loans checked in before the given time from check_out to check_out_archive,
+# oldest first, in transactions of CHECKOUT_ARCHIVE_BATCH loans. Returns how many were
+# moved.
+def archive_loans(before):
+    ledger, archive = CheckOut.__table__, CheckOutArchive.__table__
+    columns = [column for column in ledger.c if column.name in archive.c]
+    moved = 0
+    try:
+        while True:
+            with db.engine.begin() as connection:
+                loans = connection.execute(
+                    select(columns).where(ledger.c.checked_in_at < before)
+                    .order_by(ledger.c.checked_in_at, ledger.c.check_out_id)
+                    .limit(app.config['CHECKOUT_ARCHIVE_BATCH'])).fetchall()
+                if not loans:
+                    break
+                connection.execute(archive.insert(), [
+                    dict(loan, period=loan.checked_in_at.year * 100 + loan.checked_in_at.month) for loan in loans])
+                connection.execute(ledger.delete().where(
+                    ledger.c.check_out_id.in_([loan.check_out_id for loan in loans])))
+            moved += len(loans)
+    finally:
+        if moved:
+            for table in (ledger.name, archive.name):
+                row_counts.invalidate(table)
+            table_versions.bump([ledger.name, archive.name])
+    return moved
@@ -0,0 +1,153 @@
+import os
+import time
+from datetime import datetime, timedelta
+import click
+from app import app, db
+from app.search import search_index
+from app.assets import asset_registry
+from app.importer import import_employees, READERS
+from app.exporter import export, DATASETS, FORMATS
+from app.replicas import replica_set
+from app.static_files import static_manifest, brotli
+from app.checkouts import archive_loans
+from app.migration import migrate_assets, drop_legacy_tables
+from app.employees import delete_employees
+from app.models import Users
+
+
+# Maintenance commands, available as "flask inventory <command>".
+@app.cli.group()
+def inventory():
+    """Inventory maintenance commands."""
+    pass
+
+
+@inventory.command()
+def reindex():
+    """Rebuild the full text search index and the asset tag registry."""
+    search_index.reindex()
+    asset_registry.rebuild()
+    click.echo('Search index and asset registry rebuilt.')
+
+
+@inventory.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'format', type=click.Choice(sorted(READERS)),
+              help='File format, taken from the file extension by default.')
+@click.option('--batch-size', type=int, help='Employees written per transaction.')
+def import_file(path, format, batch_size):
+    """Import employees and their equipment from a CSV or JSONL file."""
+    format = format or os.path.splitext(path)[1].lstrip('.').lower()
+    if format not in READERS:
+        raise click.BadParameter('cannot tell the format of {}, use --format'.format(path))
+    with open(path, newline='', encoding='utf-8-sig') as lines:
+        report = import_employees(lines, format, batch_size)
+    for line, message in report.errors:
+        click.echo('Line {}: {}'.format(line, message), err=True)
+    click.echo('{} employees imported, {} rows rejected.'.format(report.imported, len(report.errors)))
+
+
+@inventory.command('export')
+@click.argument('dataset', type=click.Choice(sorted(DATASETS)))
+@click.option('--format', 'format', type=click.Choice(sorted(FORMATS)), default='csv')
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip.')
+@click.option('--output', '-o', type=click.File('wb'), default='-', help='File to write, stdout by default.')
+def export_file(dataset, format, compress, output):
+    """Export employees, items, checkouts or toner as CSV or JSONL."""
+    for chunk in export(dataset, format, compress):
+        output.write(chunk)
+
+
+@inventory.command()
+@click.option('--interval', type=float, default=0,
+              help='Keep syncing every this many seconds instead of once.')
+def replicate(interval):
+    """Copy the SQLite database over the SQLite read replicas, standing in for replication."""
+    if not replica_set:
+        raise click.ClickException('No replicas configured, set DATABASE_REPLICA_URLS.')
+    while True:
+        try:
+            replica_set.sync()
+        except RuntimeError as error:
+            raise click.ClickException(str(error))
+        click.echo('Synced {} replica(s).'.format(len(replica_set.keys)))
+        if not interval:
+            break
+        time.sleep(interval)
+
+
+@inventory.command('compress-static')
+def compress_static():
+    """Write gzip (and, with the brotli package, brotli) copies of the static files."""
+    written = static_manifest.compress()
+    click.echo('Wrote {} compressed file(s).'.format(written))
+    if brotli is None:
+        click.echo('Install the brotli package to also write brotli copies.')
+
+
+@inventory.command('archive-checkouts')
+@click.option('--days', type=int, help='Archive loans checked in more than this many days ago.')
+def archive_checkouts(days):
+    """Move loans checked in long ago from the checkout ledger to its archive."""
+    days = app.config['CHECKOUT_ARCHIVE_AFTER'] if days is None else days
+    moved = archive_loans(datetime.utcnow() - timedelta(days=days))
+    click.echo('Archived {} loan(s).'.format(moved))
+
+
+@inventory.command('migrate-assets')
+@click.option('--batch-size', type=int, help='Employees, or leftover rows, moved per transaction.')
+def migrate_assets_command(batch_size):
+    """Move the rows of the old per-kind device tables into the asset table.
+
+    Run "flask db upgrade" first and stop the application while it runs.
+    """
+    try:
+        moved = migrate_assets(batch_size)
+    except RuntimeError as error:
+        raise click.ClickException(str(error))
+    if not moved:
+        click.echo('No old device tables left to migrate.')
+    for name, count in sorted(moved.items()):
+        click.echo('Moved {} row(s) from {}.'.format(count, name))
+    if moved:
+        click.echo('Search index and asset registry rebuilt, run drop-legacy-tables to drop the old tables.')
+
+
+@inventory.command('drop-legacy-tables')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def drop_legacy_tables_command(yes):
+    """Drop the old per-kind device tables once migrate-assets has emptied them."""
+    left = drop_legacy_tables(dry_run=True)
+    if not left:
+        click.echo('No old device tables left to drop.')
+        return
+    for name, count in sorted(left.items()):
+        click.echo('{} row(s) left in {}.'.format(count, name))
+    if any(left.values()):
+        raise click.ClickException('Run migrate-assets until the old tables are empty.')
+    if not (yes or click.confirm('Drop {}?'.format(', '.join(sorted(left))))):
+        return
+    if any(drop_legacy_tables().values()):
+        raise click.ClickException('Rows were added to the old tables, nothing was dropped.')
+    click.echo('Dropped.')
+
+
+@inventory.command('delete-employees')
+@click.argument('employee_ids', nargs=-1, type=int)
+@click.option('--room', help='Delete every employee in this room instead.')
+@click.option('--dry-run', is_flag=True, help='Only count the employees and devices that would be deleted.')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def delete_employees_command(employee_ids, room, dry_run, yes):
+    """Delete employees and all of their devices in one transaction."""
+    if room is not None:
+        employee_ids = [row[0] for row in db.session.query(Users.employee_id).filter_by(room_number=room)]
+    if not employee_ids:
+        raise click.ClickException('No employees given, pass employee ids or --room.')
+    counts = delete_employees(employee_ids, dry_run=True)
+    click.echo('{employees} employee(s) and {assets} device(s) {verb} deleted.'.format(
+        verb='would be' if dry_run else 'will be', **counts))
+    if dry_run or not counts['employees'] or not (yes or click.confirm('Continue?')):
+        return
+    delete_employees(employee_ids)
+    db.session.commit()
+    click.echo('Deleted.')
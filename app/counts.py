@@ -0,0 +1,77 @@
+from threading import Lock
+from time import monotonic
+from sqlalchemy import event
+from app import app, db
+
+
+# Keeps the number of rows of each table, and of any filtered query over it, so that the
+# list views do not run SELECT COUNT(*) over the whole table on every page view. Plain
+# table counts are adjusted when a transaction that inserted or deleted rows commits;
+# filtered counts are dropped instead, also when rows were only updated. Every entry is
+# also recomputed once it is older than ROW_COUNT_TTL seconds, which bounds the drift
+# caused by other worker processes and by statements that bypass the session.
+class RowCounter(object):
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.counts = {}
+        self.lock = Lock()
+
+    # Returns the number of rows of query. Queries that filter the table must pass a
+    # hashable key describing the filter.
+    def count(self, query, table, key=None):
+        entry = self.counts.get((table, key))
+        if entry is not None and entry[0] > monotonic():
+            return entry[1]
+        total = query.order_by(None).count()
+        with self.lock:
+            self.counts[(table, key)] = (monotonic() + self.ttl, total)
+        return total
+
+    # Applies the net number of inserted rows per table of a committed transaction.
+    def adjust(self, deltas):
+        with self.lock:
+            for (table, key), (expires, total) in list(self.counts.items()):
+                if table not in deltas:
+                    continue
+                if key is None:
+                    self.counts[(table, key)] = (expires, max(total + deltas[table], 0))
+                else:
+                    del self.counts[(table, key)]
+
+    def invalidate(self, table):
+        with self.lock:
+            for entry in [entry for entry in self.counts if entry[0] == table]:
+                del self.counts[entry]
+
+
+row_counts = RowCounter(app.config['ROW_COUNT_TTL'])
+
+
+# Inserted and deleted rows are tallied per flush and only applied once the transaction
+# commits, so a rollback leaves the cached counts untouched.
+@event.listens_for(db.session, 'after_flush')
+def tally_row_counts(session, flush_context):
+    deltas = session.info.setdefault('row_count_deltas', {})
+    for objects, step in ((session.new, 1), (session.deleted, -1), (session.dirty, 0)):
+        for obj in objects:
+            table = obj.__table__.name
+            deltas[table] = deltas.get(table, 0) + step
+
+
+@event.listens_for(db.session, 'after_commit')
+def apply_row_counts(session):
+    deltas = session.info.pop('row_count_deltas', None)
+    if deltas:
+        row_counts.adjust(deltas)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_row_counts(session):
+    session.info.pop('row_count_deltas', None)
+
+
+# Query.delete() does not report how many rows of which table went away through the
+# session, so the table's counts are simply recomputed on next use.
+@event.listens_for(db.session, 'after_bulk_delete')
+def invalidate_row_counts(delete_context):
+    row_counts.invalidate(delete_context.primary_table.name)
@@ -0,0 +1,100 @@
+from flask import current_app
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import Column, event, inspect, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import Select, UpdateBase
+
+PRIMARY, REPLICA = 'primary', 'replica'
+
+
+# Returns the create_engine() options for the configured database. Connections are
+# pooled for SQLite too: by default every checkout would open a new connection and run
+# the pragmas again. A pooled connection is only used by one thread at a time, so it may
+# be handed between threads. In-memory databases keep the single shared connection
+# Flask-SQLAlchemy sets up for them.
+def engine_options(config):
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    options = {'pool_size': config['DATABASE_POOL_SIZE'], 'max_overflow': config['DATABASE_MAX_OVERFLOW']}
+    if url.drivername.startswith('sqlite'):
+        if url.database in (None, '', ':memory:'):
+            return {}
+        options.update(poolclass=QueuePool, connect_args={'check_same_thread': False})
+    else:
+        options.update(pool_pre_ping=config['DATABASE_POOL_PRE_PING'],
+                       pool_recycle=config['DATABASE_POOL_RECYCLE'])
+    return options
+
+
+# Foreign keys are always enforced: the asset table relies on ON DELETE CASCADE.
+def sqlite_pragmas(config):
+    return ['PRAGMA journal_mode={}'.format(config['SQLITE_JOURNAL_MODE']),
+            'PRAGMA synchronous={}'.format(config['SQLITE_SYNCHRONOUS']),
+            'PRAGMA busy_timeout={:d}'.format(config['SQLITE_BUSY_TIMEOUT']),
+            'PRAGMA cache_size={:d}'.format(config['SQLITE_CACHE_SIZE']),
+            'PRAGMA mmap_size={:d}'.format(config['SQLITE_MMAP_SIZE']),
+            'PRAGMA temp_store={}'.format(config['SQLITE_TEMP_STORE']),
+            'PRAGMA foreign_keys=ON']
+
+
+# Runs the pragmas on every new connection of engine when it is an SQLite database.
+def apply_sqlite_pragmas(engine, pragmas):
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+# Tables the models do not describe but "flask db migrate" must not drop: the old per-kind
+# device tables, which "flask inventory drop-legacy-tables" drops once their rows were
+# moved to the asset table, the full text index kept by app/search.py, and SQLite's own.
+LEGACY_TABLES = ('monitors', 'desktop', 'laptop', 'printer', 'scanner', 'other')
+UNMANAGED_PREFIXES = ('search_index', 'sqlite_')
+
+
+# Passed to Alembic as include_object, leaving those tables out of autogenerated revisions.
+# SQLAlchemy cannot reflect indexes on expressions, so they always look missing; they are
+# only included with a table that does not exist yet.
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == 'table' and reflected and compare_to is None:
+        return name not in LEGACY_TABLES and not name.startswith(UNMANAGED_PREFIXES)
+    if type_ == 'index' and not reflected and not all(isinstance(expression, Column)
+                                                      for expression in object.expressions):
+        engine = current_app.extensions['migrate'].db.engine
+        return object.table.name not in inspect(engine).get_table_names()
+    return True
+
+
+# A session that sends its SELECTs to a replica while the view is routed there (see
+# app/replicas.py) and nothing has been written yet. Flushes, writes and everything after
+# them go to the primary, so a request always reads its own writes, and so does a user
+# who wrote shortly before ('pinned'). One replica is picked per session; when none is
+# fresh enough the primary is used.
+class RoutingSession(SignallingSession):
+    def __init__(self, db, **options):
+        self.db = db
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+        elif isinstance(clause, Select) and not self._flushing and not self.info.get('wrote') and \
+                not self.info.get('pinned') and (self.info.get('route') or self.app.config['DATABASE_DEFAULT_ROUTE']) == REPLICA:
+            if 'replica' not in self.info:
+                self.info['replica'] = self.db.replicas.choose() if self.db.replicas else None
+            if self.info['replica'] is not None:
+                return self.info['replica']
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    # Set by app/replicas.py to the replica set in use.
+    replicas = None
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
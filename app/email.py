@@ -1,19 +1,155 @@
-from threading import Thread
+import atexit
+from queue import Queue, Empty, Full
+from threading import Thread, Lock, Event
+from time import monotonic
 from flask import render_template
 from flask_mail import Message
 from app import app, mail
 
+# Tells a worker to finish once everything queued before it has been sent
+STOP = object()
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+
+# Delivers mail in the background. Messages wait in a bounded queue and a fixed pool of
+# workers sends them in batches over an SMTP connection that is kept open until the
+# worker has been idle for MAIL_IDLE_TIMEOUT seconds. Failed sends are retried with
+# exponential backoff, and whatever is still queued is sent when the process exits, for at
+# most MAIL_SHUTDOWN_TIMEOUT seconds.
+class MailQueue(object):
+    def __init__(self, app):
+        self.app = app
+        self.queue = Queue(app.config['MAIL_QUEUE_SIZE'])
+        self.workers = []
+        self.lock = Lock()
+        self.counters = {'sent': 0, 'failed': 0, 'retried': 0, 'rejected': 0}
+        self.exiting = Event()
+        atexit.register(self.shutdown)
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    # Queue depth and delivery counters, for the flask shell or a health check.
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, queued=self.queue.qsize())
+
+    def start(self):
+        with self.lock:
+            if not self.workers:
+                for number in range(self.app.config['MAIL_WORKERS']):
+                    worker = Thread(target=self.run, name='mail-{}'.format(number), daemon=True)
+                    worker.start()
+                    self.workers.append(worker)
+
+    # Queues a message. When the queue stays full for MAIL_QUEUE_TIMEOUT seconds the
+    # message is dropped and False is returned, so a burst of requests cannot pile up.
+    def put(self, msg):
+        self.start()
+        try:
+            self.queue.put(msg, timeout=self.app.config['MAIL_QUEUE_TIMEOUT'])
+        except Full:
+            self.count('rejected')
+            self.app.logger.warning('Mail queue is full, dropped message to %s', ', '.join(msg.recipients))
+            return False
+        return True
+
+    def run(self):
+        with self.app.app_context():
+            connection = None
+            stopping = False
+            while not stopping:
+                try:
+                    msg = self.queue.get(timeout=self.app.config['MAIL_IDLE_TIMEOUT'] if connection else None)
+                except Empty:
+                    connection = self.close(connection)
+                    continue
+                batch = []
+                while msg is not None:
+                    if msg is STOP:
+                        self.queue.task_done()
+                        stopping = True
+                        break
+                    batch.append(msg)
+                    msg = None
+                    if len(batch) < self.app.config['MAIL_BATCH_SIZE']:
+                        try:
+                            msg = self.queue.get_nowait()
+                        except Empty:
+                            pass
+                connection = self.deliver(connection, batch)
+            self.close(connection)
+
+    # Sends a batch over the open connection, opening a new one when needed. Returns the
+    # connection to use for the next batch.
+    def deliver(self, connection, batch):
+        attempt = 0
+        while batch:
+            try:
+                if connection is None:
+                    connection = mail.connect()
+                    connection.__enter__()
+                connection.send(batch[0])
+                self.count('sent')
+            except Exception:
+                connection = self.close(connection)
+                attempt += 1
+                # Once the process is exiting there is no time left to wait for the server
+                if attempt <= self.app.config['MAIL_RETRIES'] and not self.exiting.is_set():
+                    self.count('retried')
+                    self.exiting.wait(self.app.config['MAIL_RETRY_BACKOFF'] * 2 ** (attempt - 1))
+                    continue
+                self.count('failed')
+                self.app.logger.exception('Could not send mail to %s', ', '.join(batch[0].recipients))
+            attempt = 0
+            batch.pop(0)
+            self.queue.task_done()
+        return connection
+
+    def close(self, connection):
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except Exception:
+                pass
+        return None
+
+    # Lets the workers send everything queued so far and then stop. Called at exit. Failed
+    # sends are no longer retried, and after MAIL_SHUTDOWN_TIMEOUT seconds in all whatever
+    # is left in the queue is dropped and counted in the log.
+    def shutdown(self):
+        with self.lock:
+            workers, self.workers = self.workers, []
+        if not workers:
+            return
+        self.exiting.set()
+        deadline = monotonic() + self.app.config['MAIL_SHUTDOWN_TIMEOUT']
+        try:
+            for worker in workers:
+                self.queue.put(STOP, timeout=max(deadline - monotonic(), 0))
+        except Full:
+            pass
+        for worker in workers:
+            worker.join(max(deadline - monotonic(), 0))
+        dropped = 0
+        while True:
+            try:
+                if self.queue.get_nowait() is not STOP:
+                    dropped += 1
+            except Empty:
+                break
+        if dropped:
+            self.app.logger.warning('Mail queue shut down with %s messages not sent', dropped)
+
+
+mail_queue = MailQueue(app)
 
 
 def send_email(subject, sender, recipients, text_body, html_body):
     msg = Message(subject, sender=sender, recipients=recipients)
     msg.body = text_body
     msg.html = html_body
-    Thread(target=send_async_email, args=(app, msg)).start()
+    return mail_queue.put(msg)
 
 
 def send_password_reset_email(user):
@@ -24,4 +160,4 @@ def send_password_reset_email(user):
                text_body=render_template('email/reset_password.txt',
                                          user=user, token=token),
                html_body=render_template('email/reset_password.html',
-                                         user=user, token=token))
\ No newline at end of file
+                                         user=user, token=token))
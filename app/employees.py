@@ -0,0 +1,43 @@
+from sqlalchemy import select
+from app import db
+from app.models import Users, Asset, AssetTag
+from app.assets import ITEM
+from app.audit import record_events, make_event, DELETE
+from app.counts import row_counts
+from app.responses import record_changed_tables
+from app.search import search_index, EMPLOYEE
+
+# How many employee ids are sent in one IN (...) list, below SQLite's default variable limit
+IN_LIMIT = 500
+
+
+# Deletes the given employees together with all of their devices in the session's
+# transaction, for the caller to commit. Each slice of ids costs one DELETE on users; the
+# asset rows go with it through the ON DELETE CASCADE foreign key, so no device is loaded.
+# Their registry entries, search documents and audit events, which the flush cannot see,
+# are written here with set-based statements as well. With dry_run nothing is deleted.
+# Returns the number of employees and devices deleted, or that would be.
+def delete_employees(employee_ids, dry_run=False):
+    ids = sorted(set(employee_ids))
+    session = db.session
+    counts = {'employees': 0, 'assets': 0}
+    events = []
+    for start in range(0, len(ids), IN_LIMIT):
+        chunk = ids[start:start + IN_LIMIT]
+        employees = session.query(*Users.__table__.columns).filter(Users.employee_id.in_(chunk)).all()
+        assets = session.query(*Asset.__table__.columns).filter(Asset.employee_id.in_(chunk)).all()
+        counts['employees'] += len(employees)
+        counts['assets'] += len(assets)
+        if dry_run or not employees:
+            continue
+        events.extend(make_event(DELETE, Users.__tablename__, row.employee_id, row._asdict()) for row in employees)
+        events.extend(make_event(DELETE, row.type, row.asset_id, row._asdict()) for row in assets)
+        session.execute(AssetTag.__table__.delete().where(AssetTag.kind != ITEM).where(AssetTag.row_id.in_(
+            select([Asset.asset_id]).where(Asset.employee_id.in_(chunk)))))
+        Users.query.filter(Users.employee_id.in_(chunk)).delete(synchronize_session=False)
+        search_index.refresh(session.connection(), EMPLOYEE, chunk)
+    if events:
+        record_events(session, events)
+        record_changed_tables(session, [Asset.__tablename__])
+        row_counts.invalidate(Asset.__tablename__)
+    return counts
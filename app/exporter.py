@@ -0,0 +1,107 @@
+import csv
+import io
+import json
+import zlib
+from itertools import groupby
+from operator import itemgetter
+from app import app, db
+from app.models import Users, Asset, Other, CheckOut, Toner
+from app.importer import EMPLOYEE_COLUMNS, DEVICE_COLUMNS
+
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+# The employees with their devices flattened into the columns read by the importer, so an
+# export can be imported again. The devices are streamed in employee order next to the
+# employees and merged in, instead of joining and multiplying the rows.
+def employee_rows():
+    chunk = app.config['EXPORT_CHUNK_SIZE']
+    assets = db.session.query(Asset.employee_id, Asset.type, Asset.name, Asset.serial_number, Asset.asset_tag)\
+        .filter(Asset.employee_id != None).order_by(Asset.employee_id, Asset.asset_id).yield_per(chunk)
+    groups = ((key, list(rows)) for key, rows in groupby(assets, key=itemgetter(0)))
+    current = next(groups, None)
+    employees = db.session.query(*[getattr(Users, column) for column in EMPLOYEE_COLUMNS])\
+        .order_by(Users.employee_id).yield_per(chunk)
+    for employee in employees:
+        row = list(employee)
+        while current is not None and current[0] < employee.employee_id:
+            current = next(groups, None)
+        devices = {}
+        if current is not None and current[0] == employee.employee_id:
+            for asset in current[1]:
+                devices.setdefault(asset.type, []).append(asset)
+            current = next(groups, None)
+        for model, fields in DEVICE_COLUMNS:
+            found = devices.get(model.__mapper__.polymorphic_identity)
+            asset = found.pop(0) if found else None
+            row.extend(getattr(asset, column) if asset is not None else None for column in fields)
+        yield row
+
+
+def employee_columns():
+    return EMPLOYEE_COLUMNS + [field for model, fields in DEVICE_COLUMNS for field in fields.values()]
+
+
+def _table(*columns):
+    def columns_of():
+        return [column.key for column in columns]
+
+    def rows():
+        return db.session.query(*columns).order_by(columns[0]).yield_per(app.config['EXPORT_CHUNK_SIZE'])
+    return columns_of, rows
+
+
+# The datasets that can be exported: a function returning the column names and one
+# returning the rows.
+DATASETS = {
+    'employees': (employee_columns, employee_rows),
+    'items': _table(Other.others_id, Other.other_item_name, Other.other_serial_number, Other.other_asset_tag),
+    'checkouts': _table(CheckOut.check_out_id, CheckOut.checkout_timestamp, CheckOut.checkout_username,
+                        CheckOut.checkout_item_name, CheckOut.checkout_serial_number,
+                        CheckOut.checkout_asset_tag, CheckOut.checked_in_at),
+    'toner': _table(Toner.toner_id, Toner.toner_model, Toner.toner_cartridge, Toner.toner_color,
+                    Toner.toner_quantity, Toner.toner_reorder_threshold),
+}
+
+
+def csv_chunks(columns, rows, size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % size == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def jsonl_chunks(columns, rows, size):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row)), default=str))
+        if len(lines) == size:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# Returns a generator of byte chunks holding the whole dataset in the given format. Rows
+# are read from the database EXPORT_CHUNK_SIZE at a time and written out as they arrive,
+# so memory use stays flat however large the tables grow.
+def export(dataset, format='csv', compress=False):
+    columns, rows = DATASETS[dataset]
+    writer = csv_chunks if format == 'csv' else jsonl_chunks
+    chunks = writer(columns(), rows(), app.config['EXPORT_CHUNK_SIZE'])
+    return gzipped(chunks) if compress else chunks
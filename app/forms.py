@@ -1,8 +1,10 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, TextAreaField, PasswordField, BooleanField, \
-    SubmitField, SelectField, IntegerField, RadioField
-from wtforms.validators import ValidationError, DataRequired, Email, EqualTo, Length
-from app.models import User, Admin, Users, Monitors, Desktop, Laptop, Printer, Scanner, Toner, Other, CheckOut
+    SubmitField, IntegerField, RadioField
+from wtforms.validators import ValidationError, DataRequired, Email, EqualTo, Length, NumberRange, \
+    Optional, AnyOf
+from app.models import User, Admin, Users, Asset, Monitors, Desktop, Laptop, Printer, Scanner, Toner, Other, CheckOut
 from app import app, db
 
 class LoginForm(FlaskForm):
@@ -42,13 +44,20 @@ class EditProfileForm(FlaskForm):
             if email is not None:
                 raise ValidationError('Please use a different email address!')
 
+# The user fields of the admin and checkout forms are filled in through the typeahead
+# lookups in routes.py, so the submitted id is checked here rather than against a list
+# of choices built from the whole table.
 class AdminUserForm(FlaskForm):
-    select_field = SelectField(u'Users', coerce=int)
+    select_field = IntegerField(u'User ID', validators=[DataRequired()])
     radio_field = RadioField('Actions', choices=[('option1', 'Make Admin'),
                                                  ('option2', 'Remove Admin'),
                                                  ('option3', 'Delete User')])
     submit = SubmitField('Submit')
 
+    def validate_select_field(self, select_field):
+        if db.session.query(User.id).filter_by(id=select_field.data).first() is None:
+            raise ValidationError('Please choose a user from the list.')
+
 class ImportUserForm(FlaskForm):
     employee_id = StringField('Employee ID', validators=[DataRequired()])
     username = StringField('Username', validators=[DataRequired()])
@@ -81,6 +90,22 @@ class ImportUserForm(FlaskForm):
         if employee_id:
             raise ValidationError('Please use a different employee code or id.')
 
+# Validates one row of a bulk import file with the rules of ImportUserForm. The importer
+# checks that employee ids, usernames and emails are unused for a whole batch at once,
+# so the per row query is replaced with a check that the id is a number.
+class ImportRowForm(ImportUserForm):
+    class Meta:
+        csrf = False
+
+    def validate_employee_id(self, employee_id):
+        if not str(employee_id.data).strip().isdigit():
+            raise ValidationError('Employee ID must be a number.')
+
+class ImportFileForm(FlaskForm):
+    file = FileField('CSV or JSONL File', validators=[FileRequired(),
+                                                      FileAllowed(['csv', 'jsonl', 'json'], 'CSV or JSONL files only')])
+    submit = SubmitField('Upload')
+
 class SearchUserForm(FlaskForm):
     search = StringField('Username')
     submit = SubmitField('Search')
@@ -115,16 +140,66 @@ class InventoryForm(FlaskForm):
     other_asset_tag = StringField('Item Asset Tag')
     submit = SubmitField('Submit')
 
+# Validates one device or inventory item written through the JSON API. Items need a name,
+# as on InventoryForm, and are given to employees by checking them out, not by assignment.
+class AssetForm(FlaskForm):
+    class Meta:
+        csrf = False
+
+    type = StringField('Type', validators=[DataRequired(), AnyOf(sorted(Asset.__mapper__.polymorphic_map))])
+    name = StringField('Name')
+    serial_number = StringField('Serial Number')
+    asset_tag = StringField('Asset Tag')
+    employee_id = IntegerField('Employee ID', validators=[Optional()])
+
+    def validate_name(self, name):
+        if self.type.data == Other.__mapper__.polymorphic_identity:
+            DataRequired()(self, name)
+
+    def validate_employee_id(self, employee_id):
+        if self.type.data == Other.__mapper__.polymorphic_identity and employee_id.data is not None:
+            raise ValidationError('Inventory items are given to employees by checking them out.')
+
 class CheckOutForm(FlaskForm):
-    select_field = SelectField(u'Users', coerce=int)
+    select_field = IntegerField(u'Employee ID', validators=[DataRequired()])
     checkout_asset_tag = StringField('Item Asset Tag', validators=[DataRequired()])
     submit = SubmitField('Check Out')
 
+    def validate_select_field(self, select_field):
+        if db.session.query(Users.employee_id).filter_by(employee_id=select_field.data).first() is None:
+            raise ValidationError('Please choose an employee from the list.')
+
+# Takes the tags of a burst of barcode scans, one per line, and checks them all out to the
+# chosen employee or checks them all back in.
+class BatchCheckOutForm(FlaskForm):
+    select_field = IntegerField(u'Employee ID', validators=[Optional()])
+    asset_tags = TextAreaField('Item Asset Tags', validators=[DataRequired()], render_kw={'rows': 10})
+    check_out = SubmitField('Check Out')
+    check_in = SubmitField('Check In')
+
+    # The employee is only needed to check items out
+    def validate(self):
+        if not FlaskForm.validate(self):
+            return False
+        if self.check_out.data and (self.select_field.data is None or db.session.query(Users.employee_id)
+                                    .filter_by(employee_id=self.select_field.data).first() is None):
+            self.select_field.errors.append('Please choose an employee from the list.')
+            return False
+        return True
+
+    def validate_asset_tags(self, asset_tags):
+        if len(self.tags()) > app.config['CHECKOUT_BATCH_LIMIT']:
+            raise ValidationError('Please scan at most {} tags at a time.'.format(app.config['CHECKOUT_BATCH_LIMIT']))
+
+    def tags(self):
+        return (self.asset_tags.data or '').splitlines()
+
 class TonerForm(FlaskForm):
     toner_model = StringField('Toner Model', validators=[DataRequired()])
     toner_cartridge = StringField('Toner Cartridge', validators=[DataRequired()])
     toner_color = StringField('Toner Color')
     toner_quantity = IntegerField('Quantity')
+    toner_reorder_threshold = IntegerField('Reorder Below', default=3, validators=[NumberRange(min=0)])
     submit = SubmitField('Submit')
 
 class ResetPasswordRequestForm(FlaskForm):
@@ -0,0 +1,149 @@
+import csv
+import json
+from itertools import islice
+from sqlalchemy import select
+from werkzeug.datastructures import MultiDict
+from app import app, db
+from app.forms import ImportRowForm
+from app.models import Users, Asset, Monitors, Desktop, Laptop, Printer, Scanner
+from app.search import search_index, EMPLOYEE
+from app.assets import asset_registry
+from app.counts import row_counts
+from app.audit import audit_trail, make_event, CREATE
+from app.responses import table_versions
+
+# The employee columns and, for each device row created per employee, the model and the
+# file columns feeding its asset columns. File columns are named after the fields of
+# ImportUserForm.
+EMPLOYEE_COLUMNS = ['employee_id', 'username', 'first_name', 'last_name', 'email', 'room_number']
+DEVICE_COLUMNS = [
+    (Monitors, {'serial_number': 'monitor_serial_number1', 'asset_tag': 'monitor_asset_tag1'}),
+    (Monitors, {'serial_number': 'monitor_serial_number2', 'asset_tag': 'monitor_asset_tag2'}),
+    (Desktop, {'name': 'desktop_name', 'serial_number': 'desktop_serial_number', 'asset_tag': 'desktop_asset_tag'}),
+    (Laptop, {'name': 'laptop_name', 'serial_number': 'laptop_serial_number', 'asset_tag': 'laptop_asset_tag'}),
+    (Printer, {'name': 'printer_model', 'serial_number': 'printer_serial_number',
+               'asset_tag': 'printer_asset_tag'}),
+    (Scanner, {'name': 'scanner_model', 'serial_number': 'scanner_serial_number',
+               'asset_tag': 'scanner_asset_tag'}),
+]
+TABLES = [Users.__tablename__, Asset.__tablename__]
+
+# How many values are sent in one IN (...) list, below SQLite's default variable limit
+IN_LIMIT = 500
+
+
+# The outcome of an import: how many employees were written and, for every rejected row,
+# its line number and the reasons.
+class ImportReport(object):
+    def __init__(self):
+        self.imported = 0
+        self.errors = []
+
+    def reject(self, line, message):
+        self.errors.append((line, message))
+
+    def __repr__(self):
+        return '<ImportReport {} imported, {} rejected>'.format(self.imported, len(self.errors))
+
+
+# Readers yield (line number, row) pairs. A row that cannot be parsed is yielded as the
+# exception instead so it is reported without stopping the run.
+def read_csv(lines):
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_jsonl(lines):
+    for number, line in enumerate(lines, start=1):
+        if line.strip():
+            try:
+                yield number, json.loads(line)
+            except ValueError as error:
+                yield number, error
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl, 'json': read_jsonl}
+
+
+# Validates each row with ImportRowForm and yields the clean values of the good ones.
+def validate(rows, report):
+    for line, row in rows:
+        if isinstance(row, Exception) or not isinstance(row, dict):
+            report.reject(line, 'Could not read row: {}'.format(row))
+            continue
+        form = ImportRowForm(formdata=MultiDict({key: '' if value is None else str(value)
+                                                 for key, value in row.items()}))
+        if not form.validate():
+            report.reject(line, '; '.join('{}: {}'.format(field, ' '.join(messages))
+                                          for field, messages in form.errors.items()))
+            continue
+        values = {field.name: field.data.strip() for field in form if field.type == 'StringField'}
+        values['employee_id'] = int(values['employee_id'])
+        yield line, values
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    batch = list(islice(rows, size))
+    while batch:
+        yield batch
+        batch = list(islice(rows, size))
+
+
+# Returns the employee ids, usernames and emails of the batch that are already taken.
+def _taken(connection, batch):
+    taken = set()
+    for column, name in ((Users.employee_id, 'employee_id'), (Users.username, 'username'), (Users.email, 'email')):
+        wanted = [values[name] for line, values in batch]
+        for start in range(0, len(wanted), IN_LIMIT):
+            taken.update((name, row[0]) for row in connection.execute(
+                select([column]).where(column.in_(wanted[start:start + IN_LIMIT]))))
+    return taken
+
+
+# Writes one batch in a single transaction: the employees with one executemany INSERT and
+# all of their devices with another, followed by the search index and asset registry. The
+# rows bypass the session, so their audit events are recorded here.
+def write_batch(batch, report):
+    with db.engine.begin() as connection:
+        taken = _taken(connection, batch)
+        employees = []
+        for line, values in batch:
+            duplicates = [name for name in ('employee_id', 'username', 'email') if (name, values[name]) in taken]
+            if duplicates:
+                report.reject(line, 'Already in use: {}'.format(', '.join(duplicates)))
+                continue
+            taken.update((name, values[name]) for name in ('employee_id', 'username', 'email'))
+            employees.append(values)
+        if not employees:
+            return
+        connection.execute(Users.__table__.insert(),
+                           [{column: values[column] for column in EMPLOYEE_COLUMNS} for values in employees])
+        connection.execute(Asset.__table__.insert(), [
+            dict({'name': None}, type=model.__mapper__.polymorphic_identity, employee_id=values['employee_id'],
+                 **{column: values[field] for column, field in fields.items()})
+            for values in employees for model, fields in DEVICE_COLUMNS])
+        ids = [values['employee_id'] for values in employees]
+        search_index.refresh(connection, EMPLOYEE, ids)
+        asset_registry.register_employees(connection, ids)
+    audit_trail.add([make_event(CREATE, Users.__tablename__, values['employee_id'], values)
+                     for values in employees])
+    report.imported += len(employees)
+
+
+# Imports employees and their equipment from an iterable of text lines in the given
+# format. Rows are validated and written batch by batch, so memory use does not grow with
+# the size of the file and a bad row only rejects itself.
+def import_employees(lines, format='csv', batch_size=None):
+    report = ImportReport()
+    batch_size = batch_size or app.config['IMPORT_BATCH_SIZE']
+    try:
+        for batch in batches(validate(READERS[format](lines), report), batch_size):
+            write_batch(batch, report)
+    finally:
+        for table in TABLES:
+            row_counts.invalidate(table)
+        table_versions.bump(TABLES)
+    report.errors.sort()
+    return report
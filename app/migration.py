@@ -0,0 +1,109 @@
+from sqlalchemy import column, func, inspect, null, select, table
+from app import db
+from app.models import Users, Asset, AssetTag, SearchDocument
+from app.assets import asset_registry
+from app.search import search_index
+from app.counts import row_counts
+from app.responses import table_versions
+
+# The tables the asset table replaced. For each: its name, which is kept as the asset type,
+# its primary key, and the columns that became name, serial_number, asset_tag and
+# employee_id.
+LEGACY_TABLES = [
+    ('monitors', 'monitors_id', None, 'monitor_serial_number', 'monitor_asset_tag', 'monitor_reference_id'),
+    ('desktop', 'desktops_id', 'desktop_name', 'desktop_serial_number', 'desktop_asset_tag',
+     'desktop_reference_id'),
+    ('laptop', 'laptops_id', 'laptop_name', 'laptop_serial_number', 'laptop_asset_tag', 'laptop_reference_id'),
+    ('printer', 'printers_id', 'printer_model', 'printer_serial_number', 'printer_asset_tag',
+     'printer_reference_id'),
+    ('scanner', 'scanners_id', 'scanner_model', 'scanner_serial_number', 'scanner_asset_tag',
+     'scanner_reference_id'),
+    ('other', 'others_id', 'other_item_name', 'other_serial_number', 'other_asset_tag', None),
+]
+ASSET_COLUMNS = ['name', 'serial_number', 'asset_tag', 'employee_id']
+
+# How many employees, or leftover rows of one table, are moved per transaction
+MIGRATE_BATCH = 500
+
+
+def _legacy_tables(connection):
+    existing = set(inspect(connection).get_table_names())
+    for name, key, *columns in LEGACY_TABLES:
+        if name in existing:
+            legacy = table(name, *[column(field) for field in [key] + [field for field in columns if field]])
+            selected = [legacy.c[key]] + [legacy.c[field] if field else null() for field in columns]
+            yield name, legacy, legacy.c[key], selected, legacy.c[columns[-1]] if columns[-1] else None
+
+
+# Copies the selected rows of a legacy table into the asset table and deletes them from
+# the legacy table, on the caller's transaction. Returns the number of rows moved.
+def _move(connection, kind, legacy, key, selected, criterion, limit=None):
+    query = select(selected).where(criterion).order_by(key)
+    rows = connection.execute(query.limit(limit) if limit else query).fetchall()
+    if rows:
+        connection.execute(Asset.__table__.insert(),
+                           [dict(zip(ASSET_COLUMNS, row[1:]), type=kind) for row in rows])
+        connection.execute(legacy.delete().where(criterion).where(key <= rows[-1][0]))
+    return len(rows)
+
+
+# The tables migrate_assets() writes to, which "flask db upgrade" must have created first
+REQUIRED_TABLES = [Asset.__tablename__, AssetTag.__tablename__, SearchDocument.__tablename__]
+
+
+# Moves the rows of the old per-kind device tables into the asset table. Run it with the
+# application stopped: until an employee's batch is moved they show no devices, and saving
+# them would add blank ones next to the devices still to come. Every transaction moves the
+# devices of a batch of existing employees, so an employee's devices are always all in
+# one place, and then the items and the devices of no existing employee, which become
+# unassigned, are moved by primary key. An interrupted run simply continues where it
+# stopped: any run that finds the old tables ends by rebuilding the registry and search
+# index, even when nothing was left to move. The emptied tables are kept for
+# drop_legacy_tables(). Returns the number of rows moved per table, or raises
+# RuntimeError when the tables it writes to are missing.
+def migrate_assets(batch_size=None):
+    batch_size = batch_size or MIGRATE_BATCH
+    with db.engine.connect() as connection:
+        missing = [name for name in REQUIRED_TABLES if name not in inspect(connection).get_table_names()]
+        if missing:
+            raise RuntimeError('Missing tables {}, run "flask db upgrade" first.'.format(', '.join(missing)))
+        legacy_tables = list(_legacy_tables(connection))
+    moved = dict((name, 0) for name, legacy, key, selected, reference in legacy_tables)
+    last = None
+    while legacy_tables:
+        with db.engine.begin() as connection:
+            query = select([Users.employee_id]).order_by(Users.employee_id).limit(batch_size)
+            ids = [row[0] for row in connection.execute(
+                query.where(Users.employee_id > last) if last is not None else query)]
+            if not ids:
+                break
+            for name, legacy, key, selected, reference in legacy_tables:
+                if reference is not None:
+                    moved[name] += _move(connection, name, legacy, key, selected, reference.in_(ids))
+            last = ids[-1]
+    # Devices left over at this point belong to no existing employee
+    for name, legacy, key, selected, reference in legacy_tables:
+        count = None
+        while count != 0:
+            with db.engine.begin() as connection:
+                count = _move(connection, name, legacy, key, selected[:-1] + [null()], key != None, batch_size)
+            moved[name] += count
+    if legacy_tables:
+        asset_registry.rebuild()
+        search_index.reindex()
+        row_counts.invalidate(Asset.__tablename__)
+        table_versions.bump([Asset.__tablename__])
+    return moved
+
+
+# Drops the old device tables once migrate_assets() has emptied them, in one transaction
+# with the count. Nothing is dropped while any of them still holds rows, or with dry_run.
+# Returns the number of rows left in each of the tables found.
+def drop_legacy_tables(dry_run=False):
+    with db.engine.begin() as connection:
+        left = dict((name, connection.execute(select([func.count()]).select_from(legacy)).scalar())
+                    for name, legacy, key, selected, reference in _legacy_tables(connection))
+        if not dry_run and not any(left.values()):
+            for name in left:
+                db.Table(name, db.MetaData()).drop(connection)
+    return left
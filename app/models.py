@@ -2,10 +2,19 @@ from datetime import datetime
 from hashlib import md5
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
+from sqlalchemy.orm import make_transient_to_detached
 from app import app, db, login
+from app.cache import TTLCache
 from time import time
 import jwt
 
+# Filters column to values starting with prefix, ignoring case. It is written as a range
+# over lower(column) so the expression indexes declared with the models can serve it.
+def starts_with(column, prefix):
+    prefix = prefix.lower()
+    return db.and_(db.func.lower(column) >= prefix,
+                   db.func.lower(column) < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
 # User class to allow access into the Inventory System. The avatar function is the
 # only function that pulls from an external website.
 class User(UserMixin, db.Model):
@@ -36,6 +45,13 @@ class User(UserMixin, db.Model):
             {'reset_password': self.id, 'exp': time() + expires_in},
             app.config['SECRET_KEY'], algorithm='HS256').decode('utf-8')
 
+    # Returns up to limit (id, username) rows whose username starts with prefix. Used by
+    # the user picker of the Admin Console.
+    @staticmethod
+    def lookup(prefix, limit):
+        return db.session.query(User.id, User.username).filter(starts_with(User.username, prefix))\
+            .order_by(db.func.lower(User.username)).limit(limit).all()
+
     @staticmethod
     def verify_reset_password_token(token):
         try:
@@ -45,10 +61,29 @@ class User(UserMixin, db.Model):
             return
         return User.query.get(id)
 
-# decorator used to load the user into the application.
+# Column values of recently loaded users, keyed by id, so that rebuilding current_user
+# does not cost a query on every request.
+identity_cache = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+
+# decorator used to load the user into the application. A cached user is rebuilt from its
+# column values and attached to the session without emitting a SELECT.
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    id = int(id)
+    values = identity_cache.get(id)
+    if values is None:
+        user = User.query.get(id)
+        if user is not None:
+            identity_cache.set(id, {column.key: getattr(user, column.key)
+                                    for column in User.__table__.columns})
+        return user
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+# Must be called whenever a user's row changes or the user is deleted.
+def invalidate_user(id):
+    identity_cache.pop(int(id))
 
 # Admin class which gives the rights to make other users admins, remove them from
 # admin group, and also delete them from the system completely.
@@ -58,34 +93,37 @@ class Admin(db.Model):
         self.admin_username = admin_username
 
     id = db.Column(db.Integer, primary_key=True)
-    user = db.Column(db.String)
+    user = db.Column(db.String, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 
 
     def __repr__(self):
         return '<Admin {}>'.format(self.user)
 
-    # These functions allow the admin to delete a specified user from the database and all the items attached
-    # to their name. The admin account can also delete other admins and users. A word of caution,
-    # do not try to delete a user if they have items checked out to their name.
-    def delete_user(self, name):
-        db.session.delete(User.query.filter_by(username=name.username).first())
-        db.session.commit()
-
-    def delete_admin(self, name):
-        db.session.delete(Admin.query.filter_by(user=name.username).first())
+    # These functions allow the admin to delete a specified user from the database. The admin
+    # account can also delete other admins and users; employees and the items attached to
+    # their name are deleted with app/employees.py. A word of caution, do not try to delete
+    # a user if they have items checked out to their name. They are static so views guarded
+    # by admin_required can call them without loading an Admin row.
+    @staticmethod
+    def delete_user(name):
+        db.session.delete(name)
         db.session.commit()
+        invalidate_user(name.id)
 
-    def delete_users(self, name):
-        db.session.delete(Users.query.filter_by(username=name.username).first())
+    @staticmethod
+    def delete_admin(name):
+        db.session.delete(name)
         db.session.commit()
 
-    def delete_item(self, name):
-        db.session.delete(Other.query.filter_by(other_item_name=name.other_item_name).first())
+    @staticmethod
+    def delete_item(name):
+        db.session.delete(name)
         db.session.commit()
 
-    def delete_toners(self, name):
-        db.session.delete(Toner.query.filter_by(toner_cartridge=name.toner_cartridge).first())
+    @staticmethod
+    def delete_toners(name):
+        db.session.delete(name)
         db.session.commit()
 
 # These classes are used in conjunction with the ImportUserForm and allows the creation
@@ -93,137 +131,280 @@ class Admin(db.Model):
 class Users(db.Model):
     employee_id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True, unique=True)
-    first_name = db.Column(db.String(64))
+    first_name = db.Column(db.String(64), index=True)
     last_name = db.Column(db.String(64))
     email = db.Column(db.String(120), index=True, unique=True)
     room_number = db.Column(db.String(5))
-    monitors = db.relationship('Monitors', backref='monitor_id', lazy='dynamic', cascade='all,delete-orphan')
-    desktop = db.relationship('Desktop', backref='desktop_id', lazy='dynamic', cascade='all, delete-orphan')
-    laptop = db.relationship('Laptop', backref='laptop_id', lazy='dynamic', cascade='all, delete-orphan')
-    printer = db.relationship('Printer', backref='printer_id', lazy='dynamic', cascade='all, delete-orphan')
-    scanner = db.relationship('Scanner', backref='scanner_id', lazy='dynamic', cascade='all, delete-orphan')
+    # The database deletes an employee's devices with them (ON DELETE CASCADE), so deleting
+    # an employee does not load the devices first.
+    assets = db.relationship('Asset', back_populates='employee', order_by='Asset.asset_id',
+                             cascade='all, delete-orphan', passive_deletes=True)
 
 
     def __repr__(self):
         return '<Users {}>'.format(self.username)
 
+    # The employee's devices of each kind, taken from the one assets collection
+    @property
+    def monitors(self):
+        return [asset for asset in self.assets if isinstance(asset, Monitors)]
+
+    @property
+    def desktop(self):
+        return [asset for asset in self.assets if isinstance(asset, Desktop)]
+
+    @property
+    def laptop(self):
+        return [asset for asset in self.assets if isinstance(asset, Laptop)]
+
+    @property
+    def printer(self):
+        return [asset for asset in self.assets if isinstance(asset, Printer)]
+
+    @property
+    def scanner(self):
+        return [asset for asset in self.assets if isinstance(asset, Scanner)]
+
+    # The devices shown on the edit form: two monitors, a desktop, a laptop, a printer and
+    # a scanner. A device the employee does not have, because it was unassigned or never
+    # created, is stood in for by a new blank one that is not saved unless it is added to
+    # the employee's assets.
+    def device_slots(self):
+        monitors = self.monitors
+        return [monitors[0] if monitors else Monitors(),
+                monitors[1] if len(monitors) > 1 else Monitors()] + \
+            [devices[0] if devices else model() for model, devices in
+             ((Desktop, self.desktop), (Laptop, self.laptop), (Printer, self.printer), (Scanner, self.scanner))]
+
+    # Loads an employee together with every device assigned to them in a single SELECT.
+    # The edit view uses this so the form can be filled and saved without a query per field.
+    @staticmethod
+    def with_assets(employee_id):
+        return Users.query.options(db.joinedload(Users.assets))\
+            .filter_by(employee_id=employee_id).first_or_404()
+
+    # Returns up to limit employees whose last name, first name or username starts with
+    # prefix, or whose employee id is prefix, ordered by name. Used by the employee picker.
+    @staticmethod
+    def lookup(prefix, limit):
+        columns = (Users.employee_id, Users.first_name, Users.last_name, Users.username)
+        if prefix.isdigit():
+            return db.session.query(*columns).filter(Users.employee_id == int(prefix)).all()
+        found = {}
+        for column in (Users.last_name, Users.first_name, Users.username):
+            for row in db.session.query(*columns).filter(starts_with(column, prefix))\
+                    .order_by(db.func.lower(column)).limit(limit):
+                found.setdefault(row.employee_id, row)
+        return sorted(found.values(), key=lambda row: ((row.last_name or '').lower(),
+                                                       (row.first_name or '').lower()))[:limit]
+
+# Case-insensitive indexes for the name lookups above
+db.Index('ix_user_username_lower', db.func.lower(User.username))
+db.Index('ix_users_last_name_lower', db.func.lower(Users.last_name))
+db.Index('ix_users_first_name_lower', db.func.lower(Users.first_name))
+db.Index('ix_users_username_lower', db.func.lower(Users.username))
+
+
+
+# Every device and inventory item is a row of the asset table, told apart by type. The
+# subclasses below keep the classes, constructors and attribute names of the separate
+# tables they replaced, as synonyms of the shared columns, so a lookup or count across
+# every kind of asset is a single query on the indexed serial number or asset tag.
+class Asset(db.Model):
+    __tablename__ = 'asset'
+    __table_args__ = (db.Index('ix_asset_type_name', 'type', 'name'),)
+
+    asset_id = db.Column(db.Integer, primary_key=True)
+    type = db.Column(db.String(20), nullable=False)
+    name = db.Column(db.String(40))
+    serial_number = db.Column(db.String(40), index=True)
+    asset_tag = db.Column(db.String(40), index=True)
+    employee_id = db.Column(db.Integer, db.ForeignKey('users.employee_id', ondelete='CASCADE'), index=True)
+    employee = db.relationship('Users', back_populates='assets')
+
+    __mapper_args__ = {'polymorphic_on': type}
+
+    def __repr__(self):
+        return '<{} {}>'.format(type(self).__name__, self.asset_tag)
+
+    # Returns the class of the assets stored under the given type, e.g. Monitors for
+    # 'monitors', or None for an unknown type. The subclass constructors only set the
+    # employee when one is given, so an employee_id assigned afterwards is kept.
+    @classmethod
+    def class_of(cls, kind):
+        mapper = cls.__mapper__.polymorphic_map.get(kind)
+        return mapper.class_ if mapper is not None else None
 
 
-class Monitors(db.Model):
-    def __init__(self, monitor_serial_number, monitor_asset_tag, monitor_id):
+class Monitors(Asset):
+    __mapper_args__ = {'polymorphic_identity': 'monitors'}
+
+    def __init__(self, monitor_serial_number=None, monitor_asset_tag=None, monitor_id=None):
         self.monitor_serial_number = monitor_serial_number
         self.monitor_asset_tag = monitor_asset_tag
-        self.monitor_id = monitor_id
+        if monitor_id is not None:
+            self.monitor_id = monitor_id
 
-    monitors_id = db.Column(db.Integer, primary_key=True)
-    monitor_serial_number = db.Column(db.String(40))
-    monitor_asset_tag = db.Column(db.String(40))
-    monitor_reference_id = db.Column(db.Integer, db.ForeignKey('users.employee_id'))
+    monitors_id = db.synonym('asset_id')
+    monitor_serial_number = db.synonym('serial_number')
+    monitor_asset_tag = db.synonym('asset_tag')
+    monitor_reference_id = db.synonym('employee_id')
+    monitor_id = db.synonym('employee')
 
     def __repr__(self):
         return '<Monitor {}>'.format(self.monitor_serial_number)
 
 
-class Desktop(db.Model):
-    def __init__(self, desktop_name, desktop_serial_number, desktop_asset_tag, desktop_id):
+class Desktop(Asset):
+    __mapper_args__ = {'polymorphic_identity': 'desktop'}
+
+    def __init__(self, desktop_name=None, desktop_serial_number=None, desktop_asset_tag=None, desktop_id=None):
         self.desktop_name = desktop_name
         self.desktop_serial_number = desktop_serial_number
         self.desktop_asset_tag = desktop_asset_tag
-        self.desktop_id = desktop_id
+        if desktop_id is not None:
+            self.desktop_id = desktop_id
 
-    desktops_id = db.Column(db.Integer, primary_key=True)
-    desktop_name = db.Column(db.String(40))
-    desktop_serial_number = db.Column(db.String(40))
-    desktop_asset_tag = db.Column(db.String(40))
-    desktop_reference_id = db.Column(db.Integer, db.ForeignKey('users.employee_id'))
+    desktops_id = db.synonym('asset_id')
+    desktop_name = db.synonym('name')
+    desktop_serial_number = db.synonym('serial_number')
+    desktop_asset_tag = db.synonym('asset_tag')
+    desktop_reference_id = db.synonym('employee_id')
+    desktop_id = db.synonym('employee')
 
     def __repr__(self):
         return '<Desktop {}>'.format(self.desktop_name)
 
 
-class Laptop(db.Model):
-    def __init__(self, laptop_name, laptop_serial_number, laptop_asset_tag, laptop_id):
+class Laptop(Asset):
+    __mapper_args__ = {'polymorphic_identity': 'laptop'}
+
+    def __init__(self, laptop_name=None, laptop_serial_number=None, laptop_asset_tag=None, laptop_id=None):
         self.laptop_name = laptop_name
         self.laptop_serial_number = laptop_serial_number
         self.laptop_asset_tag = laptop_asset_tag
-        self.laptop_id = laptop_id
+        if laptop_id is not None:
+            self.laptop_id = laptop_id
 
-    laptops_id = db.Column(db.Integer, primary_key=True)
-    laptop_name = db.Column(db.String(40))
-    laptop_serial_number = db.Column(db.String(40))
-    laptop_asset_tag = db.Column(db.String(40))
-    laptop_reference_id = db.Column(db.Integer, db.ForeignKey('users.employee_id'))
+    laptops_id = db.synonym('asset_id')
+    laptop_name = db.synonym('name')
+    laptop_serial_number = db.synonym('serial_number')
+    laptop_asset_tag = db.synonym('asset_tag')
+    laptop_reference_id = db.synonym('employee_id')
+    laptop_id = db.synonym('employee')
 
     def __repr__(self):
         return '<Laptop {}>'.format(self.laptop_serial_number)
 
 
-class Printer(db.Model):
-    def __init__(self, printer_model, printer_serial_number, printer_asset_tag, printer_id):
+class Printer(Asset):
+    __mapper_args__ = {'polymorphic_identity': 'printer'}
+
+    def __init__(self, printer_model=None, printer_serial_number=None, printer_asset_tag=None, printer_id=None):
         self.printer_model = printer_model
         self.printer_serial_number = printer_serial_number
         self.printer_asset_tag = printer_asset_tag
-        self.printer_id = printer_id
+        if printer_id is not None:
+            self.printer_id = printer_id
 
-    printers_id = db.Column(db.Integer, primary_key=True)
-    printer_model = db.Column(db.String(40))
-    printer_serial_number = db.Column(db.String(40))
-    printer_asset_tag = db.Column(db.String(40))
-    printer_reference_id = db.Column(db.Integer, db.ForeignKey('users.employee_id'))
+    printers_id = db.synonym('asset_id')
+    printer_model = db.synonym('name')
+    printer_serial_number = db.synonym('serial_number')
+    printer_asset_tag = db.synonym('asset_tag')
+    printer_reference_id = db.synonym('employee_id')
+    printer_id = db.synonym('employee')
 
     def __repr__(self):
         return '<Printer {}>'.format(self.printer_model)
 
 
-class Scanner(db.Model):
-    def __init__(self, scanner_model, scanner_serial_number, scanner_asset_tag, scanner_id):
+class Scanner(Asset):
+    __mapper_args__ = {'polymorphic_identity': 'scanner'}
+
+    def __init__(self, scanner_model=None, scanner_serial_number=None, scanner_asset_tag=None, scanner_id=None):
         self.scanner_model = scanner_model
         self.scanner_serial_number = scanner_serial_number
         self.scanner_asset_tag = scanner_asset_tag
-        self.scanner_id = scanner_id
+        if scanner_id is not None:
+            self.scanner_id = scanner_id
 
-    scanners_id = db.Column(db.Integer, primary_key=True)
-    scanner_model = db.Column(db.String(40))
-    scanner_serial_number = db.Column(db.String(40))
-    scanner_asset_tag = db.Column(db.String(40))
-    scanner_reference_id = db.Column(db.Integer, db.ForeignKey('users.employee_id'))
+    scanners_id = db.synonym('asset_id')
+    scanner_model = db.synonym('name')
+    scanner_serial_number = db.synonym('serial_number')
+    scanner_asset_tag = db.synonym('asset_tag')
+    scanner_reference_id = db.synonym('employee_id')
+    scanner_id = db.synonym('employee')
 
     def __repr__(self):
         return '<Scanner {}>'.format(self.scanner_model)
 
 class Toner(db.Model):
-    def __init__(self, toner_model, toner_cartridge, toner_color, toner_quantity):
+    def __init__(self, toner_model, toner_cartridge, toner_color, toner_quantity, toner_reorder_threshold=None):
         self.toner_model = toner_model
         self.toner_cartridge = toner_cartridge
         self.toner_color = toner_color
         self.toner_quantity = toner_quantity
+        if toner_reorder_threshold is not None:
+            self.toner_reorder_threshold = toner_reorder_threshold
 
     toner_id = db.Column(db.Integer, primary_key=True)
-    toner_model = db.Column(db.String(40))
+    toner_model = db.Column(db.String(40), index=True)
     toner_cartridge = db.Column(db.String(40))
     toner_color = db.Column(db.String(40))
     toner_quantity = db.Column(db.Integer)
+    # A cartridge is low on stock, and due to be reordered, once fewer than this are left
+    toner_reorder_threshold = db.Column(db.Integer, nullable=False, default=3, server_default='3')
+
+    # Cartridges left above the reorder threshold, negative once stock is low. The
+    # ix_toner_stock_margin index below is on this expression, so the low stock query
+    # only reads the low rows. The 0 is written as a literal, not a bound parameter, so the
+    # query's expression is the same as the index's and SQLite can match them.
+    @classmethod
+    def stock_margin(cls):
+        return db.func.coalesce(cls.toner_quantity, db.literal_column('0')) - cls.toner_reorder_threshold
+
+    @classmethod
+    def low_stock(cls):
+        return cls.query.filter(cls.stock_margin() < 0).order_by(cls.stock_margin(), cls.toner_id)
 
     def __repr__(self):
         return '<Toner {}>'.format(self.toner_model)
 
+
+db.Index('ix_toner_stock_margin', Toner.stock_margin())
+
 # This class is primarily used for the Checkout system.
-class Other(db.Model):
-    def __init__(self, other_item_name, other_serial_number, other_asset_tag):
+class Other(Asset):
+    __mapper_args__ = {'polymorphic_identity': 'other'}
+
+    def __init__(self, other_item_name=None, other_serial_number=None, other_asset_tag=None):
         self.other_item_name = other_item_name
         self.other_serial_number = other_serial_number
         self.other_asset_tag = other_asset_tag
 
-    others_id = db.Column(db.Integer, primary_key=True)
-    other_item_name = db.Column(db.String(40))
-    other_serial_number = db.Column(db.String(40))
-    other_asset_tag = db.Column(db.String(40))
+    others_id = db.synonym('asset_id')
+    other_item_name = db.synonym('name')
+    other_serial_number = db.synonym('serial_number')
+    other_asset_tag = db.synonym('asset_tag')
 
     def __repr__(self):
-        return '<Other {}>'.format(self.other.item_name)
+        return '<Other {}>'.format(self.other_item_name)
 
-# This class is used to checkout items in the Other class.
+# This class is used to checkout items in the Other class. It is a ledger: checking an
+# item in only sets checked_in_at, and closed loans are later moved to CheckOutArchive by
+# app/checkouts.py. The partial indexes hold either the open or the closed loans, so
+# finding what is currently out never reads the closed ones and the other way round.
 class CheckOut(db.Model):
+    __table_args__ = (
+        db.Index('ix_check_out_open_tag', 'checkout_asset_tag',
+                 sqlite_where=db.text('checked_in_at IS NULL'), postgresql_where=db.text('checked_in_at IS NULL')),
+        db.Index('ix_check_out_open_timestamp', 'checkout_timestamp', 'check_out_id',
+                 sqlite_where=db.text('checked_in_at IS NULL'), postgresql_where=db.text('checked_in_at IS NULL')),
+        db.Index('ix_check_out_closed', 'checked_in_at', 'check_out_id',
+                 sqlite_where=db.text('checked_in_at IS NOT NULL'),
+                 postgresql_where=db.text('checked_in_at IS NOT NULL')),
+        {'sqlite_autoincrement': True})
+
     def __init__(self, checkout_timestamp, checkout_username, checkout_item_name, checkout_serial_number,
                  checkout_asset_tag):
         self.checkout_timestamp = checkout_timestamp
@@ -233,12 +414,106 @@ class CheckOut(db.Model):
         self.checkout_asset_tag = checkout_asset_tag
 
     check_out_id = db.Column(db.Integer, primary_key=True)
-    checkout_timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    checkout_timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     checkout_username = db.Column(db.String(40))
     checkout_item_name = db.Column(db.String(40))
     checkout_serial_number = db.Column(db.String(40))
     checkout_asset_tag = db.Column(db.String(40))
+    checked_in_at = db.Column(db.DateTime)
+
+    # The loans that have not been checked in. Written exactly like the partial indexes'
+    # condition so the database can use them.
+    @classmethod
+    def is_open(cls):
+        return cls.checked_in_at.is_(None)
 
     def __repr__(self):
         return '<CheckOut {}>'.format(self.checkout_username)
 
+
+# Closed loans older than CHECKOUT_ARCHIVE_AFTER days, moved out of check_out to keep it
+# small. Rows are partitioned by period, the year and month they were checked in as
+# YYYYMM, which leads the index so a month of history is read on its own. The history
+# view pages through this table and the closed loans still in check_out together.
+class CheckOutArchive(db.Model):
+    __tablename__ = 'check_out_archive'
+    __table_args__ = (
+        db.Index('ix_check_out_archive_period', 'period', 'checked_in_at', 'check_out_id'),
+        db.Index('ix_check_out_archive_checked_in_at', 'checked_in_at', 'check_out_id'),
+        db.Index('ix_check_out_archive_tag', 'checkout_asset_tag'))
+
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.Integer, nullable=False)
+    check_out_id = db.Column(db.Integer)
+    checkout_timestamp = db.Column(db.DateTime)
+    checkout_username = db.Column(db.String(40))
+    checkout_item_name = db.Column(db.String(40))
+    checkout_serial_number = db.Column(db.String(40))
+    checkout_asset_tag = db.Column(db.String(40))
+    checked_in_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return '<CheckOutArchive {}>'.format(self.checkout_username)
+
+
+# Flattened text of an employee and their devices, or of an inventory item. The rows are
+# maintained by app/search.py and mirrored into an FTS5 index when running on SQLite.
+class SearchDocument(db.Model):
+    __tablename__ = 'search_document'
+    __table_args__ = (db.Index('ix_search_document_kind_key', 'kind', 'key', unique=True),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10))
+    key = db.Column(db.Integer)
+    body = db.Column(db.Text)
+
+    def __repr__(self):
+        return '<SearchDocument {} {}>'.format(self.kind, self.key)
+
+
+# One row per asset tag across every device and inventory item, pointing at the asset
+# type and row that own the tag and at the employee currently holding it. It is kept
+# up to date by app/assets.py so a scanned tag is resolved with a single index lookup.
+class AssetTag(db.Model):
+    __tablename__ = 'asset_tag'
+    __table_args__ = (db.Index('ix_asset_tag_kind_row_id', 'kind', 'row_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    tag = db.Column(db.String(40), index=True, unique=True)
+    kind = db.Column(db.String(10))
+    row_id = db.Column(db.Integer)
+    employee_id = db.Column(db.Integer, index=True)
+
+    def __repr__(self):
+        return '<AssetTag {}>'.format(self.tag)
+
+
+# One change made to a row through the session: who made it, whether the row was created,
+# updated or deleted, and the changed column values as JSON. Written in batches by
+# app/audit.py and indexed so the history of one record is a single range scan.
+class AuditEvent(db.Model):
+    __tablename__ = 'audit_event'
+    __table_args__ = (db.Index('ix_audit_event_entity', 'entity', 'entity_id', 'timestamp'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    actor = db.Column(db.String(64), index=True)
+    action = db.Column(db.String(10))
+    entity = db.Column(db.String(20))
+    entity_id = db.Column(db.Integer)
+    changes = db.Column(db.Text)
+
+    def __repr__(self):
+        return '<AuditEvent {} {} {}>'.format(self.action, self.entity, self.entity_id)
+
+
+# A single row holding the time of the last write made through the session. Replicas
+# carry a copy of it, so comparing the two tells how far a replica trails the primary.
+class ReplicaHeartbeat(db.Model):
+    __tablename__ = 'replica_heartbeat'
+
+    id = db.Column(db.Integer, primary_key=True)
+    beat = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return '<ReplicaHeartbeat {}>'.format(self.beat)
@@ -0,0 +1,134 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from flask import request, url_for
+from sqlalchemy import and_, or_
+from app import app
+from app.counts import row_counts
+
+
+# Fetches the first limit rows, after offset, of one or more (query, sort, key) sources
+# each ordered by its sort column and key. Rows of several sources, which must carry the
+# same column names, are merged in that order, so every source is read through its own
+# index and no more than limit rows of it are fetched.
+def merged_rows(sources, limit, offset=0, descending=False, cursor=None):
+    rows = []
+    for query, sort, key in sources:
+        if cursor is not None:
+            value, ident = cursor
+            if descending:
+                query = query.filter(or_(sort < value, and_(sort == value, key < ident)))
+            else:
+                query = query.filter(or_(sort > value, and_(sort == value, key > ident)))
+        if descending:
+            query = query.order_by(sort.desc(), key.desc())
+        else:
+            query = query.order_by(sort, key)
+        if len(sources) == 1:
+            return query.limit(limit).offset(offset).all()
+        rows.extend(query.limit(limit + offset).all())
+    sort, key = sources[0][1].key, sources[0][2].key
+    rows.sort(key=lambda row: (getattr(row, sort), getattr(row, key)), reverse=descending)
+    return rows[offset:offset + limit]
+
+
+# One page of a query ordered by a sort column with the primary key as tiebreaker. Instead
+# of an offset, the page starts right after (or ends right before) the row described by a
+# cursor, so deep pages cost the same as the first one and rows do not shift between pages
+# when records are added or removed. Sort columns are expected to be NOT NULL in practice.
+# sources are further (query, sort, key) triples whose rows are merged into the list.
+class KeysetPage(object):
+    def __init__(self, query, sort, key, per_page, after=None, before=None, reverse=False, sources=()):
+        self.sort = sort
+        self.key = key
+        self.per_page = per_page
+        backwards = before is not None and after is None
+        cursor = self.decode(before if backwards else after)
+        # Going back through a list sorted newest first walks the index upwards, and the
+        # other way round.
+        descending = backwards != reverse
+        rows = merged_rows([(query, sort, key)] + list(sources), per_page + 1,
+                           descending=descending, cursor=cursor)
+        more = len(rows) > per_page
+        self.items = rows[:per_page]
+        if backwards:
+            self.items.reverse()
+            self.has_prev, self.has_next = more, cursor is not None
+        else:
+            self.has_prev, self.has_next = cursor is not None, more
+
+    @property
+    def next_cursor(self):
+        return self.encode(self.items[-1]) if self.items else None
+
+    @property
+    def prev_cursor(self):
+        return self.encode(self.items[0]) if self.items else None
+
+    def encode(self, row):
+        value = getattr(row, self.sort.key)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        data = json.dumps([value, getattr(row, self.key.key)], separators=(',', ':'))
+        return urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+    # Returns the (sort value, key) pair of a cursor, or None when it is missing or invalid
+    # so a tampered link simply starts from the first page.
+    def decode(self, cursor):
+        if not cursor:
+            return None
+        try:
+            value, ident = json.loads(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            if value is not None and self.sort.type.python_type is datetime:
+                value = datetime.fromisoformat(value)
+            return value, ident
+        except (ValueError, TypeError):
+            return None
+
+
+# One page of a query addressed by page number. One row more than the page size is
+# fetched to find out whether there is a next page, so no count is needed for the links.
+class OffsetPage(object):
+    def __init__(self, query, sort, key, per_page, page=1, reverse=False, sources=()):
+        page = max(page, 1)
+        rows = merged_rows([(query, sort, key)] + list(sources), per_page + 1,
+                           (page - 1) * per_page, descending=reverse)
+        self.page = page
+        self.per_page = per_page
+        self.items = rows[:per_page]
+        self.has_prev = page > 1
+        self.has_next = len(rows) > per_page
+        self.prev_num = page - 1 if self.has_prev else None
+        self.next_num = page + 1 if self.has_next else None
+
+
+# Returns the page of query asked for by the current request, together with the links to
+# the pages before and after it. PAGINATION_MODE selects cursors ('keyset') or the classic
+# page numbers ('offset'), and reverse lists the newest rows first. The page's total is
+# taken from the row count cache, counted exactly, or skipped altogether depending on
+# PAGINATION_COUNT. Views that filter the query pass the filter's request arguments so
+# the links keep them and the cached count is kept per filter; views whose query always
+# filters the table name the subset with scope. sources lists further (query, sort, key)
+# triples, of other tables with the same columns, merged into the list.
+def paginate(query, endpoint, sort, key, reverse=False, filters=None, scope=None, sources=()):
+    per_page = app.config['RESULTS_PER_PAGE']
+    filters = dict((name, value) for name, value in (filters or {}).items() if value not in (None, ''))
+    if app.config['PAGINATION_MODE'] == 'offset':
+        results = OffsetPage(query, sort, key, per_page, request.args.get('page', 1, type=int), reverse,
+                             sources)
+        next_url = url_for(endpoint, page=results.next_num, **filters) if results.has_next else None
+        prev_url = url_for(endpoint, page=results.prev_num, **filters) if results.has_prev else None
+    else:
+        results = KeysetPage(query, sort, key, per_page, after=request.args.get('after'),
+                             before=request.args.get('before'), reverse=reverse, sources=sources)
+        next_url = url_for(endpoint, after=results.next_cursor, **filters) if results.has_next else None
+        prev_url = url_for(endpoint, before=results.prev_cursor, **filters) if results.has_prev else None
+    results.total = None
+    queries = [(query, key)] + [(source, source_key) for source, source_sort, source_key in sources]
+    if app.config['PAGINATION_COUNT'] == 'cached':
+        count_key = ((scope,) if scope else ()) + tuple(sorted(filters.items()))
+        results.total = sum(row_counts.count(source, source_key.class_.__tablename__, count_key or None)
+                            for source, source_key in queries)
+    elif app.config['PAGINATION_COUNT'] == 'exact':
+        results.total = sum(source.order_by(None).count() for source, source_key in queries)
+    return results, next_url, prev_url
@@ -0,0 +1,59 @@
+from functools import wraps
+from flask import g, flash, redirect, url_for, has_app_context
+from flask_login import current_user
+from app import app, db
+from app.cache import TTLCache
+from app.models import Admin
+
+ADMIN = 'admin'
+
+# Roles resolved in earlier requests, keyed by username.
+role_cache = TTLCache(maxsize=app.config['ROLE_CACHE_SIZE'], ttl=app.config['ROLE_CACHE_TTL'])
+
+
+# Returns the set of roles held by a user. The answer is kept on flask.g for the rest of
+# the request and in role_cache across requests, so the Admin table is only read when
+# the cache entry is missing or has expired.
+def roles_for(username):
+    request_roles = g.setdefault('roles', {})
+    if username in request_roles:
+        return request_roles[username]
+    roles = role_cache.get(username)
+    if roles is None:
+        if db.session.query(Admin.id).filter_by(user=username).first():
+            roles = frozenset([ADMIN])
+        else:
+            roles = frozenset()
+        role_cache.set(username, roles)
+    request_roles[username] = roles
+    return roles
+
+
+# Checks the current user unless another username is given.
+def is_admin(username=None):
+    if username is None:
+        if not current_user.is_authenticated:
+            return False
+        username = current_user.username
+    return ADMIN in roles_for(username)
+
+
+# Must be called whenever a user is added to or removed from a role.
+def invalidate_roles(username):
+    role_cache.pop(username)
+    if has_app_context():
+        g.pop('roles', None)
+
+
+# Use this decorator underneath login_required on views that only admins may use. Anyone
+# else is sent to the given endpoint with a flashed message.
+def admin_required(endpoint='index', message='You are not an admin!'):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not is_admin():
+                flash(message)
+                return redirect(url_for(endpoint))
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
@@ -0,0 +1,142 @@
+import random
+from datetime import datetime
+from functools import wraps
+from time import time
+import flask
+from sqlalchemy import event, select
+from app import app, db
+from app.cache import TTLCache
+from app.database import PRIMARY, REPLICA, sqlite_pragmas, apply_sqlite_pragmas
+from app.models import ReplicaHeartbeat
+
+HEARTBEAT = ReplicaHeartbeat.__table__
+
+
+# The read replicas listed in DATABASE_REPLICA_URLS. A replica is only read from while
+# the last write it has received is at most DATABASE_REPLICA_MAX_LAG seconds old or it has
+# every write of the primary; a replica that lags further or cannot be reached is skipped
+# until it catches up.
+class ReplicaSet(object):
+    def __init__(self, app, db):
+        self.app = app
+        self.db = db
+        self.keys = ['replica{}'.format(number) for number in range(len(app.config['DATABASE_REPLICA_URLS']))]
+        self.max_lag = app.config['DATABASE_REPLICA_MAX_LAG']
+        self.beats = TTLCache(maxsize=len(self.keys) + 1, ttl=app.config['DATABASE_REPLICA_LAG_CHECK'])
+        for key in self.keys:
+            apply_sqlite_pragmas(self.engine(key), sqlite_pragmas(app.config))
+
+    def __bool__(self):
+        return bool(self.keys)
+
+    # The engine of a replica, or of the primary when no key is given.
+    def engine(self, key=None):
+        return self.db.get_engine(self.app, bind=key)
+
+    # Returns the last write recorded in a database as a one element tuple, or None when
+    # the database cannot be read.
+    def heartbeat(self, key=None):
+        beat = self.beats.get(key)
+        if beat is None:
+            try:
+                with self.engine(key).connect() as connection:
+                    beat = (connection.execute(select([HEARTBEAT.c.beat]).where(HEARTBEAT.c.id == 1)).scalar(),)
+            except Exception:
+                app.logger.warning('Could not read the heartbeat of %s', key or 'the primary', exc_info=True)
+                beat = ()
+            self.beats.set(key, beat)
+        return beat or None
+
+    # Seconds for which a replica has been missing writes of the primary, or None when the
+    # replica is unusable. A replica behind the primary is as stale as the last write it
+    # received is old, however close that write was to the primary's latest one, so a
+    # replica that stopped receiving writes ages out instead of staying fresh.
+    def lag(self, key):
+        primary, replica = self.heartbeat(), self.heartbeat(key)
+        if primary is None or replica is None:
+            return None
+        if primary[0] is None or (replica[0] is not None and replica[0] >= primary[0]):
+            return 0
+        if replica[0] is None:
+            return None
+        return (datetime.utcnow() - replica[0]).total_seconds()
+
+    # Returns the engine of a random replica that is fresh enough, or None.
+    def choose(self):
+        fresh = [key for key in self.keys if self.lag(key) is not None and self.lag(key) <= self.max_lag]
+        return self.engine(random.choice(fresh)) if fresh else None
+
+    # Whether a replica engine handed out by choose() is missing writes of the primary.
+    def lagging(self, engine):
+        for key in self.keys:
+            if engine is not None and self.engine(key) is engine:
+                return self.lag(key) != 0
+        return False
+
+    # A stand-in for real replication when the primary and the replicas are SQLite files:
+    # copies the primary over every replica with SQLite's online backup.
+    def sync(self):
+        for key in self.keys:
+            if self.engine().dialect.name != 'sqlite' or self.engine(key).dialect.name != 'sqlite':
+                raise RuntimeError('Only SQLite replicas can be synced, use the database replication instead')
+            source, target = self.engine().raw_connection(), self.engine(key).raw_connection()
+            try:
+                source.connection.backup(target.connection)
+            finally:
+                target.close()
+                source.close()
+        self.beats.clear()
+
+
+replica_set = ReplicaSet(app, db)
+db.replicas = replica_set
+
+
+# Use this decorator underneath login_required to choose where the queries of a view go.
+# db_route() lets a read-only view read from a replica and db_route(PRIMARY) keeps a view
+# on the primary when DATABASE_DEFAULT_ROUTE sends the others to the replicas.
+def db_route(route=REPLICA):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            db.session.info['route'] = route
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+# A user who has just written something reads from the primary for the next
+# DATABASE_REPLICA_STICKY seconds, so the page shown after a form is saved has the change.
+@app.before_request
+def read_own_writes():
+    if replica_set and flask.session.get('primary_until', 0) > time():
+        db.session.info['pinned'] = True
+
+
+# Every flush or bulk statement that writes also stamps the heartbeat on the primary, in
+# the same transaction, and keeps the rest of the request on the primary.
+@event.listens_for(db.session, 'after_flush')
+def stamp_heartbeat(session, flush_context):
+    record_write(session)
+
+
+@event.listens_for(db.session, 'after_bulk_update')
+@event.listens_for(db.session, 'after_bulk_delete')
+def stamp_heartbeat_bulk(context):
+    record_write(context.session)
+
+
+def record_write(session):
+    session.info['wrote'] = True
+    if not replica_set:
+        return
+    connection = session.connection()
+    now = datetime.utcnow()
+    if connection.execute(HEARTBEAT.update().where(HEARTBEAT.c.id == 1).values(beat=now)).rowcount == 0:
+        connection.execute(HEARTBEAT.insert().values(id=1, beat=now))
+
+
+@event.listens_for(db.session, 'after_commit')
+def stick_to_primary(session):
+    if replica_set and session.info.get('wrote') and flask.has_request_context():
+        flask.session['primary_until'] = time() + app.config['DATABASE_REPLICA_STICKY']
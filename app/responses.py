@@ -0,0 +1,124 @@
+from datetime import datetime
+from functools import wraps
+from hashlib import sha1
+from threading import Lock
+from time import time
+from uuid import uuid4
+from flask import request, session, make_response
+from flask_login import current_user
+from sqlalchemy import event
+from app import app, db
+from app.cache import TTLCache
+from app.permissions import is_admin
+
+
+# A version counter and last modification time per table, bumped when a transaction that
+# changed the table commits. Together they tell whether a cached page is still current
+# without querying the table. The counters live in this process only, so ETags also carry
+# the start of the current RESPONSE_CACHE_TTL period: other worker processes' changes show
+# up at the latest when it rolls over.
+class TableVersions(object):
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.boot = uuid4().hex
+        self.started = datetime.utcnow()
+        self.versions = {}
+        self.lock = Lock()
+
+    def bump(self, tables):
+        now = datetime.utcnow()
+        with self.lock:
+            for table in tables:
+                version, modified = self.versions.get(table, (0, self.started))
+                self.versions[table] = (version + 1, now)
+
+    # Returns a token for the current state of the tables and the time they last changed.
+    def state(self, tables):
+        period = int(time() // self.ttl) if self.ttl else 0
+        with self.lock:
+            versions = [self.versions.get(table, (0, self.started)) for table in tables]
+        modified = max([self.started, datetime.utcfromtimestamp(period * self.ttl)] +
+                       [modified for version, modified in versions])
+        token = '{}:{}:{}'.format(self.boot, period, ','.join(str(version) for version, modified in versions))
+        return token, modified.replace(microsecond=0)
+
+
+table_versions = TableVersions(app.config['RESPONSE_CACHE_TTL'])
+
+# Rendered pages by request. Any object with the get and set methods of TTLCache can be
+# put here instead, such as a client for a shared cache.
+response_cache = TTLCache(maxsize=app.config['RESPONSE_CACHE_SIZE'], ttl=app.config['RESPONSE_CACHE_TTL'])
+
+
+# Use this decorator as the last one on list views whose page only depends on the given
+# models and the request. GET requests are answered with 304 when the browser's ETag is
+# still current and from response_cache when another tab already rendered the page. The
+# key includes the user, their role and their session's CSRF secret because the pages
+# show the user's links and forms. Pages whose rendering changed the session, for example
+# by showing flashed messages, and pages read from a replica that is behind are not cached.
+def cached_response(*models):
+    tables = sorted(model.__tablename__ for model in models)
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != 'GET' or not app.config['RESPONSE_CACHE_SIZE']:
+                return f(*args, **kwargs)
+            key = repr((request.endpoint, sorted(request.view_args.items()), sorted(request.args.items(multi=True)),
+                        current_user.get_id(), is_admin(), session.get('csrf_token')))
+            token, modified = table_versions.state(tables)
+            etag = sha1((key + token).encode('utf-8')).hexdigest()
+            if etag in request.if_none_match or \
+                    (not request.if_none_match and request.if_modified_since and
+                     request.if_modified_since >= modified):
+                response = make_response('', 304)
+            else:
+                cached = response_cache.get(key)
+                if cached is not None and cached[0] == etag:
+                    response = make_response(cached[1])
+                    response.mimetype = cached[2]
+                else:
+                    response = make_response(f(*args, **kwargs))
+                    if response.status_code != 200 or session.modified or \
+                            db.replicas and db.replicas.lagging(db.session.info.get('replica')):
+                        return response
+                    response_cache.set(key, (etag, response.get_data(), response.mimetype))
+            response.set_etag(etag)
+            response.last_modified = modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return decorated_function
+    return decorator
+
+
+# Tables changed by a flush or a bulk statement are bumped once the transaction commits.
+@event.listens_for(db.session, 'after_flush')
+def collect_changed_tables(session, flush_context):
+    changed = session.info.setdefault('changed_tables', set())
+    for objects in (session.new, session.dirty, session.deleted):
+        changed.update(obj.__table__.name for obj in objects)
+
+
+@event.listens_for(db.session, 'after_bulk_update')
+@event.listens_for(db.session, 'after_bulk_delete')
+def collect_bulk_changed_table(context):
+    context.session.info.setdefault('changed_tables', set()).add(context.primary_table.name)
+
+
+# Adds tables changed by statements the session does not see, such as the rows removed by
+# an ON DELETE CASCADE, to the session's transaction.
+def record_changed_tables(session, tables):
+    session.info.setdefault('changed_tables', set()).update(tables)
+
+
+@event.listens_for(db.session, 'after_commit')
+def bump_table_versions(session):
+    changed = session.info.pop('changed_tables', None)
+    if changed:
+        table_versions.bump(changed)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_changed_tables(session):
+    session.info.pop('changed_tables', None)
@@ -1,39 +1,65 @@
 from datetime import datetime
-from flask import render_template, flash, redirect, url_for, request
+from flask import render_template, flash, redirect, url_for, request, jsonify, abort, \
+    Response, stream_with_context
 from werkzeug.urls import url_parse
+from sqlalchemy.exc import IntegrityError
 from flask_login import current_user, login_user, logout_user, login_required
-from app import app, db
+from app import app, db, audit_log
 from app.forms import LoginForm, RegistrationForm, ResetPasswordRequestForm, ResetPasswordForm,\
     EditProfileForm, AdminUserForm, ImportUserForm, EditImportForm, SearchUserForm, \
-    InventoryForm, CheckOutForm, TonerForm
+    InventoryForm, CheckOutForm, BatchCheckOutForm, TonerForm, ImportFileForm
 from app.models import User, Admin, Users, Monitors, Desktop, Laptop, \
-    Printer, Scanner, Toner, Other, CheckOut
-from app.tables import Results, Inventory, Checkout, TonerInventory
-from sqlalchemy import or_
+    Printer, Scanner, Toner, Other, CheckOut, CheckOutArchive, AuditEvent, invalidate_user
+from app.tables import Results, Inventory, Checkout, CheckoutHistory, CheckoutResults, TonerInventory, LowStock, AuditEvents
 import os
-import logging
-from logging.handlers import RotatingFileHandler
+import codecs
 from app.email import send_password_reset_email
-
-# This snippet of code allows logging of commits within the following functions:
-# manage_users, import_user, edit.
-if not os.path.exists('logs'):
-    os.mkdir('logs')
-file_handler = RotatingFileHandler('logs/commit.log')
-file_handler.setFormatter(logging.Formatter(
-    '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
-file_handler.setLevel(logging.INFO)
-app.logger.addHandler(file_handler)
-app.logger.setLevel(logging.INFO)
+from app.activity import last_seen_tracker
+from app.permissions import admin_required, is_admin, invalidate_roles
+from app.search import search_index, EMPLOYEE, ITEM
+from app.pagination import paginate
+from app.assets import asset_registry, ITEM as ITEM_KIND
+from app.importer import import_employees
+from app.exporter import export, DATASETS, FORMATS
+from app.replicas import db_route
+from app.responses import cached_response
+from app.stock import adjust_toner, UNKNOWN
+from app.checkouts import check_out, check_in, OK as CHECKOUT_OK
+from app.employees import delete_employees
+from app.api import RESOURCES, api_response, fetch, upsert
+
+# The audit log lines for an employee created or changed through the forms. The values
+# come from employee_fields and are only formatted by the log listener thread.
+EMPLOYEE_FIELDS = ('[Employee ID]: %s [Username]: %s [First Name]: %s [Last Name]: %s [Email]: %s '
+                   '[Room Number]: %s [Monitor 1 Serial Number]: %s [Monitor 1 Asset Tag]: %s '
+                   '[Monitor 2 Serial Number]: %s [Monitor 2 Asset Tag]: %s [Desktop Name]: %s '
+                   '[Desktop Serial Number]: %s [Desktop Asset Tag]: %s [Laptop Name]: %s '
+                   '[Laptop Serial Number]: %s [Laptop Asset Tag]: %s [Printer Model]: %s '
+                   '[Printer Serial Number]: %s [Printer Asset Tag]: %s [Scanner Model]: %s '
+                   '[Scanner Serial Number]: %s [Scanner Asset Tag]: %s')
+EMPLOYEE_CREATED = '[Committed by user]: %s User created: ' + EMPLOYEE_FIELDS
+EMPLOYEE_CHANGED = '[Committed by user]: %s Changed to: ' + EMPLOYEE_FIELDS
+# The pages the toner stock buttons may return to
+TONER_PAGES = ('search_toner', 'low_stock')
+
+
+def employee_fields(users, monitor1, monitor2, desktop, laptop, printer, scanner):
+    return (users.employee_id, users.username, users.first_name, users.last_name, users.email,
+            users.room_number, monitor1.monitor_serial_number, monitor1.monitor_asset_tag,
+            monitor2.monitor_serial_number, monitor2.monitor_asset_tag, desktop.desktop_name,
+            desktop.desktop_serial_number, desktop.desktop_asset_tag, laptop.laptop_name,
+            laptop.laptop_serial_number, laptop.laptop_asset_tag, printer.printer_model,
+            printer.printer_serial_number, printer.printer_asset_tag, scanner.scanner_model,
+            scanner.scanner_serial_number, scanner.scanner_asset_tag)
 
 
 # Each time a user is logged into the inventory system, this function
-# logs the time of login in a variable.
+# logs the time of login in a variable. The write is buffered by the last seen
+# tracker so page views do not take a write lock, and static files are skipped.
 @ app.before_request
 def before_request():
-    if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
+    if request.endpoint != 'static' and current_user.is_authenticated:
+        last_seen_tracker.touch(current_user._get_current_object())
 
 # Loads the homepage
 @app.route('/', methods=['GET', 'POST'])
@@ -108,6 +134,7 @@ def reset_password(token):
     if form.validate_on_submit():
         user.set_password(form.password.data)
         db.session.commit()
+        invalidate_user(user.id)
         flash('Your password has been reset.')
         return redirect(url_for('login'))
     return render_template('reset_password.html', form=form)
@@ -115,6 +142,7 @@ def reset_password(token):
 # Used to locate current user in system by checking against username.
 @app.route('/user/<username>')
 @login_required
+@db_route()
 def user(username):
     user = User.query.filter_by(username=username).first_or_404()
     return render_template('user.html', user=user)
@@ -128,6 +156,7 @@ def edit_profile():
         current_user.email = form.email.data
         current_user.about_me = form.about_me.data
         db.session.commit()
+        invalidate_user(current_user.id)
         flash('Your changes have been saved.')
         return redirect(url_for('edit_profile'))
     elif request.method == 'GET':
@@ -140,54 +169,55 @@ def edit_profile():
 # deleting records in the database also.
 @app.route('/admin', methods=['GET', 'POST'])
 @login_required
+@admin_required(message='Sorry you are not admin!')
 def manage_users():
-    if Admin.query.filter_by(user=current_user.username).first():
-        form = AdminUserForm(request.form)
-        form.select_field.choices = [(u.id, u.username) for u in User.query.all()]
-        target = request.form.get('select_field')
-        option = request.form.get('radio_field')
-        if form.validate_on_submit() and option == 'option1':
-            if isinstance(Admin.query.filter_by(id=target).first(), Admin):
-                flash('{} is already an Administrator'.format(User.query.get(target).username))
+    form = AdminUserForm(request.form)
+    form.select_field.render_kw = {'data-typeahead': url_for('user_lookup')}
+    option = request.form.get('radio_field')
+    if form.validate_on_submit():
+        target = User.query.get(form.select_field.data)
+        if option == 'option1':
+            if is_admin(target.username):
+                flash('{} is already an Administrator'.format(target.username))
                 return redirect(url_for('manage_users'))
 
             else:
-                admin = Admin(str(User.query.get(target).username),
-                              admin_username=User.query.get(target))
+                admin = Admin(str(target.username), admin_username=target)
                 db.session.add(admin)
                 db.session.commit()
-                app.logger.info('[Committed by user]: ' + str(current_user.username) + ' ' + str(admin.user) + ' created')
+                invalidate_roles(target.username)
+                invalidate_user(target.id)
+                audit_log.info('[Committed by user]: %s %s created', current_user.username, admin.user)
                 flash('You added {} as an administrator'.format(admin.user))
                 return redirect(url_for('manage_users'))
 
-        if form.validate_on_submit() and option == 'option2':
-            if Admin.query.filter_by(id=target).first().user == current_user.username:
+        if option == 'option2':
+            if target.username == current_user.username:
                 flash('You cannot remove yourself')
                 return redirect(url_for('manage_users'))
 
             else:
-                admin = Admin.query.filter_by(user=current_user.username).first()
-                deleted = Admin.query.filter_by(user=User.query.get(target).username).first()
-                admin.delete_admin(deleted)
-                app.logger.info('[Committed by user]: ' + str(current_user.username) + ' ' + str(deleted.user) + ' removed from Administrator group')
+                deleted = Admin.query.filter_by(user=target.username).first_or_404()
+                Admin.delete_admin(deleted)
+                invalidate_roles(deleted.user)
+                invalidate_user(target.id)
+                audit_log.info('[Committed by user]: %s %s removed from Administrator group',
+                               current_user.username, deleted.user)
                 flash('{} was removed as an admin'.format(deleted.user))
                 return redirect(url_for('manage_users'))
 
-        if form.validate_on_submit() and option == 'option3':
-            if User.query.filter_by(id=target).first().username == current_user.username:
+        if option == 'option3':
+            if target.username == current_user.username:
                 flash('You cannot delete yourself')
                 return redirect(url_for('manage_users'))
 
             else:
-                admin = Admin.query.filter_by(user=current_user.username).first()
-                deleted = User.query.filter_by(username=User.query.get(target).username).first()
-                admin.delete_user(deleted)
-                app.logger.info('[Committed by user]: ' + str(current_user.username) + ' ' + str(deleted.username) + ' was deleted from application')
-                flash('{} was deleted'.format(deleted.username))
+                Admin.delete_user(target)
+                invalidate_roles(target.username)
+                audit_log.info('[Committed by user]: %s %s was deleted from application',
+                               current_user.username, target.username)
+                flash('{} was deleted'.format(target.username))
                 return redirect(url_for('manage_users'))
-    else:
-        flash('Sorry you are not admin!')
-        return redirect(url_for('index'))
     return render_template('admin.html', title='Admin Console', form=form)
 
 # Imports users into inventory system by using the ImportUserForm.
@@ -229,96 +259,83 @@ def import_user():
             db.session.add(laptop)
             db.session.add(printer)
             db.session.add(scanner)
+            audit_log.info(EMPLOYEE_CREATED, current_user.username,
+                           *employee_fields(users, monitor1, monitor2, desktop, laptop, printer, scanner))
             db.session.commit()
-            app.logger.info('[Committed by user]: ' + str(current_user.username) + ' User created: ' + ' [Employee ID]: ' + str(users.employee_id) + ' ' +
-                            '[Username]: ' + str(users.username) + ' ' +
-                            '[First Name]: ' + str(users.first_name) + ' ' +
-                            '[Last Name]: ' + str(users.last_name) + ' ' +
-                            '[Email]: ' + str(users.email) + ' ' +
-                            '[Room Number]: ' + str(users.room_number) + ' ' +
-                            '[Monitor 1 Serial Number]: ' + str(monitor1.monitor_serial_number) + ' ' +
-                            '[Monitor 1 Asset Tag]: ' + str(monitor1.monitor_asset_tag) + ' ' +
-                            '[Monitor 2 Serial Number]: ' + str(monitor2.monitor_serial_number) + ' ' +
-                            '[Monitor 2 Asset Tag]: ' + str(monitor2.monitor_asset_tag) + ' ' +
-                            '[Desktop Name]: ' + str(desktop.desktop_name) + ' ' +
-                            '[Desktop Serial Number]: ' + str(desktop.desktop_serial_number) + ' ' +
-                            '[Desktop Asset Tag]: ' + str(desktop.desktop_asset_tag) + ' ' +
-                            '[Laptop Name]: ' + str(laptop.laptop_name) + ' ' +
-                            '[Laptop Serial Number]: ' + str(laptop.laptop_serial_number) + ' ' +
-                            '[Laptop Asset Tag]: ' + str(laptop.laptop_asset_tag) + ' ' +
-                            '[Printer Model]: ' + str(printer.printer_model) + ' ' +
-                            '[Printer Serial Number]: ' + str(printer.printer_serial_number) + ' ' +
-                            '[Printer Asset Tag]: ' + str(printer.printer_asset_tag) + ' ' +
-                            '[Scanner Model]: ' + str(scanner.scanner_model) + ' ' +
-                            '[Scanner Serial Number]: ' + str(scanner.scanner_serial_number) + ' ' +
-                            '[Scanner Asset Tag]: ' + str(scanner.scanner_asset_tag))
             flash('User submitted!')
             return redirect(url_for('import_user'))
-    return render_template('import_user.html', title='Import Users', form=form)
+    return render_template('import_user.html', title='Import Users', form=form,
+                           upload_form=ImportFileForm())
 
-# Creates a query of users and each item that assigned to their name. More functionality will
-# be added to the search function to query by username.
+# Imports a whole CSV or JSONL file of employees through the bulk importer. The upload is
+# decoded and read line by line rather than loaded into memory, and the rejected rows are
+# listed on the page.
+@app.route('/import_user/upload', methods=['POST'])
+@login_required
+def import_upload():
+    upload_form = ImportFileForm()
+    if upload_form.validate_on_submit():
+        upload = upload_form.file.data
+        format = os.path.splitext(upload.filename)[1].lstrip('.').lower()
+        report = import_employees(codecs.getreader('utf-8-sig')(upload.stream), format)
+        audit_log.info('[Committed by user]: %s imported %s users from %s',
+                       current_user.username, report.imported, upload.filename)
+        flash('{} users imported, {} rows rejected'.format(report.imported, len(report.errors)))
+        return render_template('import_user.html', title='Import Users', form=ImportUserForm(formdata=None),
+                               upload_form=upload_form, errors=report.errors[:app.config['IMPORT_ERRORS_SHOWN']])
+    return render_template('import_user.html', title='Import Users', form=ImportUserForm(formdata=None),
+                           upload_form=upload_form)
+
+# Creates a query of users and each item that assigned to their name. A search looks the
+# words up in the full text index, which matches the start of any name, email, room, serial
+# number or asset tag of an employee and their devices, as well as the inventory items.
 @app.route('/search', methods=['GET', 'POST'])
 @login_required
+@db_route()
+@cached_response(Users)
 def search_results():
     form = SearchUserForm()
     target = form.search.data
-    search = db.session.query(Users.employee_id, Users.username, Users.first_name,
-                                Users.last_name, Users.email, Users.room_number)\
-                                .filter(or_(Users.username == target, Users.first_name == target,
-                                        Users.last_name == target, Users.email == target,
-                                        Users.room_number == target))
 
-    if form.validate_on_submit() and search:
+    if form.validate_on_submit() and target:
+        hits = search_index.search(target, app.config['SEARCH_RESULTS_LIMIT'])
+        rank = {hit: position for position, hit in enumerate(hits)}
+        employee_ids = [key for kind, key in hits if kind == EMPLOYEE]
+        item_ids = [key for kind, key in hits if kind == ITEM]
+        search = sorted(Users.query.filter(Users.employee_id.in_(employee_ids)),
+                        key=lambda row: rank[(EMPLOYEE, row.employee_id)]) if employee_ids else []
+        items = sorted(Other.query.filter(Other.others_id.in_(item_ids)),
+                       key=lambda row: rank[(ITEM, row.others_id)]) if item_ids else []
         table = Results(search, border=True)
-        return render_template('search.html', table=table, title='Search', search=search,
-                               form=form, target=target)
+        items_table = Inventory(items, border=True) if items else None
+        return render_template('search.html', table=table, items_table=items_table, title='Search',
+                               search=search, form=form, target=target)
     else:
-        page = request.args.get('page', 1, type=int)
-        results = db.session.query(Users.employee_id, Users.username, Users.first_name,
-                       Users.last_name, Users.email, Users.room_number).order_by(Users.first_name).paginate(page, app.config['RESULTS_PER_PAGE'], False)
+        results, next_url, prev_url = paginate(
+            db.session.query(Users.employee_id, Users.username, Users.first_name,
+                             Users.last_name, Users.email, Users.room_number),
+            'search_results', Users.first_name, Users.employee_id)
 
         table = Results(results.items, border=True)
-        next_url = url_for('search_results', page=results.next_num) if results.has_next else None
-        prev_url = url_for('search_results', page=results.prev_num) if results.has_prev else None
         return render_template('search.html', table=table, title='Search', next_url=next_url, prev_url=prev_url, results=results, form=form)
 
 # The item/<int:id> argument is necessary for the edit link in the Results table to link it back
-# to the user in question. The parameters are in dictionary format.
+# to the user in question. The parameters are in dictionary format. The employee and all of their
+# devices are loaded once with Users.with_assets and shared by the form and the update.
+# Devices the employee is missing show up empty and are created when the form is saved.
 @app.route('/item/<int:id>', methods=['GET', 'POST'])
 @login_required
 def edit(id):
+        users = Users.with_assets(id)
+        devices = users.device_slots()
+        monitor = devices[:2]
+        desktop, laptop, printer, scanner = devices[2:]
         form = EditImportForm()
-        form.username.data = Users.query.filter_by(employee_id=id).first().username
-        form.first_name.data = Users.query.filter_by(employee_id=id).first().first_name
-        form.last_name.data = Users.query.filter_by(employee_id=id).first().last_name
-        form.email.data = Users.query.filter_by(employee_id=id).first().email
-        form.room_number.data = Users.query.filter_by(employee_id=id).first().room_number
-        form.monitor_serial_number1.data = Monitors.query.filter_by(monitor_reference_id=id).all()[0].monitor_serial_number
-        form.monitor_asset_tag1.data = Monitors.query.filter_by(monitor_reference_id=id).all()[0].monitor_asset_tag
-        form.monitor_serial_number2.data = Monitors.query.filter_by(monitor_reference_id=id).all()[1].monitor_serial_number
-        form.monitor_asset_tag2.data = Monitors.query.filter_by(monitor_reference_id=id).all()[1].monitor_asset_tag
-        form.desktop_name.data = Desktop.query.filter_by(desktop_reference_id=id).first().desktop_name
-        form.desktop_serial_number.data = Desktop.query.filter_by(desktop_reference_id=id).first().desktop_serial_number
-        form.desktop_asset_tag.data = Desktop.query.filter_by(desktop_reference_id=id).first().desktop_asset_tag
-        form.laptop_name.data = Laptop.query.filter_by(laptop_reference_id=id).first().laptop_name
-        form.laptop_serial_number.data = Laptop.query.filter_by(laptop_reference_id=id).first().laptop_serial_number
-        form.laptop_asset_tag.data = Laptop.query.filter_by(laptop_reference_id=id).first().laptop_asset_tag
-        form.printer_model.data = Printer.query.filter_by(printer_reference_id=id).first().printer_model
-        form.printer_serial_number.data = Printer.query.filter_by(printer_reference_id=id).first().printer_serial_number
-        form.printer_asset_tag.data = Printer.query.filter_by(printer_reference_id=id).first().printer_asset_tag
-        form.scanner_model.data = Scanner.query.filter_by(scanner_reference_id=id).first().scanner_model
-        form.scanner_serial_number.data = Scanner.query.filter_by(scanner_reference_id=id).first().scanner_serial_number
-        form.scanner_asset_tag.data = Scanner.query.filter_by(scanner_reference_id=id).first().scanner_asset_tag
 
         if form.validate_on_submit():
-            form = EditImportForm()
-            users = Users.query.filter_by(employee_id=id).first()
-            monitor = Monitors.query.filter_by(monitor_reference_id=id).all()
-            desktop = Desktop.query.filter_by(desktop_reference_id=id).first()
-            laptop = Laptop.query.filter_by(laptop_reference_id=id).first()
-            printer = Printer.query.filter_by(printer_reference_id=id).first()
-            scanner = Scanner.query.filter_by(scanner_reference_id=id).first()
+            for device in devices:
+                if device.asset_id is None:
+                    users.assets.append(device)
             users.username = form.username.data
             users.first_name = form.first_name.data
             users.last_name = form.last_name.data
@@ -340,50 +357,71 @@ def edit(id):
             scanner.scanner_model = form.scanner_model.data
             scanner.scanner_serial_number = form.scanner_serial_number.data
             scanner.scanner_asset_tag = form.scanner_asset_tag.data
-            db.session.commit()
-            app.logger.info('[Committed by user]: ' + str(current_user.username) + ' Changed to: ' + '[Employee ID]: ' +
-                            '[Username]: ' + str(users.username) + ' ' +
-                            '[First Name]: ' + str(users.first_name) + ' ' +
-                            '[Last Name]: ' + str(users.last_name) + ' ' +
-                            '[Email]: ' + str(users.email) + ' ' +
-                            '[Room Number]: ' + str(users.room_number) + ' ' +
-                            '[Monitor 1 Serial Number]: ' + str(monitor[0].monitor_serial_number) + ' ' +
-                            '[Monitor 1 Asset Tag]: ' + str(monitor[0].monitor_asset_tag) + ' ' +
-                            '[Monitor 2 Serial Number]: ' + str(monitor[1].monitor_serial_number) + ' ' +
-                            '[Monitor 2 Asset Tag]: ' + str(monitor[1].monitor_asset_tag) + ' ' +
-                            '[Desktop Name]: ' + str(desktop.desktop_name) + ' ' +
-                            '[Desktop Serial Number]: ' + str(desktop.desktop_serial_number) + ' ' +
-                            '[Desktop Asset Tag]: ' + str(desktop.desktop_asset_tag) + ' ' +
-                            '[Laptop Name]: ' + str(laptop.laptop_name) + ' ' +
-                            '[Laptop Serial Number]: ' + str(laptop.laptop_serial_number) + ' ' +
-                            '[Laptop Asset Tag]: ' + str(laptop.laptop_asset_tag) + ' ' +
-                            '[Printer Model]: ' + str(printer.printer_model) + ' ' +
-                            '[Printer Serial Number]: ' + str(printer.printer_serial_number) + ' ' +
-                            '[Printer Asset Tag]: ' + str(printer.printer_asset_tag) + ' ' +
-                            '[Scanner Model]: ' + str(scanner.scanner_model) + ' ' +
-                            '[Scanner Serial Number]: ' + str(scanner.scanner_serial_number) + ' ' +
-                            '[Scanner Asset Tag]: ' + str(scanner.scanner_asset_tag))
+            audit_log.info(EMPLOYEE_CHANGED, current_user.username,
+                           *employee_fields(users, monitor[0], monitor[1], desktop, laptop, printer, scanner))
             db.session.commit()
             flash('User updated!')
             return redirect(url_for('search_results'))
+        elif request.method == 'GET':
+            form.username.data = users.username
+            form.first_name.data = users.first_name
+            form.last_name.data = users.last_name
+            form.email.data = users.email
+            form.room_number.data = users.room_number
+            form.monitor_serial_number1.data = monitor[0].monitor_serial_number
+            form.monitor_asset_tag1.data = monitor[0].monitor_asset_tag
+            form.monitor_serial_number2.data = monitor[1].monitor_serial_number
+            form.monitor_asset_tag2.data = monitor[1].monitor_asset_tag
+            form.desktop_name.data = desktop.desktop_name
+            form.desktop_serial_number.data = desktop.desktop_serial_number
+            form.desktop_asset_tag.data = desktop.desktop_asset_tag
+            form.laptop_name.data = laptop.laptop_name
+            form.laptop_serial_number.data = laptop.laptop_serial_number
+            form.laptop_asset_tag.data = laptop.laptop_asset_tag
+            form.printer_model.data = printer.printer_model
+            form.printer_serial_number.data = printer.printer_serial_number
+            form.printer_asset_tag.data = printer.printer_asset_tag
+            form.scanner_model.data = scanner.scanner_model
+            form.scanner_serial_number.data = scanner.scanner_serial_number
+            form.scanner_asset_tag.data = scanner.scanner_asset_tag
         return render_template('edit_import.html', title='Edit User', form=form)
 
 # This allows anyone in the Admin class to delete users in the inventory system
 @app.route('/delete_users/<int:id>', methods=['GET', 'POST'])
 @login_required
+@admin_required('search_results')
 def delete_users(id):
-    if isinstance(Admin.query.filter_by(user=current_user.username).first(), Admin):
-        admin = Admin.query.filter_by(user=current_user.username).first()
-        deleted = Users.query.filter_by(employee_id=id).first()
-        admin.delete_users(deleted)
-        app.logger.info('[Committed by user]: ' + str(current_user.username) + ' Changed to: ' +
-                        '[Username]: ' + str(deleted.username) + ' was deleted')
+    username = db.session.query(Users.username).filter_by(employee_id=id).scalar()
+    if username is None:
+        abort(404)
+    delete_employees([id])
+    audit_log.info('[Committed by user]: %s Changed to: [Username]: %s was deleted',
+                   current_user.username, username)
+    db.session.commit()
+    flash('Record Deleted!')
+    return redirect(url_for('search_results'))
+
+# Deletes many employees and all of their devices in one transaction, for example a whole
+# department that left. Takes {"employee_ids": [...]} or {"room_number": "..."}; with
+# "dry_run": true it only answers how many employees and devices would be deleted.
+@app.route('/employees/delete', methods=['POST'])
+@login_required
+@admin_required('search_results')
+def delete_employees_batch():
+    data = request.get_json(silent=True)
+    data = data if isinstance(data, dict) else {}
+    ids = data.get('employee_ids')
+    if isinstance(data.get('room_number'), str) and ids is None:
+        ids = [row[0] for row in db.session.query(Users.employee_id).filter_by(room_number=data['room_number'])]
+    if not isinstance(ids, list) or not all(isinstance(employee_id, int) for employee_id in ids):
+        return jsonify(error='Expected {"employee_ids": [...]} or {"room_number": "..."}'), 400
+    dry_run = data.get('dry_run') is True
+    counts = delete_employees(ids, dry_run)
+    if not dry_run and counts['employees']:
+        audit_log.info('[Committed by user]: %s Changed to: [Employee IDs]: %s were deleted with %s devices',
+                       current_user.username, sorted(set(ids)), counts['assets'])
         db.session.commit()
-        flash('Record Deleted!')
-        return redirect(url_for('search_results'))
-    else:
-        flash('You are not an admin!')
-        return redirect(url_for('search_results'))
+    return jsonify(dry_run=dry_run, **counts)
 
 # This function allows you to add an item to the inventory database
 @app.route('/add_item', methods=['GET', 'POST'])
@@ -396,12 +434,10 @@ def add_item():
                               other_serial_number=form.other_serial_number.data,
                          other_asset_tag=form.other_asset_tag.data)
             db.session.add(inventory)
+            audit_log.info('[Committed by user]: %s Changed to: [Item Name]: %s [Item Serial Number]: %s '
+                           '[Item Asset Tag]: %s', current_user.username, inventory.other_item_name,
+                           inventory.other_serial_number, inventory.other_asset_tag)
             db.session.commit()
-            app.logger.info(
-                '[Committed by user]: ' + str(current_user.username) + ' Changed to: ' + '[Item Name]: ' + str(
-                    inventory.other_item_name) + ' ' +
-                '[Item Serial Number]: ' + str(inventory.other_serial_number) + ' ' +
-                '[Item Asset Tag]: ' + str(inventory.other_asset_tag))
             flash('{} added to inventory'.format(inventory.other_item_name))
             return redirect(url_for('add_item'))
     return render_template('add_item.html', title='Add Item', form=form)
@@ -409,15 +445,15 @@ def add_item():
 # Allows you to search items in the database
 @app.route('/search_inventory', methods=['GET', 'POST'])
 @login_required
+@db_route()
+@cached_response(Other)
 def search_inventory():
-    page = request.args.get('page', 1, type=int)
-    results = db.session.query(Other.others_id, Other.other_item_name, Other.other_serial_number,
-                               Other.other_asset_tag)\
-        .order_by(Other.other_item_name).paginate(page, app.config['RESULTS_PER_PAGE'], False)
+    results, next_url, prev_url = paginate(
+        db.session.query(Other.others_id, Other.other_item_name, Other.other_serial_number,
+                         Other.other_asset_tag),
+        'search_inventory', Other.other_item_name, Other.others_id, scope=ITEM_KIND)
 
     table = Inventory(results.items, border=True)
-    next_url = url_for('search_inventory', page=results.next_num) if results.has_next else None
-    prev_url = url_for('search_inventory', page=results.prev_num) if results.has_prev else None
 
     return render_template('search_inventory.html', table=table, title='Search Inventory',
                            next_url=next_url, prev_url=prev_url, results=results)
@@ -436,10 +472,10 @@ def edit_inventory(ids):
             inventory.other_item_name = form.other_item_name.data
             inventory.other_serial_number = form.other_serial_number.data
             inventory.other_asset_tag = form.other_asset_tag.data
+            audit_log.info('[Committed by user]: %s Changed to: [Item Name]: %s [Item Serial Number]: %s '
+                           '[Item Asset Tag]: %s', current_user.username, inventory.other_item_name,
+                           inventory.other_serial_number, inventory.other_asset_tag)
             db.session.commit()
-            app.logger.info('[Committed by user]: ' + str(current_user.username) + ' Changed to: ' + '[Item Name]: ' + str(inventory.other_item_name) + ' ' +
-                            '[Item Serial Number]: ' + str(inventory.other_serial_number) + ' ' +
-                            '[Item Asset Tag]: ' + str(inventory.other_asset_tag))
             flash('Inventory record updated!')
             return redirect(url_for('search_inventory'))
         return render_template('edit_inventory.html', title='Edit Item', form=form, record=record)
@@ -447,85 +483,227 @@ def edit_inventory(ids):
 # Use this function to delete a specific item in your database.
 @app.route('/delete_inventory/<int:ids>', methods=['GET', 'POST'])
 @login_required
+@admin_required('search_inventory')
 def delete_inventory(ids):
-    if isinstance(Admin.query.filter_by(user=current_user.username).first(), Admin):
-        admin = Admin.query.filter_by(user=current_user.username).first()
-        deleted = Other.query.filter_by(others_id=ids).first()
-        admin.delete_item(deleted)
-        app.logger.info('[Committed by user]: ' + str(current_user.username) + ' Changed to: ' +
-                        '[Item]: ' + str(deleted.other_item_name) + ' was deleted')
-        db.session.commit()
-        flash('Record Deleted!')
-        return redirect(url_for('search_inventory'))
-    else:
-        flash('You are not an admin!')
-        return redirect(url_for('search_inventory'))
-
-# Allows you to checkout items from your inventory to users
+    deleted = Other.query.filter_by(others_id=ids).first_or_404()
+    Admin.delete_item(deleted)
+    audit_log.info('[Committed by user]: %s Changed to: [Item]: %s was deleted',
+                   current_user.username, deleted.other_item_name)
+    flash('Record Deleted!')
+    return redirect(url_for('search_inventory'))
+
+# Allows you to checkout items from your inventory to users. The scanned tag is resolved
+# through the asset registry, which also knows whether the item is already checked out.
 @app.route('/checkout', methods=['GET', 'POST'])
 @login_required
 def checkout():
     if current_user.is_authenticated:
         form = CheckOutForm(request.form)
-        form.select_field.choices = [(u.employee_id, u.last_name + ',' + u.first_name) for u in Users.query.order_by(Users.last_name).all()]
-        target = request.form.get('select_field')
+        form.select_field.render_kw = {'data-typeahead': url_for('employee_lookup')}
+        target = form.select_field.data
         target1 = form.checkout_asset_tag.data
-        item = Other.query.filter_by(other_asset_tag=target1).first()
+        item = None
         timestamp = datetime.utcnow()
         if form.validate_on_submit():
-            if isinstance(CheckOut.query.filter_by(checkout_asset_tag=target1).first(), CheckOut):
+            entry = asset_registry.find(target1)
+            if entry is None or entry.kind != ITEM_KIND:
+                flash('This item is not in the inventory system!')
+                return redirect(url_for('checkout'))
+
+            elif entry.employee_id is not None:
                 flash('This item is already checked out')
                 return redirect(url_for('checkout'))
 
-            elif isinstance(Other.query.filter_by(other_asset_tag=target1).first(), Other):
+            else:
+                item = Other.query.get(entry.row_id)
                 checked_out = CheckOut(checkout_timestamp=timestamp,
-                                       checkout_username=Users.query.filter_by(employee_id=target).first().username,
+                                       checkout_username=Users.query.get(target).username,
                                        checkout_item_name=item.other_item_name,
                                        checkout_serial_number=item.other_serial_number,
                                        checkout_asset_tag=item.other_asset_tag)
                 db.session.add(checked_out)
+                audit_log.info('[Committed by user]: %s [Item]: %s was checked out to: %s on: %s',
+                               current_user.username, checked_out.checkout_item_name,
+                               checked_out.checkout_username, checked_out.checkout_timestamp)
                 db.session.commit()
-                app.logger.info('[Committed by user]: ' + str(current_user.username) +
-                ' [Item]: ' + str(checked_out.checkout_item_name) +
-                ' was checked out to: ' + str(checked_out.checkout_username) +
-                ' on: ' + str(checked_out.checkout_timestamp))
                 flash('Check out successful!')
                 return redirect(url_for('checkout'))
-            else:
-                flash('This item is not in the inventory system!')
-                return redirect(url_for('checkout'))
 
     return render_template('checkout.html', title='Check Out', form=form, item=item)
 
-# Search items that are checked out to users
+# Checks a burst of scanned tags out to one employee, or back in, in one transaction and
+# lists the result of every tag.
+@app.route('/batch_checkout', methods=['GET', 'POST'])
+@login_required
+def batch_checkout():
+    form = BatchCheckOutForm()
+    form.select_field.render_kw = {'data-typeahead': url_for('employee_lookup')}
+    table = None
+    if form.validate_on_submit():
+        if form.check_out.data:
+            results = checkout_batch_results(form.tags(), Users.query.get(form.select_field.data))
+        else:
+            results = checkin_batch_results(form.tags())
+        table = CheckoutResults(results, border=True)
+    return render_template('batch_checkout.html', title='Batch Check Out', form=form, table=table)
+
+# JSON versions of the batch check out and check in for scanner tools. Check out takes
+# {"employee_id": <id>, "tags": [...]}, check in {"tags": [...]}, and both answer with a
+# status per tag.
+@app.route('/checkouts', methods=['POST'])
+@login_required
+def checkout_batch():
+    data = request.get_json(silent=True)
+    tags = batch_tags(data)
+    if tags is None:
+        return jsonify(error='Expected {{"employee_id": <id>, "tags": [...]}} with at most {} tags'
+                       .format(app.config['CHECKOUT_BATCH_LIMIT'])), 400
+    employee = Users.query.get(data.get('employee_id')) if isinstance(data.get('employee_id'), int) else None
+    if employee is None:
+        return jsonify(error='Unknown employee'), 400
+    return jsonify(results=checkout_batch_results(tags, employee))
+
+@app.route('/checkins', methods=['POST'])
+@login_required
+def checkin_batch():
+    tags = batch_tags(request.get_json(silent=True))
+    if tags is None:
+        return jsonify(error='Expected {{"tags": [...]}} with at most {} tags'
+                       .format(app.config['CHECKOUT_BATCH_LIMIT'])), 400
+    return jsonify(results=checkin_batch_results(tags))
+
+def batch_tags(data):
+    tags = data.get('tags') if isinstance(data, dict) else None
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags) or \
+            len(tags) > app.config['CHECKOUT_BATCH_LIMIT']:
+        return None
+    return tags
+
+def checkout_batch_results(tags, employee):
+    timestamp = datetime.utcnow()
+    results = check_out(tags, employee)
+    checked_out = [result['tag'] for result in results if result['status'] == CHECKOUT_OK]
+    if checked_out:
+        audit_log.info('[Committed by user]: %s [Items]: %s were checked out to: %s on: %s',
+                       current_user.username, checked_out, employee.username, timestamp)
+        db.session.commit()
+    return results
+
+def checkin_batch_results(tags):
+    timestamp = datetime.utcnow()
+    results = check_in(tags)
+    checked_in = [result['tag'] for result in results if result['status'] == CHECKOUT_OK]
+    if checked_in:
+        audit_log.info('[Committed by user]: %s [Items]: %s were checked in on: %s',
+                       current_user.username, checked_in, timestamp)
+        db.session.commit()
+    return results
+
+# Answers "who has tag X" for barcode scanners and other tools with the owning table and row
+# of the tag and the employee currently holding it.
+@app.route('/assets/<string:tag>')
+@login_required
+def asset_holder(tag):
+    entry, employee = asset_registry.holder(tag)
+    if entry is None:
+        return jsonify(error='Unknown asset tag', tag=tag), 404
+    holder = None
+    if employee is not None:
+        holder = {'employee_id': employee.employee_id, 'username': employee.username,
+                  'first_name': employee.first_name, 'last_name': employee.last_name}
+    return jsonify(tag=entry.tag, type=entry.kind, id=entry.row_id, holder=holder)
+
+# Typeahead lookups for the user pickers. Each returns the best matches for the prefix in
+# the q argument as JSON, which the pickers offer as suggestions while typing.
+@app.route('/lookup/employees')
+@login_required
+@db_route()
+def employee_lookup():
+    prefix = request.args.get('q', '').strip()
+    rows = Users.lookup(prefix, app.config['TYPEAHEAD_RESULTS']) if prefix else []
+    return jsonify(results=[{'id': row.employee_id,
+                             'label': '{},{} ({})'.format(row.last_name, row.first_name, row.username)}
+                            for row in rows])
+
+@app.route('/lookup/users')
+@login_required
+@admin_required()
+@db_route()
+def user_lookup():
+    prefix = request.args.get('q', '').strip()
+    rows = User.lookup(prefix, app.config['TYPEAHEAD_RESULTS']) if prefix else []
+    return jsonify(results=[{'id': row.id, 'label': row.username} for row in rows])
+
+# Search items that are checked out to users. Only the open loans are read, through the
+# partial ix_check_out_open_timestamp index.
 @app.route('/search_checkout', methods=['GET', 'POST'])
 @login_required
+@db_route()
+@cached_response(CheckOut)
 def search_checkout():
-    page = request.args.get('page', 1, type=int)
-    results = db.session.query(CheckOut.checkout_timestamp,
-                               CheckOut.checkout_username,
-                               CheckOut.checkout_item_name,
-                               CheckOut.checkout_serial_number,
-                               CheckOut.checkout_asset_tag)\
-        .order_by(CheckOut.checkout_timestamp).paginate(page, app.config['RESULTS_PER_PAGE'], False)
+    results, next_url, prev_url = paginate(
+        db.session.query(CheckOut.check_out_id,
+                         CheckOut.checkout_timestamp,
+                         CheckOut.checkout_username,
+                         CheckOut.checkout_item_name,
+                         CheckOut.checkout_serial_number,
+                         CheckOut.checkout_asset_tag).filter(CheckOut.is_open()),
+        'search_checkout', CheckOut.checkout_timestamp, CheckOut.check_out_id, scope='open')
     table = Checkout(results.items, border=True)
-    next_url = url_for('search_checkout', page=results.next_num) if results.has_next else None
-    prev_url = url_for('search_checkout', page=results.prev_num) if results.has_prev else None
 
     return render_template('search_checkout.html', table=table, title='Search Checkout',
                            next_url=next_url, prev_url=prev_url, results=results)
 
 
+# The checked in loans, newest first, from the ledger and the archive merged into one
+# list. month=YYYY-MM narrows it to the loans checked in that month, which in the archive
+# reads just that period.
+@app.route('/checkout_history')
+@login_required
+@db_route()
+@cached_response(CheckOut, CheckOutArchive)
+def checkout_history():
+    month = request.args.get('month', '')
+    try:
+        start = datetime.strptime(month, '%Y-%m') if month else None
+    except ValueError:
+        start, month = None, ''
+    sources = []
+    for model in (CheckOut, CheckOutArchive):
+        query = db.session.query(model.check_out_id, model.checkout_timestamp, model.checked_in_at,
+                                 model.checkout_username, model.checkout_item_name,
+                                 model.checkout_serial_number, model.checkout_asset_tag)
+        if model is CheckOutArchive and start:
+            query = query.filter(model.period == start.year * 100 + start.month)
+        elif start:
+            end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+            query = query.filter(model.checked_in_at >= start, model.checked_in_at < end)
+        query = query.filter(model.checked_in_at.isnot(None))
+        sources.append((query, model.checked_in_at, model.check_out_id))
+    (query, sort, key), archived = sources
+    results, next_url, prev_url = paginate(query, 'checkout_history', sort, key, reverse=True,
+                                           filters={'month': month}, scope='closed', sources=[archived])
+    table = CheckoutHistory(results.items, border=True)
+    return render_template('checkout_history.html', table=table, title='Checkout History', month=month,
+                           next_url=next_url, prev_url=prev_url, results=results)
+
+
 # This function allows you to check in an item
 @app.route('/checkout/<string:item>', methods=['GET', 'POST'])
 @login_required
 def delete_record(item):
     checkout_timestamp = datetime.utcnow()
-    checkout_user = CheckOut.query.filter_by(checkout_asset_tag=item).first()
-    app.logger.info('[Committed by user]: ' + str(current_user.username) +
-                    ' was checked in for: ' + '[Username]: ' + checkout_user.checkout_username +
-                    ' on: ' + str(checkout_timestamp))
-    CheckOut.query.filter_by(checkout_asset_tag=item).delete()
+    # The open loans are looked up in the ledger itself, through ix_check_out_open_tag, so an
+    # item that was deleted or retagged while out can still be checked in. The flush clears
+    # the holder in the registry.
+    checked_out = CheckOut.query.filter(CheckOut.is_open(), CheckOut.checkout_asset_tag == item).all()
+    if not checked_out:
+        flash('This item is not checked out!')
+        return redirect(url_for('search_checkout'))
+    for checkout_user in checked_out:
+        audit_log.info('[Committed by user]: %s was checked in for: [Username]: %s on: %s',
+                       current_user.username, checkout_user.checkout_username, checkout_timestamp)
+        checkout_user.checked_in_at = checkout_timestamp
     db.session.commit()
     flash('Check in successful!')
     return redirect(url_for('search_checkout'))
@@ -540,15 +718,14 @@ def add_toner():
             inventory = Toner(toner_model=form.toner_model.data,
                             toner_cartridge=form.toner_cartridge.data,
                             toner_color=form.toner_color.data,
-                              toner_quantity=form.toner_quantity.data)
+                              toner_quantity=form.toner_quantity.data,
+                              toner_reorder_threshold=form.toner_reorder_threshold.data)
             db.session.add(inventory)
+            audit_log.info('[Committed by user]: %s Changed to: [Toner Model]: %s [Toner Cartridge]: %s '
+                           '[Toner Color]: %s [Toner Quantity]: %s [Reorder Below]: %s', current_user.username,
+                           inventory.toner_model, inventory.toner_cartridge, inventory.toner_color,
+                           inventory.toner_quantity, inventory.toner_reorder_threshold)
             db.session.commit()
-            app.logger.info(
-                '[Committed by user]: ' + str(current_user.username) + ' Changed to: ' + '[Toner Model]: ' + str(
-                    inventory.toner_model) + ' ' +
-                '[Toner Cartridge]: ' + str(inventory.toner_cartridge) + ' ' +
-                '[Toner Color]: ' + str(inventory.toner_color) + ' ' +
-                '[Toner Quantity]: ' + str(inventory.toner_quantity))
             flash('{} added to inventory'.format(inventory.toner_cartridge))
             return redirect(url_for('add_toner'))
     return render_template('toner.html', title='Import Toner', form=form)
@@ -556,60 +733,212 @@ def add_toner():
 # This allows you to search for a specific toner in the inventory system
 @app.route('/search_toner', methods=['GET', 'POST'])
 @login_required
+@db_route()
+@cached_response(Toner)
 def search_toner():
-    page = request.args.get('page', 1, type=int)
-    results = db.session.query(Toner.toner_id,
-                               Toner.toner_model,
-                               Toner.toner_cartridge,
-                               Toner.toner_color,
-                               Toner.toner_quantity)\
-        .order_by(Toner.toner_model).paginate(page, app.config['RESULTS_PER_PAGE'], False)
+    results, next_url, prev_url = paginate(
+        db.session.query(Toner.toner_id,
+                         Toner.toner_model,
+                         Toner.toner_cartridge,
+                         Toner.toner_color,
+                         Toner.toner_quantity,
+                         Toner.toner_reorder_threshold),
+        'search_toner', Toner.toner_model, Toner.toner_id)
 
     table = TonerInventory(results.items, border=True)
-    next_url = url_for('search_toner', page=results.next_num) if results.has_next else None
-    prev_url = url_for('search_toner', page=results.prev_num) if results.has_prev else None
 
     return render_template('search_toner.html', table=table, title='Search Toner',
                            next_url=next_url, prev_url=prev_url, results=results)
 
-# Allows you to edit a toner item
+# Allows you to edit a toner item. Use the consume and restock buttons to change the
+# quantity while cartridges are being used, the form writes back the whole row.
 @app.route('/edit_toner/<int:ids>', methods=['GET', 'POST'])
 @login_required
-def edit_toner(cartridge):
-    record = Toner.query.filter_by(toner_id=ids).first()
+def edit_toner(ids):
+    record = Toner.query.filter_by(toner_id=ids).first_or_404()
+    form = TonerForm(formdata=request.form, obj=record)
 
-    if record:
-        form = TonerForm(formdata=request.form, obj=record)
+    if form.validate_on_submit():
+        record.toner_model = form.toner_model.data
+        record.toner_cartridge = form.toner_cartridge.data
+        record.toner_color = form.toner_color.data
+        record.toner_quantity = form.toner_quantity.data
+        record.toner_reorder_threshold = form.toner_reorder_threshold.data
+        audit_log.info('[Committed by user]: %s Changed to: [Toner Model]: %s [Toner Cartridge]: %s '
+                       '[Toner Color]: %s [Toner Quantity]: %s [Reorder Below]: %s', current_user.username,
+                       record.toner_model, record.toner_cartridge, record.toner_color, record.toner_quantity,
+                       record.toner_reorder_threshold)
+        db.session.commit()
+        flash('Toner record updated!')
+        return redirect(url_for('search_toner'))
+    return render_template('edit_toner.html', title='Edit Toner', form=form, record=record)
 
+# Uses up or restocks cartridges of a toner with one atomic UPDATE, so the print rooms'
+# changes never overwrite each other. The quantity field defaults to one cartridge.
+@app.route('/toner/<int:ids>/consume', methods=['POST'])
+@login_required
+def consume_toner(ids):
+    return change_toner_stock(ids, -1)
 
-        if form.validate_on_submit():
-            toner = Toner.query.filter_by(toner_ids=ids).first()
-            toner.toner_model = form.toner_model.data
-            toner.toner_cartridge = form.toner_cartridge.data
-            toner.toner_color = form.toner_color.data
-            toner.toner_quantity = form.toner_quantity.data
-            db.session.commit()
-            app.logger.info('[Committed by user]: ' + str(current_user.username) + ' Changed to: ' + '[Toner Model]: ' + str(toner.toner_model) + ' ' +
-                            '[Toner Cartridge]: ' + str(toner.toner_cartridge) + ' ' +
-                            '[Toner Color]: ' + str(toner.toner_color) + ' ' +
-                            '[Toner Quantity]: ' + str(toner.toner_quantity))
-            flash('Toner record updated!')
-            return redirect(url_for('search_toner'))
-        return render_template('edit_toner.html', title='Edit Toner', form=form, record=record)
+@app.route('/toner/<int:ids>/restock', methods=['POST'])
+@login_required
+def restock_toner(ids):
+    return change_toner_stock(ids, 1)
+
+def change_toner_stock(ids, direction):
+    back = url_for(request.form.get('next') if request.form.get('next') in TONER_PAGES else 'search_toner')
+    quantity = request.form.get('quantity', 1, type=int)
+    if quantity is None or quantity < 1:
+        flash('Please enter a quantity of at least one.')
+        return redirect(back)
+    applied, results = adjust_toner([(ids, direction * quantity)])
+    result = results[ids]
+    if not applied:
+        db.session.rollback()
+    if result['status'] == UNKNOWN:
+        abort(404)
+    if not applied:
+        flash('Only {} of this toner left!'.format(result['quantity'] or 0))
+        return redirect(back)
+    audit_log.info('[Committed by user]: %s [Toner]: %s changed by %s to %s', current_user.username,
+                   ids, direction * quantity, result['quantity'])
+    db.session.commit()
+    flash('{} of this toner left'.format(result['quantity']))
+    return redirect(back)
+
+# Adjusts the stock of several toners in one transaction for scripts and print room tools.
+# Takes {"adjustments": [{"id": <toner id>, "change": <cartridges>}, ...]}, negative changes
+# using cartridges up, and answers with each toner's status and quantity. Nothing is
+# applied when a toner is unknown or would go below zero, which is answered with 409.
+@app.route('/toner/adjust', methods=['POST'])
+@login_required
+def adjust_toner_stock():
+    data = request.get_json(silent=True)
+    try:
+        adjustments = [(int(entry['id']), int(entry['change'])) for entry in data['adjustments']]
+    except (KeyError, TypeError, ValueError):
+        adjustments = None
+    if not adjustments:
+        return jsonify(error='Expected {"adjustments": [{"id": <toner id>, "change": <cartridges>}, ...]}'), 400
+    applied, results = adjust_toner(adjustments)
+    if applied:
+        audit_log.info('[Committed by user]: %s [Toner]: adjusted %s', current_user.username,
+                       adjustments)
+        db.session.commit()
+    else:
+        db.session.rollback()
+    return jsonify(applied=applied, results=[dict(result, id=toner_id) for toner_id, result in results.items()]), \
+        200 if applied else 409
+
+# Lists the toners below their reorder threshold, the lowest first. The query is served by
+# the ix_toner_stock_margin index, so it only reads the low rows.
+@app.route('/low_stock')
+@login_required
+@db_route()
+@cached_response(Toner)
+def low_stock():
+    table = LowStock(Toner.low_stock().all(), border=True)
+    return render_template('low_stock.html', table=table, title='Low Toner Stock')
 
 # Delete a toner from the database
 @app.route('/delete_toner/<int:ids>', methods=['GET', 'POST'])
 @login_required
+@admin_required('search_toner')
 def delete_toner(ids):
-    if isinstance(Admin.query.filter_by(user=current_user.username).first(), Admin):
-        admin = Admin.query.filter_by(user=current_user.username).first()
-        deleted = Toner.query.filter_by(toner_id=ids).first()
-        admin.delete_toners(deleted)
-        app.logger.info('[Committed by user]: ' + str(current_user.username) + ' Changed to: ' +
-                        '[Toner Cartridge]: ' + str(deleted.toner_cartridge) + ' was deleted')
+    deleted = Toner.query.filter_by(toner_id=ids).first_or_404()
+    Admin.delete_toners(deleted)
+    audit_log.info('[Committed by user]: %s Changed to: [Toner Cartridge]: %s was deleted',
+                   current_user.username, deleted.toner_cartridge)
+    flash('Record Deleted!')
+    return redirect(url_for('search_toner'))
+
+# Streams a whole dataset (employees, items, checkouts or toner) as a CSV or JSONL download.
+# Add gzip=1 to the query string to have it compressed on the fly.
+@app.route('/export/<string:dataset>')
+@login_required
+@db_route()
+def export_data(dataset):
+    format = request.args.get('format', 'csv')
+    if dataset not in DATASETS or format not in FORMATS:
+        abort(404)
+    compress = request.args.get('gzip', 0, type=int) == 1
+    filename = '{}.{}{}'.format(dataset, format, '.gz' if compress else '')
+    audit_log.info('[Committed by user]: %s exported %s', current_user.username, filename)
+    return Response(stream_with_context(export(dataset, format, compress)),
+                    mimetype='application/gzip' if compress else FORMATS[format],
+                    headers={'Content-Disposition': 'attachment; filename=' + filename})
+
+
+# Lists the audit trail newest first. It can be narrowed to one record by table and id,
+# to the record currently holding an asset tag, or to the changes made by one user.
+@app.route('/audit')
+@login_required
+@admin_required()
+@db_route()
+@cached_response(AuditEvent)
+def audit_events():
+    filters = {'entity': request.args.get('entity'), 'entity_id': request.args.get('entity_id', type=int),
+               'actor': request.args.get('actor'), 'tag': request.args.get('tag')}
+    query = db.session.query(AuditEvent.id, AuditEvent.timestamp, AuditEvent.actor, AuditEvent.action,
+                             AuditEvent.entity, AuditEvent.entity_id, AuditEvent.changes)
+    if filters['tag']:
+        entry = asset_registry.find(filters['tag'])
+        if entry is None:
+            query = query.filter(db.false())
+        else:
+            query = query.filter(AuditEvent.entity == entry.kind, AuditEvent.entity_id == entry.row_id)
+    if filters['entity']:
+        query = query.filter(AuditEvent.entity == filters['entity'])
+    if filters['entity_id'] is not None:
+        query = query.filter(AuditEvent.entity_id == filters['entity_id'])
+    if filters['actor']:
+        query = query.filter(AuditEvent.actor == filters['actor'])
+    results, next_url, prev_url = paginate(query, 'audit_events', AuditEvent.timestamp, AuditEvent.id,
+                                           reverse=True, filters=filters)
+    table = AuditEvents(results.items, border=True)
+    return render_template('audit.html', table=table, title='Audit Trail', filters=filters,
+                           next_url=next_url, prev_url=prev_url, results=results)
+
+# Version 1 of the JSON API for integrations such as the imaging server and the MDM sync.
+# GET returns a page of employees, assets, checkouts or toner as {"data": [...], "next":
+# <cursor>}, see app.api.fetch for the arguments; a nightly sync passes after=<next> until
+# next is null. POST takes {"data": [...]} with at most API_BATCH_LIMIT rows, creates or
+# updates them in one transaction and answers with each row's key. Invalid rows are
+# answered with 400 and a conflict found by the database with 409; in both cases nothing
+# is written.
+@app.route('/api/v1/<resource>', methods=['GET'])
+@login_required
+@db_route()
+def api_list(resource):
+    if resource not in RESOURCES:
+        return api_response({'error': 'Unknown resource'}, 404)
+    try:
+        rows, cursor = fetch(RESOURCES[resource], request.args)
+    except ValueError as e:
+        return api_response({'error': str(e)}, 400)
+    return api_response({'data': rows, 'next': cursor})
+
+@app.route('/api/v1/<resource>', methods=['POST'])
+@login_required
+def api_upsert(resource):
+    if resource not in RESOURCES:
+        return api_response({'error': 'Unknown resource'}, 404)
+    if RESOURCES[resource].form is None:
+        return api_response({'error': 'This resource is read-only'}, 405)
+    data = request.get_json(silent=True)
+    rows = data.get('data') if isinstance(data, dict) else None
+    if not isinstance(rows, list) or len(rows) > app.config['API_BATCH_LIMIT']:
+        return api_response({'error': 'Expected {{"data": [...]}} with at most {} rows'
+                            .format(app.config['API_BATCH_LIMIT'])}, 400)
+    try:
+        results, errors = upsert(RESOURCES[resource], rows)
+        if errors:
+            db.session.rollback()
+            return api_response({'errors': errors}, 400)
+        audit_log.info('[Committed by user]: %s [API]: wrote %s %s rows', current_user.username, len(results),
+                       resource)
         db.session.commit()
-        flash('Record Deleted!')
-        return redirect(url_for('search_toner'))
-    else:
-        flash('You are not an admin!')
-        return redirect(url_for('search_toner'))
+    except IntegrityError:
+        db.session.rollback()
+        return api_response({'error': 'The batch conflicts with stored rows'}, 409)
+    return api_response({'data': results})
@@ -0,0 +1,167 @@
+import re
+from sqlalchemy import event, inspect, select, text
+from sqlalchemy.exc import OperationalError
+from app import app, db
+from app.models import Users, Asset, Other, SearchDocument
+
+# The two kinds of document in the index
+EMPLOYEE = 'employee'
+ITEM = 'item'
+
+# Columns of the devices that are indexed together with the employee they belong to. The
+# first column is the reference back to Users.employee_id.
+DEVICE_FIELDS = [Asset.employee_id, Asset.name, Asset.serial_number, Asset.asset_tag]
+EMPLOYEE_FIELDS = [Users.employee_id, Users.username, Users.first_name, Users.last_name, Users.email,
+                   Users.room_number]
+ITEM_FIELDS = [Asset.asset_id, Asset.name, Asset.serial_number, Asset.asset_tag]
+ITEM_TYPE = Other.__mapper__.polymorphic_identity
+
+# The FTS5 table is an external content index over search_document, kept in step with it by
+# triggers. The prefix option keeps two and three character prefix queries cheap.
+FTS_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+    "body, content='search_document', content_rowid='id', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS search_document_ai AFTER INSERT ON search_document BEGIN "
+    "INSERT INTO search_index(rowid, body) VALUES (new.id, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS search_document_ad AFTER DELETE ON search_document BEGIN "
+    "INSERT INTO search_index(search_index, rowid, body) VALUES ('delete', old.id, old.body); END",
+    "CREATE TRIGGER IF NOT EXISTS search_document_au AFTER UPDATE ON search_document BEGIN "
+    "INSERT INTO search_index(search_index, rowid, body) VALUES ('delete', old.id, old.body); "
+    "INSERT INTO search_index(rowid, body) VALUES (new.id, new.body); END",
+]
+
+FTS_QUERY = text("SELECT search_document.kind, search_document.key FROM search_index "
+                 "JOIN search_document ON search_document.id = search_index.rowid "
+                 "WHERE search_index MATCH :match ORDER BY bm25(search_index) LIMIT :limit")
+
+# How many employees or items are rebuilt per statement during a full reindex
+REINDEX_BATCH = 500
+
+
+def _body(values):
+    return ' '.join(str(value) for value in values if value)
+
+
+# Full text search over employees, their devices and the inventory items. SQLite builds
+# with FTS5 get ranked prefix matching; any other database falls back to LIKE filters on
+# the same documents.
+class SearchIndex(object):
+    def __init__(self):
+        self.fts = None
+
+    # Creates the FTS5 table and triggers the first time the index is used by this process.
+    # An index created over existing documents is filled with the 'rebuild' command.
+    def setup(self, connection):
+        if self.fts is not None:
+            return self.fts
+        self.fts = False
+        if connection.dialect.name == 'sqlite':
+            try:
+                existing = connection.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'search_index'")).first()
+                for statement in FTS_SCHEMA:
+                    connection.execute(text(statement))
+                if existing is None:
+                    connection.execute(text("INSERT INTO search_index(search_index) VALUES ('rebuild')"))
+                self.fts = True
+            except OperationalError:
+                app.logger.warning('SQLite was built without FTS5, search falls back to LIKE')
+        return self.fts
+
+    # Returns the documents of the employees selected by criterion, keyed by employee id.
+    # The criterion is called with each column that refers to an employee.
+    def employee_bodies(self, connection, criterion):
+        values = {}
+        for row in connection.execute(select(EMPLOYEE_FIELDS).where(criterion(Users.employee_id))):
+            values[row[0]] = list(row)
+        for row in connection.execute(select(DEVICE_FIELDS).where(criterion(Asset.employee_id))
+                                      .order_by(Asset.employee_id, Asset.asset_id)):
+            if row[0] in values:
+                values[row[0]].extend(row[1:])
+        return {key: _body(row) for key, row in values.items()}
+
+    def item_bodies(self, connection, criterion):
+        return {row[0]: _body(row) for row in
+                connection.execute(select(ITEM_FIELDS).where(Asset.type == ITEM_TYPE)
+                                   .where(criterion(Asset.asset_id)))}
+
+    def bodies(self, connection, kind, criterion):
+        if kind == EMPLOYEE:
+            return self.employee_bodies(connection, criterion)
+        return self.item_bodies(connection, criterion)
+
+    def insert(self, connection, kind, bodies):
+        if bodies:
+            connection.execute(SearchDocument.__table__.insert(),
+                               [{'kind': kind, 'key': key, 'body': body} for key, body in bodies.items()])
+
+    # Replaces the documents for the given keys. Keys whose row no longer exists are
+    # simply removed from the index.
+    def refresh(self, connection, kind, ids):
+        if not ids:
+            return
+        self.setup(connection)
+        ids = list(ids)
+        table = SearchDocument.__table__
+        connection.execute(table.delete().where(table.c.kind == kind).where(table.c.key.in_(ids)))
+        self.insert(connection, kind, self.bodies(connection, kind, lambda column: column.in_(ids)))
+
+    # Rebuilds every document, walking each table in primary key ranges. Used after bulk
+    # loads that bypass the ORM.
+    def reindex(self):
+        with db.engine.begin() as connection:
+            self.setup(connection)
+            connection.execute(SearchDocument.__table__.delete())
+            for kind, keys in ((EMPLOYEE, select([Users.employee_id]).order_by(Users.employee_id)),
+                               (ITEM, select([Asset.asset_id]).where(Asset.type == ITEM_TYPE)
+                                .order_by(Asset.asset_id))):
+                ids = [row[0] for row in connection.execute(keys)]
+                for start in range(0, len(ids), REINDEX_BATCH):
+                    low, high = ids[start], ids[min(start + REINDEX_BATCH, len(ids)) - 1]
+                    self.insert(connection, kind, self.bodies(
+                        connection, kind, lambda column: column.between(low, high)))
+
+    # Returns up to limit (kind, key) pairs, best match first.
+    def search(self, terms, limit=50):
+        tokens = re.findall(r'\w+', terms.lower())
+        if not tokens:
+            return []
+        connection = db.session.connection()
+        if self.setup(connection):
+            match = ' '.join('"{}"*'.format(token) for token in tokens)
+            rows = connection.execute(FTS_QUERY, match=match, limit=limit)
+        else:
+            query = select([SearchDocument.kind, SearchDocument.key])
+            for token in tokens:
+                query = query.where(SearchDocument.body.ilike('%' + token + '%'))
+            rows = connection.execute(query.order_by(SearchDocument.kind, SearchDocument.key).limit(limit))
+        return [(row[0], row[1]) for row in rows]
+
+
+search_index = SearchIndex()
+
+
+# Returns the previous and current value of an attribute that is part of the flush.
+def _keys(obj, attribute):
+    history = inspect(obj).attrs[attribute].history
+    return [key for key in history.sum() if key is not None] or [getattr(obj, attribute)]
+
+
+# Collects the employees and items touched by a flush and rebuilds their documents on the
+# same connection, so the index commits or rolls back together with the change itself.
+@event.listens_for(db.session, 'after_flush')
+def update_search_index(session, flush_context):
+    employees, items = set(), set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Users):
+            employees.update(_keys(obj, 'employee_id'))
+        elif isinstance(obj, Other):
+            items.update(_keys(obj, 'asset_id'))
+        elif isinstance(obj, Asset):
+            employees.update(_keys(obj, 'employee_id'))
+    employees.discard(None)
+    items.discard(None)
+    if employees or items:
+        connection = session.connection()
+        search_index.refresh(connection, EMPLOYEE, employees)
+        search_index.refresh(connection, ITEM, items)
@@ -0,0 +1,145 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from functools import wraps
+from flask import request, send_from_directory
+from app import app
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# mystyle.css is served as mystyle.<first 12 hex digits of its sha1>.css
+FINGERPRINT = re.compile(r'^(?P<stem>.+)\.(?P<digest>[0-9a-f]{12})(?P<ext>\.[^./]+)$')
+# Pre-compressed copies, best first, as written by "flask inventory compress-static"
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+COMPRESSIBLE = {'.css', '.js', '.map', '.svg', '.json', '.txt', '.html', '.eot', '.ttf'}
+
+
+# The content hashes of the files in the app's and the blueprints' static folders. They
+# are computed at startup; in debug mode a file is hashed again when it changes, so edited
+# stylesheets get a new URL without restarting.
+class StaticManifest(object):
+    def __init__(self, app):
+        self.app = app
+        self.folders = {}
+        self.digests = {}
+
+    def add(self, endpoint, folder):
+        self.folders[endpoint] = folder
+        for root, dirs, files in os.walk(folder):
+            for name in files:
+                self.digest(endpoint, os.path.relpath(os.path.join(root, name), folder).replace(os.sep, '/'))
+
+    def path(self, endpoint, filename):
+        return os.path.join(self.folders[endpoint], *filename.split('/'))
+
+    # Returns the short hash of a static file, or None when there is no such file.
+    def digest(self, endpoint, filename):
+        entry = self.digests.get((endpoint, filename))
+        if entry is not None and not self.app.debug:
+            return entry[1]
+        try:
+            mtime = os.path.getmtime(self.path(endpoint, filename))
+        except OSError:
+            return None
+        if entry is None or entry[0] != mtime:
+            with open(self.path(endpoint, filename), 'rb') as source:
+                entry = (mtime, hashlib.sha1(source.read()).hexdigest()[:12])
+            self.digests[(endpoint, filename)] = entry
+        return entry[1]
+
+    def versioned(self, endpoint, filename):
+        digest = self.digest(endpoint, filename)
+        if digest is None:
+            return filename
+        stem, ext = os.path.splitext(filename)
+        return '{}.{}{}'.format(stem, digest, ext)
+
+    # Splits a requested name into the file it stands for and whether it carries that
+    # file's current hash. Names from pages rendered before a file changed still work.
+    def original(self, endpoint, filename):
+        match = FINGERPRINT.match(filename)
+        if match is None or os.path.isfile(self.path(endpoint, filename)):
+            return filename, False
+        original = match.group('stem') + match.group('ext')
+        return original, self.digest(endpoint, original) == match.group('digest')
+
+    # Writes a gzip copy, and a brotli copy when the brotli package is installed, of every
+    # compressible file. Folders that cannot be written to, such as those of installed
+    # packages, are skipped. Returns the number of files written.
+    def compress(self):
+        written = 0
+        for endpoint, filename in sorted(self.digests):
+            if os.path.splitext(filename)[1] not in COMPRESSIBLE:
+                continue
+            path = self.path(endpoint, filename)
+            with open(path, 'rb') as source:
+                data = source.read()
+            copies = [('.gz', gzip.compress(data, 9))]
+            if brotli is not None:
+                copies.append(('.br', brotli.compress(data)))
+            for suffix, compressed in copies:
+                try:
+                    with open(path + suffix, 'wb') as target:
+                        target.write(compressed)
+                except OSError:
+                    continue
+                written += 1
+        return written
+
+    # The pre-compressed copy of a file the client accepts, as (encoding, filename).
+    def encoded(self, endpoint, filename):
+        accepted = request.accept_encodings
+        for encoding, suffix in ENCODINGS:
+            if not accepted[encoding]:
+                continue
+            try:
+                if os.path.getmtime(self.path(endpoint, filename + suffix)) >= \
+                        os.path.getmtime(self.path(endpoint, filename)):
+                    return encoding, filename + suffix
+            except OSError:
+                continue
+        return None, filename
+
+
+static_manifest = StaticManifest(app)
+
+
+# Serves fingerprinted names with a year-long immutable cache lifetime, from a
+# pre-compressed copy when there is one. Other names are left to Flask's own view.
+def serve_fingerprinted(endpoint, view):
+    @wraps(view)
+    def serve_static(filename):
+        original, current = static_manifest.original(endpoint, filename)
+        if not current:
+            return view(filename=original)
+        encoding, served = static_manifest.encoded(endpoint, original)
+        response = send_from_directory(static_manifest.folders[endpoint], served,
+                                       mimetype=mimetypes.guess_type(original)[0],
+                                       cache_timeout=app.config['STATIC_MAX_AGE'])
+        if encoding:
+            response.content_encoding = encoding
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = 'public, max-age={:d}, immutable'.format(app.config['STATIC_MAX_AGE'])
+        return response
+    return serve_static
+
+
+if app.has_static_folder:
+    static_manifest.add('static', app.static_folder)
+for blueprint in app.blueprints.values():
+    if blueprint.has_static_folder:
+        static_manifest.add(blueprint.name + '.static', blueprint.static_folder)
+for endpoint in static_manifest.folders:
+    app.view_functions[endpoint] = serve_fingerprinted(endpoint, app.view_functions[endpoint])
+
+
+# Makes url_for('static', filename=...) and the blueprints' equivalents return the
+# fingerprinted name, so a changed file is fetched under a new URL.
+@app.url_defaults
+def fingerprint_static_url(endpoint, values):
+    if endpoint in static_manifest.folders and 'filename' in values:
+        values['filename'] = static_manifest.versioned(endpoint, values['filename'])
@@ -0,0 +1,49 @@
+from collections import OrderedDict
+from app import db
+from app.audit import record_events, make_event, UPDATE
+from app.models import Toner
+
+OK, SHORT, UNKNOWN = 'ok', 'short', 'unknown'
+
+
+# Changes the stock of one or more toner cartridges in a single transaction. adjustments
+# is an iterable of (toner_id, change) pairs, negative changes consuming cartridges and
+# positive ones restocking them. Each cartridge costs one atomic
+#     UPDATE toner SET toner_quantity = toner_quantity + :change
+#     WHERE toner_id = :id AND toner_quantity + :change >= 0
+# so concurrent adjustments never lose each other's changes or take stock below zero.
+# When a cartridge is unknown or has too little stock the remaining UPDATEs are skipped and
+# the caller must roll back, since earlier ones may have been applied; otherwise the
+# caller commits. Loaded toners are expired so they read their new quantity. Returns
+# whether the adjustments were applied and, per cartridge, its status and its quantity
+# without the adjustments that failed.
+def adjust_toner(adjustments):
+    changes = OrderedDict()
+    for toner_id, change in adjustments:
+        changes[toner_id] = changes.get(toner_id, 0) + change
+    quantity = db.func.coalesce(Toner.toner_quantity, 0)
+    applied = {}
+    for toner_id, change in changes.items():
+        updated = Toner.query.filter(Toner.toner_id == toner_id, quantity + change >= 0) \
+            .update({Toner.toner_quantity: quantity + change}, synchronize_session=False)
+        if updated == 0:
+            break
+        applied[toner_id] = change
+    for obj in list(db.session.identity_map.values()):
+        if isinstance(obj, Toner) and obj.toner_id in applied:
+            db.session.expire(obj, ['toner_quantity'])
+    stock = dict(db.session.query(Toner.toner_id, Toner.toner_quantity)
+                 .filter(Toner.toner_id.in_(list(changes))))
+    if len(applied) < len(changes):
+        stock = dict((toner_id, value - applied.get(toner_id, 0) if value is not None else None)
+                     for toner_id, value in stock.items())
+        results = OrderedDict((toner_id, {'status': UNKNOWN if toner_id not in stock else
+                                          SHORT if (stock[toner_id] or 0) + change < 0 else OK,
+                                          'quantity': stock.get(toner_id)})
+                              for toner_id, change in changes.items())
+        return False, results
+    record_events(db.session, [make_event(UPDATE, Toner.__tablename__, toner_id,
+                                          {'toner_quantity': [stock[toner_id] - change, stock[toner_id]]})
+                               for toner_id, change in changes.items() if change])
+    return True, OrderedDict((toner_id, {'status': OK, 'quantity': stock[toner_id]})
+                             for toner_id, change in changes.items())
@@ -0,0 +1,147 @@
+from copy import copy
+from flask import has_request_context, request, url_for
+from babel import Locale
+from babel.dates import LC_TIME, format_date, format_datetime
+from flask_table import Table, Col, LinkCol, ButtonCol, DateCol, DatetimeCol
+from flask_table.columns import _recursive_getattr
+from flask_table.html import element
+from markupsafe import escape
+from werkzeug.routing import BuildError
+from werkzeug.urls import url_quote, url_quote_plus
+
+# Stands in for the content of a cell while its markup is rendered once.
+MARKER = 'compiledtablemarker'
+# Route values a link is built with once to find where each row's values go in the URL.
+SENTINEL = 7086421593
+
+
+# Returns a function that reads a column's value from a row the way Flask-Table does:
+# attribute or key lookup along a dotted path, calling the value if it is callable.
+def getter(keys):
+    if len(keys) != 1:
+        return lambda item: _recursive_getattr(item, keys)
+    key = keys[0]
+
+    def get(item):
+        try:
+            value = getattr(item, key)
+        except AttributeError:
+            value = item[key]
+        if callable(value):
+            try:
+                return value()
+            except TypeError:
+                pass
+        return value
+    return get
+
+
+# The URL of a LinkCol or ButtonCol split into the literal text around its url_kwargs,
+# found by building it once with sentinel values. A row's URL is then the literal parts
+# joined with its quoted values, which is what url_for would return, minus the routing.
+# Returns None when the URL cannot be split, for example when the endpoint needs values
+# the column does not provide; the column then calls url_for per row.
+def url_template(col):
+    names = sorted(col._url_kwargs)
+    sentinels = dict((name, SENTINEL + number) for number, name in enumerate(names))
+    try:
+        url = url_for(col.endpoint, **dict(col._url_kwargs_extra, **sentinels))
+    except BuildError:
+        return None
+    query = url.find('?')
+    slots = []
+    for name in names:
+        position = url.find(str(sentinels[name]))
+        if position < 0 or url.count(str(sentinels[name])) != 1:
+            return None
+        in_query = 0 <= query < position
+        slots.append((position, name, in_query))
+    literals, values, start = [], [], 0
+    for position, name, in_query in sorted(slots):
+        literals.append(url[start:position])
+        values.append((getter(col._url_kwargs[name].split('.')), in_query))
+        start = position + len(str(sentinels[name]))
+    literals.append(url[start:])
+    return literals, values
+
+
+def link_url(col, template, item):
+    literals, slots = template
+    parts = [literals[0]]
+    for (get, in_query), literal in zip(slots, literals[1:]):
+        value = get(item)
+        if value is None:
+            return col.url(item)
+        if isinstance(value, int):
+            parts.append(str(value))
+        else:
+            value = value if isinstance(value, str) else str(value)
+            parts.append(url_quote_plus(value) if in_query else url_quote(value))
+        parts.append(literal)
+    return ''.join(parts)
+
+
+def date_formatter(format_value, pattern):
+    locale = Locale.parse(LC_TIME)
+    return lambda value: format_value(value, pattern, locale=locale) if value else ''
+
+
+# Returns the function that renders one column's <td> for a row. Columns that read a
+# value and format it, and links and buttons with a fixed label, get their markup
+# rendered once; any other column is rendered by Flask-Table as before.
+def compile_column(key, col):
+    kind = type(col)
+    attr_list = col.get_attr_list(key)
+    if kind in (LinkCol, ButtonCol) and attr_list is None:
+        marked = copy(col)
+        marked.url = lambda item: MARKER
+        before, after = marked.td(None, key).split(MARKER)
+        template = url_template(col)
+        if template is None:
+            return lambda item: ''.join((before, escape(col.url(item)), after))
+        return lambda item: ''.join((before, escape(link_url(col, template, item)), after))
+    if attr_list and kind.td is Col.td and kind.td_contents is Col.td_contents and \
+            kind.from_attr_list is Col.from_attr_list:
+        opening, closing = element('td', attrs=col.td_html_attrs, content=MARKER).split(MARKER)
+        get = getter(attr_list)
+        formatter = escape if kind.td_format is Col.td_format else col.td_format
+        # Dates are formatted like Flask-Table does, with the locale looked up only once
+        if kind is DatetimeCol:
+            formatter = date_formatter(format_datetime, col.datetime_format)
+        elif kind is DateCol:
+            formatter = date_formatter(format_date, col.date_format)
+
+        def cell(item):
+            value = get(item)
+            return ''.join((opening, formatter('' if value is None else value), closing))
+        return cell
+    return lambda item: col.td(item, key)
+
+
+# A Flask-Table Table whose rows are rendered by compiled columns. Declare columns as
+# usual; the columns are compiled once per table class and URL root, and the output is
+# the same markup Flask-Table produces.
+class CompiledTable(Table):
+    @classmethod
+    def compiled_columns(cls):
+        compiled = cls.__dict__.get('_compiled')
+        if compiled is None:
+            compiled = {}
+            setattr(cls, '_compiled', compiled)
+        root = request.script_root if has_request_context() else None
+        cells = compiled.get(root)
+        if cells is None:
+            cells = [compile_column(key, col) for key, col in cls._cols.items() if col.show]
+            compiled[root] = cells
+        return cells
+
+    def tbody(self):
+        cells = self.compiled_columns()
+        if type(self).get_tr_attrs is Table.get_tr_attrs:
+            rows = [''.join(['<tr>'] + [cell(item) for cell in cells] + ['</tr>']) for item in self.items]
+        else:
+            rows = [element('tr', attrs=self.get_tr_attrs(item), content=''.join([cell(item) for cell in cells]),
+                            escape_content=False) for item in self.items]
+        if not rows:
+            return ''
+        return element('tbody', content='\n{}\n'.format('\n'.join(rows)), escape_content=False)
@@ -1,11 +1,14 @@
-from flask_table import Table, Col, LinkCol, DatetimeCol, ButtonCol
+from flask_table import Col, LinkCol, DatetimeCol, ButtonCol
+from app.table_compiler import CompiledTable
+
+# The tables render their rows through compiled columns, see app/table_compiler.py.
 
 # flask_table that corresponds to the Users class and is joined by the following classes
 # in model.py: Monitors, Desktop, Laptop, Printer, Scanner.
 
 # The Edit attribute in the Results class allows a user to edit the respective table.
 # It uses a url arguments in a dictionary type to match employee ids.
-class Results(Table):
+class Results(CompiledTable):
     classes = ['table', 'table-striped', 'table-bordered', 'table-condensed', 'table-hover']
     id = Col('Id', show=False)
     employee_id = Col('Employee Code')
@@ -17,7 +20,7 @@ class Results(Table):
     edit = LinkCol('View/Edit', 'edit', url_kwargs=dict(id='employee_id'))
     delete = ButtonCol('Delete', 'delete_users', url_kwargs=dict(id='employee_id'))
 
-class Inventory(Table):
+class Inventory(CompiledTable):
     classes = ['table', 'table-striped', 'table-bordered', 'table-condensed', 'table-hover']
     id = Col('Id', show=False)
     other_item_name = Col('Item Name')
@@ -26,7 +29,7 @@ class Inventory(Table):
     edit = LinkCol('Edit', 'edit_inventory', url_kwargs=dict(ids='others_id'))
     delete = ButtonCol('Delete', 'delete_inventory', url_kwargs=dict(ids='others_id'))
 
-class Checkout(Table):
+class Checkout(CompiledTable):
     classes = ['table', 'table-striped', 'table-bordered', 'table-condensed', 'table-hover']
     id = Col('Id', show=False)
     checkout_timestamp = DatetimeCol('Checkout Time',  datetime_format="YYYY-MM-dd")
@@ -36,7 +39,7 @@ class Checkout(Table):
     checkout_asset_tag = Col('Asset Tag')
     check_in = ButtonCol('Check in', 'delete_record', url_kwargs=dict(item='checkout_asset_tag'))
 
-class TonerInventory(Table):
+class TonerInventory(CompiledTable):
     classes = ['table', 'table-striped', 'table-bordered', 'table-condensed', 'table-hover']
     id = Col('Id', show=False)
     toner_model = Col('Printer Model')
@@ -45,4 +48,45 @@ class TonerInventory(Table):
     toner_quantity = Col('Quantity')
     edit = LinkCol('Edit', 'edit_toner', url_kwargs=dict(ids='toner_id'))
     delete = ButtonCol('Delete', 'delete_toner', url_kwargs=dict(ids='toner_id'))
-   
+
+# The outcome of each scanned tag of a batch check out or check in
+class CheckoutResults(CompiledTable):
+    classes = ['table', 'table-striped', 'table-bordered', 'table-condensed', 'table-hover']
+    tag = Col('Asset Tag')
+    status = Col('Result')
+    item = Col('Item')
+
+# Loans that were checked in, newest first, from the ledger and its archive
+class CheckoutHistory(CompiledTable):
+    classes = ['table', 'table-striped', 'table-bordered', 'table-condensed', 'table-hover']
+    id = Col('Id', show=False)
+    checkout_timestamp = DatetimeCol('Checkout Time',  datetime_format="YYYY-MM-dd")
+    checked_in_at = DatetimeCol('Check In Time',  datetime_format="YYYY-MM-dd")
+    checkout_username = Col('Username')
+    checkout_item_name = Col('Item')
+    checkout_serial_number = Col('Serial Number')
+    checkout_asset_tag = Col('Asset Tag')
+
+# Toner below its reorder threshold, with buttons that use up or restock one cartridge
+class LowStock(CompiledTable):
+    classes = ['table', 'table-striped', 'table-bordered', 'table-condensed', 'table-hover']
+    id = Col('Id', show=False)
+    toner_model = Col('Printer Model')
+    toner_cartridge = Col('Cartridge Type')
+    toner_color = Col('Color')
+    toner_quantity = Col('Quantity')
+    toner_reorder_threshold = Col('Reorder Below')
+    consume = ButtonCol('Use One', 'consume_toner', url_kwargs=dict(ids='toner_id'),
+                        form_hidden_fields=dict(next='low_stock'))
+    restock = ButtonCol('Restock One', 'restock_toner', url_kwargs=dict(ids='toner_id'),
+                        form_hidden_fields=dict(next='low_stock'))
+
+class AuditEvents(CompiledTable):
+    classes = ['table', 'table-striped', 'table-bordered', 'table-condensed', 'table-hover']
+    id = Col('Id', show=False)
+    timestamp = DatetimeCol('Time', datetime_format="YYYY-MM-dd HH:mm:ss")
+    actor = Col('User')
+    action = Col('Action')
+    entity = Col('Table')
+    entity_id = Col('Record Id')
+    changes = Col('Changes')
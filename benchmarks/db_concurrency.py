@@ -0,0 +1,106 @@
+# Measures how well page reads keep going while another thread keeps writing, first with
+# the engine as it was set up before (rollback journal, a new connection per checkout)
+# and then with the pool and pragmas from config.py. Each run uses its own scratch
+# database, so the app's database is not touched.
+#
+#     python benchmarks/db_concurrency.py --readers 8 --seconds 10
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from sqlalchemy import create_engine, select, bindparam
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from app import app, db
+from app.database import engine_options, sqlite_pragmas, apply_sqlite_pragmas
+from app.models import Users
+
+
+def build_engine(path, tuned):
+    uri = 'sqlite:///' + path
+    if not tuned:
+        return create_engine(uri)
+    engine = create_engine(uri, **engine_options(dict(app.config, SQLALCHEMY_DATABASE_URI=uri)))
+    apply_sqlite_pragmas(engine, sqlite_pragmas(app.config))
+    return engine
+
+
+def populate(engine, rows):
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(Users.__table__.insert(), [
+            {'employee_id': number, 'username': 'user{}'.format(number), 'first_name': 'First',
+             'last_name': 'Last{}'.format(number), 'email': 'user{}@example.com'.format(number),
+             'room_number': str(number % 500)} for number in range(1, rows + 1)])
+
+
+def run(engine, rows, readers, seconds, batch):
+    table = Users.__table__
+    read = select([table]).where(table.c.employee_id == bindparam('id'))
+    write = table.update().where(table.c.employee_id == bindparam('id')).values(room_number=bindparam('room'))
+    stop = threading.Event()
+    latencies = []
+    errors = []
+    writes = [0]
+
+    def reader():
+        mine = []
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with engine.connect() as connection:
+                    connection.execute(read, id=random.randint(1, rows)).fetchall()
+            except Exception as error:
+                errors.append(error)
+                continue
+            mine.append(time.perf_counter() - started)
+        latencies.extend(mine)
+
+    def writer():
+        while not stop.is_set():
+            try:
+                with engine.begin() as connection:
+                    connection.execute(write, [{'id': random.randint(1, rows), 'room': str(random.randint(1, 999))}
+                                               for _ in range(batch)])
+                writes[0] += 1
+            except Exception as error:
+                errors.append(error)
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)] + [threading.Thread(target=writer)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return {'reads/s': len(latencies) / seconds,
+            'p50 ms': latencies[len(latencies) // 2] * 1000 if latencies else 0,
+            'p99 ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0,
+            'writes/s': writes[0] / seconds,
+            'errors': len(errors)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Read throughput under a concurrent writer, before and after the database tuning.')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--batch', type=int, default=50, help='rows updated per write transaction')
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp()
+    for label, tuned in (('before', False), ('after', True)):
+        engine = build_engine(os.path.join(directory, label + '.db'), tuned)
+        populate(engine, args.rows)
+        result = run(engine, args.rows, args.readers, args.seconds, args.batch)
+        print('{:<7}'.format(label) + '  '.join('{} {:.1f}'.format(name, value) for name, value in result.items()))
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
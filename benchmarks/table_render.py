@@ -0,0 +1,67 @@
+# Measures the time to render 1,000 rows of each list table, first with Flask-Table's
+# own rendering and then with the compiled columns of app/table_compiler.py, and checks
+# that both produce the same markup. The rows are plain objects, so no database is used.
+#
+#     python benchmarks/table_render.py --rows 1000 --repeat 20
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from flask_table import Table
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from app import app
+from app.tables import Results, Inventory, Checkout, TonerInventory, AuditEvents
+
+
+def make_rows(table, count):
+    started = datetime(2019, 1, 1)
+    rows = []
+    for number in range(1, count + 1):
+        values = {}
+        for key, col in table._cols.items():
+            values[key] = number
+            for name in list(getattr(col, '_url_kwargs', {}).values()):
+                values[name] = number if name.endswith('id') else 'TAG & {}'.format(number)
+        for key in ('timestamp', 'checkout_timestamp'):
+            if key in values:
+                values[key] = started + timedelta(minutes=number)
+        for key in values:
+            if isinstance(values[key], int) and not key.endswith('id'):
+                values[key] = 'Value <{}>'.format(number)
+        rows.append(SimpleNamespace(**values))
+    return rows
+
+
+def timed(table, rows, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        html = table(rows, border=True).__html__()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None or elapsed < best else best
+    return best, html
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Table render time per 1,000 rows, Flask-Table and compiled.')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    with app.test_request_context('/'):
+        for table in (Results, Inventory, Checkout, TonerInventory, AuditEvents):
+            rows = make_rows(table, args.rows)
+            plain = type(table.__name__, (Table,), dict(table._cols, classes=table.classes))
+            before, expected = timed(plain, rows, args.repeat)
+            after, html = timed(table, rows, args.repeat)
+            scale = 1000.0 / args.rows * 1000
+            print('{:<15} flask-table {:7.2f} ms  compiled {:7.2f} ms  {:4.1f}x  {}'.format(
+                table.__name__, before * scale, after * scale, before / after,
+                'same markup' if html == expected else 'MARKUP DIFFERS'))
+
+
+if __name__ == '__main__':
+    main()
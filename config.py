@@ -5,12 +5,103 @@ class Config(object):
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'guess-me'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Connection pool of the database. Pre-ping and recycle only apply to server databases
+    # such as PostgreSQL or MySQL.
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE') or 5)
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW') or 10)
+    DATABASE_POOL_PRE_PING = os.environ.get('DATABASE_POOL_PRE_PING') != '0'
+    DATABASE_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE') or 1800)
+    # Comma separated URLs of read replicas of the database. Views marked with db_route()
+    # read from them, unless DATABASE_DEFAULT_ROUTE sends every view there.
+    DATABASE_REPLICA_URLS = [url for url in (os.environ.get('DATABASE_REPLICA_URLS') or '').split(',') if url]
+    DATABASE_DEFAULT_ROUTE = os.environ.get('DATABASE_DEFAULT_ROUTE') or 'primary'
+    # A replica that is missing writes of the primary and whose last replicated write is
+    # older than this many seconds is skipped. Lag is checked at most once per
+    # DATABASE_REPLICA_LAG_CHECK seconds.
+    DATABASE_REPLICA_MAX_LAG = int(os.environ.get('DATABASE_REPLICA_MAX_LAG') or 10)
+    DATABASE_REPLICA_LAG_CHECK = 1
+    # Seconds a user's reads stay on the primary after they wrote something
+    DATABASE_REPLICA_STICKY = 5
+    # Pragmas set on every SQLite connection. In WAL mode readers carry on while a write is
+    # in progress. The busy timeout is in milliseconds, a negative cache size in KiB.
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE') or 'wal'
+    SQLITE_SYNCHRONOUS = 'normal'
+    SQLITE_BUSY_TIMEOUT = 5000
+    SQLITE_CACHE_SIZE = -16000
+    SQLITE_MMAP_SIZE = 134217728
+    SQLITE_TEMP_STORE = 'memory'
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS') is not None
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     ADMINS = ['admin@exmaple.com']
+    # Size in bytes at which the log files are rotated, and how many old files are kept
+    LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES') or 1048576)
+    LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT') or 10)
+    # Outgoing mail waits in a queue of this size for a fixed pool of sending threads
+    MAIL_QUEUE_SIZE = int(os.environ.get('MAIL_QUEUE_SIZE') or 100)
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS') or 2)
+    # Messages a worker sends over one connection before looking at the queue again
+    MAIL_BATCH_SIZE = 20
+    # Seconds a request waits for room in a full queue before the message is dropped
+    MAIL_QUEUE_TIMEOUT = 2
+    # Seconds an idle worker keeps its SMTP connection open
+    MAIL_IDLE_TIMEOUT = 30
+    # Retries of a failed send, waiting MAIL_RETRY_BACKOFF seconds and doubling each time
+    MAIL_RETRIES = 3
+    MAIL_RETRY_BACKOFF = 1.0
+    # Seconds to wait at exit for queued mail to go out
+    MAIL_SHUTDOWN_TIMEOUT = 10
     # This allows you to control how many records are displayed on the page
     RESULTS_PER_PAGE = 10
-    SEND_FILE_MAX_AGE_DEFAULT = 0
+    # 'keyset' pages the list views with cursors, 'offset' with page numbers
+    PAGINATION_MODE = os.environ.get('PAGINATION_MODE') or 'keyset'
+    # How the record totals under the list views are found: 'cached', 'exact' or 'skip'
+    PAGINATION_COUNT = os.environ.get('PAGINATION_COUNT') or 'cached'
+    # Seconds before a cached row count is recomputed from the table
+    ROW_COUNT_TTL = int(os.environ.get('ROW_COUNT_TTL') or 300)
+    # Rendered list pages kept in memory, and the seconds after which a cached page or ETag
+    # is checked again. Set the size to 0 to turn the response cache off.
+    RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE') or 256)
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL') or 60)
+    # The number of best matches shown for a search
+    SEARCH_RESULTS_LIMIT = 50
+    # The number of suggestions offered by the user pickers
+    TYPEAHEAD_RESULTS = 10
+    # The most asset tags one batch check out or check in takes, which keeps each lookup a
+    # single IN (...) list below SQLite's variable limit
+    CHECKOUT_BATCH_LIMIT = 500
+    # Days after check in at which "flask inventory archive-checkouts" moves a loan to the
+    # archive, and the loans moved per transaction
+    CHECKOUT_ARCHIVE_AFTER = int(os.environ.get('CHECKOUT_ARCHIVE_AFTER') or 30)
+    CHECKOUT_ARCHIVE_BATCH = 500
+    # Rows per page of the JSON API, also the most a client may ask for, and the most ids,
+    # tags or rows one API call takes, which keeps each lookup a single IN (...) list
+    API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE') or 1000)
+    API_BATCH_LIMIT = 500
+    # API responses smaller than this many bytes are sent uncompressed
+    API_GZIP_MIN_SIZE = 1024
+    # Seconds between batched audit trail writes. Set to 0 to write on the request instead.
+    AUDIT_FLUSH_INTERVAL = int(os.environ.get('AUDIT_FLUSH_INTERVAL') or 5)
+    # Audit events that trigger a write before the interval is up
+    AUDIT_BATCH_SIZE = 500
+    # Rows written per transaction by the bulk employee import
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE') or 500)
+    # How many rejected rows of an uploaded file are listed on the page
+    IMPORT_ERRORS_SHOWN = 100
+    # Rows fetched from the database and written out at a time by the exports
+    EXPORT_CHUNK_SIZE = 1000
+    # Static files are linked under names carrying a hash of their content, which browsers
+    # may keep for this many seconds. Requests for the plain names are cached for 12 hours.
+    STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE') or 31536000)
+    # last_seen is only rewritten once the stored value is older than this many minutes
+    LAST_SEEN_GRANULARITY = int(os.environ.get('LAST_SEEN_GRANULARITY') or 5)
+    # Seconds between batched last_seen writes. Set to 0 to write on the request instead.
+    LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get('LAST_SEEN_FLUSH_INTERVAL') or 60)
+    # How long, in seconds, and for how many users the admin role lookups are cached
+    ROLE_CACHE_TTL = int(os.environ.get('ROLE_CACHE_TTL') or 300)
+    ROLE_CACHE_SIZE = 1024
+    # The same settings for the users rebuilt by the login manager on every request
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 300)
+    USER_CACHE_SIZE = 4096
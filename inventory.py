@@ -1,5 +1,6 @@
 from app import app, db
-from app.models import User, Admin, Users, Monitors, Desktop, Laptop, Printer, Scanner, Toner, Other, CheckOut
+from app.models import User, Admin, Users, Monitors, Desktop, Laptop, Printer, Scanner, Toner, Other, CheckOut, identity_cache
+from app.email import mail_queue
 
 # This decorator is used for testing out database models.
 @app.shell_context_processor
@@ -7,4 +8,5 @@ def make_shell_context():
     return {'db': db, 'User': User, 'Admin': Admin,
             'Users': Users, 'Monitors': Monitors, 'Desktop': Desktop,
             'Laptop': Laptop, 'Printer': Printer, 'Scanner': Scanner,
-            'Toner': Toner, 'Other': Other, 'CheckOut': CheckOut}
+            'Toner': Toner, 'Other': Other, 'CheckOut': CheckOut,
+            'identity_cache': identity_cache, 'mail_queue': mail_queue}
@@ -0,0 +1,175 @@
+"""Asset table and the tables and indexes added with it, keeping the old device tables
+
+Copy this file into migrations/versions/ to upgrade a database created before the asset
+table; README.md lists the steps. It only adds: the rows are moved by "flask inventory
+migrate-assets" and the old tables dropped by "flask inventory drop-legacy-tables".
+Anything already present is left as it is, so it is safe on a database that was partly
+upgraded by hand or by an autogenerated revision, and does nothing on a new one.
+
+Revision ID: 5a1f0c2d9e7b
+Revises:
+Create Date: 2026-10-18 09:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a1f0c2d9e7b'
+down_revision = None
+branch_labels = ('inventory_assets',)
+depends_on = None
+
+OPEN = 'checked_in_at IS NULL'
+CLOSED = 'checked_in_at IS NOT NULL'
+
+# The added tables, created in this order. asset_tag and search_document come first: the
+# rows moved into the asset table are registered and indexed in them.
+TABLES = [
+    ('asset_tag', lambda: [
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('tag', sa.String(length=40), nullable=True),
+        sa.Column('kind', sa.String(length=10), nullable=True),
+        sa.Column('row_id', sa.Integer(), nullable=True),
+        sa.Column('employee_id', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id')]),
+    ('search_document', lambda: [
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=10), nullable=True),
+        sa.Column('key', sa.Integer(), nullable=True),
+        sa.Column('body', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')]),
+    ('asset', lambda: [
+        sa.Column('asset_id', sa.Integer(), nullable=False),
+        sa.Column('type', sa.String(length=20), nullable=False),
+        sa.Column('name', sa.String(length=40), nullable=True),
+        sa.Column('serial_number', sa.String(length=40), nullable=True),
+        sa.Column('asset_tag', sa.String(length=40), nullable=True),
+        sa.Column('employee_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['employee_id'], ['users.employee_id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('asset_id')]),
+    ('audit_event', lambda: [
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.Column('actor', sa.String(length=64), nullable=True),
+        sa.Column('action', sa.String(length=10), nullable=True),
+        sa.Column('entity', sa.String(length=20), nullable=True),
+        sa.Column('entity_id', sa.Integer(), nullable=True),
+        sa.Column('changes', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')]),
+    ('check_out_archive', lambda: [
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('period', sa.Integer(), nullable=False),
+        sa.Column('check_out_id', sa.Integer(), nullable=True),
+        sa.Column('checkout_timestamp', sa.DateTime(), nullable=True),
+        sa.Column('checkout_username', sa.String(length=40), nullable=True),
+        sa.Column('checkout_item_name', sa.String(length=40), nullable=True),
+        sa.Column('checkout_serial_number', sa.String(length=40), nullable=True),
+        sa.Column('checkout_asset_tag', sa.String(length=40), nullable=True),
+        sa.Column('checked_in_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')]),
+    ('replica_heartbeat', lambda: [
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('beat', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')]),
+]
+
+# The added indexes: name, table, columns or expressions, whether unique, and the
+# condition of a partial index.
+INDEXES = [
+    ('ix_asset_tag_tag', 'asset_tag', ['tag'], True, None),
+    ('ix_asset_tag_kind_row_id', 'asset_tag', ['kind', 'row_id'], False, None),
+    ('ix_asset_tag_employee_id', 'asset_tag', ['employee_id'], False, None),
+    ('ix_search_document_kind_key', 'search_document', ['kind', 'key'], True, None),
+    ('ix_asset_asset_tag', 'asset', ['asset_tag'], False, None),
+    ('ix_asset_serial_number', 'asset', ['serial_number'], False, None),
+    ('ix_asset_type_name', 'asset', ['type', 'name'], False, None),
+    ('ix_asset_employee_id', 'asset', ['employee_id'], False, None),
+    ('ix_audit_event_entity', 'audit_event', ['entity', 'entity_id', 'timestamp'], False, None),
+    ('ix_audit_event_timestamp', 'audit_event', ['timestamp'], False, None),
+    ('ix_audit_event_actor', 'audit_event', ['actor'], False, None),
+    ('ix_check_out_archive_period', 'check_out_archive', ['period', 'checked_in_at', 'check_out_id'], False, None),
+    ('ix_check_out_archive_checked_in_at', 'check_out_archive', ['checked_in_at', 'check_out_id'], False, None),
+    ('ix_check_out_archive_tag', 'check_out_archive', ['checkout_asset_tag'], False, None),
+    ('ix_check_out_open_tag', 'check_out', ['checkout_asset_tag'], False, OPEN),
+    ('ix_check_out_open_timestamp', 'check_out', ['checkout_timestamp', 'check_out_id'], False, OPEN),
+    ('ix_check_out_closed', 'check_out', ['checked_in_at', 'check_out_id'], False, CLOSED),
+    ('ix_admin_user', 'admin', ['user'], False, None),
+    ('ix_users_first_name', 'users', ['first_name'], False, None),
+    ('ix_toner_toner_model', 'toner', ['toner_model'], False, None),
+    ('ix_user_username_lower', 'user', [sa.text('lower(username)')], False, None),
+    ('ix_users_username_lower', 'users', [sa.text('lower(username)')], False, None),
+    ('ix_users_last_name_lower', 'users', [sa.text('lower(last_name)')], False, None),
+    ('ix_users_first_name_lower', 'users', [sa.text('lower(first_name)')], False, None),
+    ('ix_toner_stock_margin', 'toner', [sa.text('coalesce(toner_quantity, 0) - toner_reorder_threshold')],
+     False, None),
+]
+
+
+# The names of the indexes on table. SQLAlchemy does not reflect indexes on expressions,
+# so the catalog is read directly where it can be.
+def _indexes(bind, table):
+    if bind.dialect.name == 'sqlite':
+        query = "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"
+    elif bind.dialect.name == 'postgresql':
+        query = 'SELECT indexname FROM pg_indexes WHERE tablename = :table'
+    else:
+        return set(index['name'] for index in sa.inspect(bind).get_indexes(table))
+    return set(row[0] for row in bind.execute(sa.text(query), table=table))
+
+
+def _columns(inspector, table):
+    return set(column['name'] for column in inspector.get_columns(table))
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    tables = set(inspector.get_table_names())
+    if 'users' not in tables:
+        return
+    for name, columns in TABLES:
+        if name not in tables:
+            op.create_table(name, *columns())
+
+    # check_out becomes a ledger: checking in sets checked_in_at. On SQLite the table is
+    # rebuilt with AUTOINCREMENT, so the id of an archived loan is never given out again.
+    sqlite = bind.dialect.name == 'sqlite'
+    if 'checked_in_at' not in _columns(inspector, 'check_out'):
+        with op.batch_alter_table('check_out', recreate='always' if sqlite else 'auto',
+                                  table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+            batch_op.add_column(sa.Column('checked_in_at', sa.DateTime(), nullable=True))
+    if 'ix_check_out_checkout_timestamp' in _indexes(bind, 'check_out'):
+        op.drop_index('ix_check_out_checkout_timestamp', table_name='check_out')
+    if 'toner_reorder_threshold' not in _columns(inspector, 'toner'):
+        op.add_column('toner', sa.Column('toner_reorder_threshold', sa.Integer(), nullable=False,
+                                         server_default='3'))
+
+    for name, table, columns, unique, where in INDEXES:
+        if name not in _indexes(bind, table):
+            condition = {'sqlite_where': sa.text(where), 'postgresql_where': sa.text(where)} if where else {}
+            op.create_index(name, table, columns, unique=unique, **condition)
+
+
+# Only undoes the schema while nothing was moved into the asset table yet; after that the
+# devices would be lost with it.
+def downgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    tables = set(inspector.get_table_names())
+    if 'asset' in tables and bind.execute(sa.text('SELECT count(*) FROM asset')).scalar():
+        raise RuntimeError('The asset table holds rows, which a downgrade would delete.')
+    for name, table, columns, unique, where in reversed(INDEXES):
+        if table in tables and name in _indexes(bind, table):
+            op.drop_index(name, table_name=table)
+    for name, columns in reversed(TABLES):
+        if name in tables:
+            op.drop_table(name)
+    if 'toner_reorder_threshold' in _columns(inspector, 'toner'):
+        with op.batch_alter_table('toner') as batch_op:
+            batch_op.drop_column('toner_reorder_threshold')
+    if 'checked_in_at' in _columns(inspector, 'check_out'):
+        with op.batch_alter_table('check_out') as batch_op:
+            batch_op.drop_column('checked_in_at')
+        op.create_index('ix_check_out_checkout_timestamp', 'check_out', ['checkout_timestamp'])